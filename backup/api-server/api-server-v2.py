@@ -5,16 +5,38 @@ Dreamle Mining Platform API 服务器 V2
 提供完整的合约数据查询和交易准备服务
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 from web3 import Web3
-import json
 import time
+import gzip
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
 
-app = Flask(__name__, static_folder='.')
+from web3.exceptions import ContractLogicError, BadFunctionCallOutput, Web3RPCError
+from multicall import MulticallBatch, MULTICALL3_ADDRESS, MULTICALL3_ABI, is_call_error
+from rpc_batch import RPCBatch, batch_stats
+from call_aggregator import CallAggregator
+from gas_oracle import GasPriceOracle
+from gas_profile import GasProfiles
+from nonce_manager import NonceManager
+from cache_store import TTLCache, SingleFlight
+from cache_backends import SharedMemoryCache, RedisCache
+from chain_watcher import BlockCursor, LogFollower
+from indexer import ChainIndexer
+from rpc_pool import PooledHTTPProvider
+from rpc_transport import TunedHTTPProvider
+from static_assets import StaticAssets
+from response_format import (
+    format_mining_info, format_miner, format_miners_detail, format_metadata_miners, format_user_miners,
+    format_balances, format_network_stats, format_referral_info,
+    normalize_address, for_address, is_incomplete, data_etag
+)
+
+app = Flask(__name__, static_folder=None)
 CORS(app)
 
 # 配置日志
@@ -26,23 +48,130 @@ logger = logging.getLogger(__name__)
 
 # ==================== 配置 ====================
 
-# BSC 主网配置
-BSC_RPC_URL = 'https://lb.drpc.org/bsc/AqlGpHrYB01Fo1dFtBRULdHcTuavm9wR8L7hwg8TMB_n'
-CHAIN_ID = 56
+from server_config import BSC_RPC_URL, BSC_RPC_URLS, CHAIN_ID, CONTRACT_ADDRESSES
 
-# 合约地址（Mainnet - 2025-09-30 部署）
-CONTRACT_ADDRESSES = {
-    'UNIFIED_SYSTEM': '0xf9462c7fE57Fc7Aff662204228cCdCd0a9d3398A',
-    'DREAMLE_TOKEN': '0x4440409e078D44A63c72696716b84A46814717e9',
-    'USDT_TOKEN': '0x55d398326f99059fF775485246999027B3197955'
-}
+# 预加载部署（serve.py 在 fork worker 之前导入本模块）：后台线程推迟到每个 worker fork 之后启动
+API_PREFORK = os.environ.get('API_PREFORK', '0') == '1'
 
 # 缓存配置
-CACHE_DURATION = 30  # 秒
-cache = {}
+CACHE_DURATION = 30  # 秒（默认TTL）
+CACHE_TTLS = {
+    'network_stats': 30,  # 全网统计
+    'mining_info': 30,    # 用户挖矿数据
+    'miners': 60,         # 矿机列表（仅购买/续费/转让时变化）
+    'balances': 15,       # 代币余额
+    'referral_info': 60   # 推荐信息
+}
+CACHE_MAX_ENTRIES = 10000
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB
+CACHE_SWEEP_INTERVAL = 60  # 秒
+
+# 过期后仍直接返回旧数据并在后台刷新的时间窗口（stale-while-revalidate）
+CACHE_STALE_WHILE_REVALIDATE = 300  # 秒
+# RPC出错时仍可返回旧数据的时间窗口（stale-if-error）
+CACHE_STALE_IF_ERROR = 3600  # 秒
+CACHE_REFRESH_WORKERS = 4
+
+# 缓存后端: 'memory' 进程内，'shm' 同机多进程共享内存，'redis' Redis协议服务器（可跨机器）
+# 多 worker 部署时使用 shm/redis，避免每个进程各自冷启动、RPC负载随进程数倍增
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_SHM_PATH = os.environ.get('CACHE_SHM_PATH', '/dev/shm/dreamle-api-cache')
+CACHE_SHM_SLOTS = 4096
+CACHE_SHM_SLOT_SIZE = 8192  # 字节，超过的条目不进入共享缓存（4096 x 8KB = 32MB）
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://127.0.0.1:6379/0')
+CACHE_REDIS_PREFIX = 'dreamle:cache:'
+
+# 缓存失效模式: 'block' 按新区块失效（TTL仅作上限），'ttl' 仅按时间失效
+CACHE_MODE = 'block'
+CACHE_BLOCK_MAX_AGE = 300  # 秒，按区块失效时条目的最长保留时间
+BLOCK_POLL_INTERVAL = 1.0  # 秒，轮询 eth_blockNumber 的间隔
+BSC_WS_URL = os.environ.get('BSC_WS_URL')  # 配置后通过 eth_subscribe newHeads 接收新区块
+
+# 合约日志驱动的缓存失效：跟踪三个合约的事件，精确失效涉及地址的缓存
+LOG_FOLLOWER_ENABLED = True
+# 仅由事件驱动失效的命名空间；挖矿信息中的待领取收益、有效算力、是否活跃随区块/时间变化而不产生事件，
+# 仍按每个区块失效
+LOG_INVALIDATED_NAMESPACES = ('miners',)
+ADDRESS_CACHE_NAMESPACES = ('mining_info', 'miners', 'balances', 'referral_info')  # 事件发生时清除的命名空间
+CACHE_EVENT_TTL = 300  # 秒，日志跟踪开启后上述命名空间的TTL
+if LOG_FOLLOWER_ENABLED:
+    for namespace in LOG_INVALIDATED_NAMESPACES:
+        CACHE_TTLS[namespace] = CACHE_EVENT_TTL
+
+def make_cache(backend):
+    """按配置创建缓存后端"""
+    options = {
+        'default_ttl': CACHE_DURATION,
+        'namespace_ttls': CACHE_TTLS,
+        'stale_ttl': max(CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR)
+    }
+    if backend == 'shm':
+        return SharedMemoryCache(CACHE_SHM_PATH, slots=CACHE_SHM_SLOTS, slot_size=CACHE_SHM_SLOT_SIZE, **options)
+    if backend == 'redis':
+        return RedisCache(CACHE_REDIS_URL, prefix=CACHE_REDIS_PREFIX, **options)
+    return TTLCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, **options)
+
+cache = make_cache(CACHE_BACKEND)
+logger.info(f"✅ 缓存后端: {CACHE_BACKEND}")
+
+# 本地链上状态索引（SQLite），开启后用户接口优先从索引读取
+INDEXER_ENABLED = os.environ.get('INDEXER_ENABLED', '0') == '1'
+INDEX_DB_PATH = os.environ.get('INDEX_DB_PATH', 'dreamle-index.db')
+INDEX_START_BLOCK = int(os.environ['INDEX_START_BLOCK']) if os.environ.get('INDEX_START_BLOCK') else None  # 默认二分查找部署区块
+INDEX_REORG_DEPTH = 12  # 回滚检测的区块深度
+
+# 请求合并：同一缓存键并发未命中时只回源一次
+SINGLEFLIGHT_TIMEOUT = 10  # 秒，跟随请求等待回源的最长时间
+singleflight = SingleFlight(timeout=SINGLEFLIGHT_TIMEOUT)
+
+# 后台刷新过期缓存
+refresh_executor = ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix='cache-refresh')
+refreshing_keys = set()
+refreshing_lock = threading.Lock()
+
+# RPC节点池：按延迟选择节点，慢请求对冲到第二个节点，连续失败的节点熔断
+RPC_POOL_ENABLED = True
+RPC_HEDGE_MIN = 0.15   # 秒，对冲截止时间下限
+RPC_HEDGE_MAX = 2.0    # 秒，对冲截止时间上限（p95 超过此值时按此值对冲）
+RPC_FAILURE_THRESHOLD = 3  # 连续失败次数达到后熔断
+RPC_CIRCUIT_COOLDOWN = 30  # 秒，熔断后多久半开试探
+
+# RPC HTTP传输：每个节点一个持久连接池，连接数用满时排队复用而不新建连接
+RPC_CONNECTION_POOL_SIZE = 64  # 每个节点的最大连接数
+RPC_CONNECT_TIMEOUT = 3  # 秒
+RPC_READ_TIMEOUT = 10  # 秒
+RPC_METHOD_TIMEOUTS = {
+    'eth_getLogs': 30  # 日志范围查询较慢
+}
+RPC_HTTP2 = False  # 需要安装 httpx[http2]
+
+def make_rpc_provider(url):
+    """创建单个节点的 HTTP Provider"""
+    return TunedHTTPProvider(
+        url,
+        pool_size=RPC_CONNECTION_POOL_SIZE,
+        connect_timeout=RPC_CONNECT_TIMEOUT,
+        read_timeout=RPC_READ_TIMEOUT,
+        method_timeouts=RPC_METHOD_TIMEOUTS,
+        http2=RPC_HTTP2
+    )
 
 # Web3 实例
-w3 = Web3(Web3.HTTPProvider(BSC_RPC_URL))
+if RPC_POOL_ENABLED and len(BSC_RPC_URLS) > 1:
+    rpc_pool = PooledHTTPProvider(
+        BSC_RPC_URLS,
+        provider_factory=make_rpc_provider,
+        hedge_min=RPC_HEDGE_MIN,
+        hedge_max=RPC_HEDGE_MAX,
+        failure_threshold=RPC_FAILURE_THRESHOLD,
+        cooldown=RPC_CIRCUIT_COOLDOWN
+    )
+    rpc_transport = None
+    w3 = Web3(rpc_pool)
+else:
+    rpc_pool = None
+    rpc_transport = make_rpc_provider(BSC_RPC_URL)
+    w3 = Web3(rpc_transport)
 
 # 添加POA中间件（BSC是POA链）
 try:
@@ -56,203 +185,42 @@ except ImportError:
     except:
         pass
 
-# ==================== 加载合约ABI ====================
+# 跨请求合并 eth_call：窗口内不同请求的合约读取合并为一次 Multicall3 调用（可选）
+RPC_MICROBATCH_ENABLED = os.environ.get('RPC_MICROBATCH_ENABLED', '0') == '1'
+RPC_MICROBATCH_WINDOW = 0.01  # 秒，合并窗口（建议 0.005-0.02）
+RPC_MICROBATCH_MAX_CALLS = 50  # 单批达到该调用数时立即发送
+call_aggregator = CallAggregator(
+    w3, window=RPC_MICROBATCH_WINDOW, max_calls=RPC_MICROBATCH_MAX_CALLS
+) if RPC_MICROBATCH_ENABLED else None
+
+def call_contract(contract_function):
+    """合约 view 调用；开启跨请求合并时经由合并器"""
+    if call_aggregator is not None:
+        return call_aggregator.call(contract_function)
+    return contract_function.call()
+
+def read_calls(contract_functions):
+    """
+    一组合约 view 调用，返回 (结果列表, {索引: 异常})，失败的调用结果为 None
+
+    开启跨请求合并时经由合并器（与其他请求的调用共用批次），否则（或调用数超过单批上限时）
+    作为一次 Multicall 执行；此时节点/网络故障整体抛出
+    """
+    if call_aggregator is not None and len(contract_functions) <= RPC_MICROBATCH_MAX_CALLS:
+        outcomes = call_aggregator.call_many(contract_functions)
+        return [r for r, _ in outcomes], {i: e for i, (_, e) in enumerate(outcomes) if e is not None}
+    batch = MulticallBatch(w3)
+    for contract_function in contract_functions:
+        batch.add(contract_function)
+    results = batch.execute()
+    return results, batch.errors
+
+# 区块游标（按区块失效缓存）
+block_cursor = BlockCursor(w3, poll_interval=BLOCK_POLL_INTERVAL, ws_url=BSC_WS_URL)
 
-# 管理员地址
-ADMIN_ADDRESS = '0xfC3b7735Dae4C7AB3Ab85Ffa9987661e795B74b7'
+# ==================== 加载合约ABI ====================
 
-# 加载V18合约ABI
-try:
-    abi_path = os.path.join(os.path.dirname(__file__), 'contract-info', 'UnifiedSystemV19_ABI.json')
-    with open(abi_path, 'r') as f:
-        UNIFIED_SYSTEM_ABI = json.load(f)
-    logger.info(f"✅ 成功加载V18合约ABI，共 {len(UNIFIED_SYSTEM_ABI)} 个函数/事件")
-except Exception as e:
-    logger.warning(f"⚠️ 无法加载ABI文件: {e}，使用内置ABI")
-    UNIFIED_SYSTEM_ABI = [
-    {
-        "inputs": [{"name": "user", "type": "address"}],
-        "name": "userMiningInfo",
-        "outputs": [
-            {"name": "totalHashPower", "type": "uint16"},
-            {"name": "ownHashPower", "type": "uint16"},
-            {"name": "teamHashPower", "type": "uint16"},
-            {"name": "minerCount", "type": "uint32"},
-            {"name": "lastUpdateTime", "type": "uint32"},
-            {"name": "isActive", "type": "bool"}
-        ],
-        "stateMutability": "view",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "user", "type": "address"}],
-        "name": "userMiners",
-        "outputs": [{"name": "", "type": "uint256[]"}],
-        "stateMutability": "view",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "tokenId", "type": "uint256"}],
-        "name": "getMinerInfo",
-        "outputs": [
-            {"name": "level", "type": "uint8"},
-            {"name": "purchaseTime", "type": "uint32"},
-            {"name": "expiryTime", "type": "uint32"},
-            {"name": "isActive", "type": "bool"}
-        ],
-        "stateMutability": "view",
-        "type": "function"
-    },
-    {
-        "inputs": [
-            {"name": "level", "type": "uint8"},
-            {"name": "referrer", "type": "address"}
-        ],
-        "name": "purchaseMinerWithUSDT",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [],
-        "name": "claimRewards",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "usdtAmount", "type": "uint256"}],
-        "name": "exchangeUsdtToDrm",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "drmAmount", "type": "uint256"}],
-        "name": "exchangeDrmToUsdt",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [
-            {"name": "from", "type": "address"},
-            {"name": "to", "type": "address"},
-            {"name": "tokenId", "type": "uint256"}
-        ],
-        "name": "transferFrom",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "tokenId", "type": "uint256"}],
-        "name": "renewMiner",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "tokenIds", "type": "uint256[]"}],
-        "name": "renewMultipleMiners",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "tokenId", "type": "uint256"}],
-        "name": "getRenewalPrice",
-        "outputs": [{"name": "", "type": "uint256"}],
-        "stateMutability": "view",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "tokenIds", "type": "uint256[]"}],
-        "name": "getBatchRenewalPrice",
-        "outputs": [{"name": "", "type": "uint256"}],
-        "stateMutability": "view",
-        "type": "function"
-    },
-    # 管理员功能
-    {
-        "inputs": [{"name": "referrer", "type": "address"}],
-        "name": "addSpecialReferrer",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "referrer", "type": "address"}],
-        "name": "removeSpecialReferrer",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [
-            {"name": "usdtAmount", "type": "uint256"},
-            {"name": "drmAmount", "type": "uint256"}
-        ],
-        "name": "adminInjectLiquidity",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [
-            {"name": "token", "type": "address"},
-            {"name": "amount", "type": "uint256"}
-        ],
-        "name": "adminWithdraw",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [],
-        "name": "emergencyPause",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    },
-    {
-        "inputs": [{"name": "user", "type": "address"}],
-        "name": "updateExpiredMiners",
-        "outputs": [],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }
-]
-
-ERC20_ABI = [
-    {
-        "inputs": [{"name": "account", "type": "address"}],
-        "name": "balanceOf",
-        "outputs": [{"name": "", "type": "uint256"}],
-        "stateMutability": "view",
-        "type": "function"
-    },
-    {
-        "inputs": [
-            {"name": "owner", "type": "address"},
-            {"name": "spender", "type": "address"}
-        ],
-        "name": "allowance",
-        "outputs": [{"name": "", "type": "uint256"}],
-        "stateMutability": "view",
-        "type": "function"
-    },
-    {
-        "inputs": [
-            {"name": "spender", "type": "address"},
-            {"name": "amount", "type": "uint256"}
-        ],
-        "name": "approve",
-        "outputs": [{"name": "", "type": "bool"}],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }
-]
+from server_config import ADMIN_ADDRESS, UNIFIED_SYSTEM_ABI, ERC20_ABI
 
 # 创建合约实例
 unified_contract = w3.eth.contract(
@@ -270,32 +238,351 @@ drm_contract = w3.eth.contract(
     abi=ERC20_ABI
 )
 
+# Multicall3 辅助函数（getEthBalance 等）；链上没有 Multicall3 时批量读取自动换成对应RPC方法
+multicall_contract = w3.eth.contract(
+    address=Web3.to_checksum_address(MULTICALL3_ADDRESS),
+    abi=MULTICALL3_ABI
+)
+
+# ==================== 合约日志跟踪 ====================
+
+def evict_addresses(touched, block):
+    """合约事件涉及的地址：清除其缓存"""
+    evicted = 0
+    for address in touched:
+        for namespace in ADDRESS_CACHE_NAMESPACES:
+            if cache.delete(f'{namespace}_{address}'):
+                evicted += 1
+    if evicted:
+        logger.info(f"🔄 区块 {block}: {len(touched)} 个地址有新事件，清除 {evicted} 条缓存")
+
+unified_address = CONTRACT_ADDRESSES['UNIFIED_SYSTEM']
+transfer_topic = Web3.keccak(text='Transfer(address,address,uint256)')
+approval_topic = Web3.keccak(text='Approval(address,address,uint256)')
+unified_topic = '0x' + '0' * 24 + unified_address[2:].lower()
+
+log_follower = LogFollower(
+    w3,
+    block_cursor,
+    sources=[
+        (unified_address, UNIFIED_SYSTEM_ABI, None),
+        # 授权给统一系统合约的 Approval：清除授权人的余额/授权缓存
+        (CONTRACT_ADDRESSES['DREAMLE_TOKEN'], ERC20_ABI, [
+            [transfer_topic],
+            [approval_topic, None, unified_topic]
+        ]),
+        # USDT转账量极大，只跟踪转入/转出统一系统合约的转账
+        (CONTRACT_ADDRESSES['USDT_TOKEN'], ERC20_ABI, [
+            [transfer_topic, unified_topic],
+            [transfer_topic, None, unified_topic],
+            [approval_topic, None, unified_topic]
+        ])
+    ],
+    on_addresses=evict_addresses,
+    namespaces=LOG_INVALIDATED_NAMESPACES
+)
+
+if LOG_FOLLOWER_ENABLED:
+    block_cursor.set_invalidation(log_follower.invalidation_block)
+
+# ==================== Gas价格 ====================
+
+# Gas价格在后台按区块刷新，准备交易时从内存读取
+GAS_ORACLE_REFRESH_INTERVAL = 3  # 秒，区块游标未运行时的刷新间隔
+GAS_ORACLE_MAX_AGE = 15  # 秒，超过后读取方同步刷新
+GAS_FEE_HISTORY_BLOCKS = 20  # eth_feeHistory 统计区块数（0 表示不计算百分位）
+GAS_FEE_PERCENTILES = (10, 50, 90)  # slow / standard / fast
+
+gas_oracle = GasPriceOracle(
+    w3,
+    cursor=block_cursor if CACHE_MODE == 'block' or LOG_FOLLOWER_ENABLED else None,
+    refresh_interval=GAS_ORACLE_REFRESH_INTERVAL,
+    max_age=GAS_ORACLE_MAX_AGE,
+    fee_history_blocks=GAS_FEE_HISTORY_BLOCKS,
+    percentiles=GAS_FEE_PERCENTILES
+)
+
+# Gas用量画像：同一合约函数的估算结果复用，仅在未命中/过期/漂移时调用 estimate_gas
+# 注意：命中画像时不再通过 estimate_gas 预检交易是否会回滚
+GAS_PROFILE_ENABLED = True
+GAS_PROFILE_MIN_SAMPLES = 3  # 开始使用画像所需的估算次数
+GAS_PROFILE_TTL = 600  # 秒
+GAS_PROFILE_REESTIMATE_EVERY = 50  # 每命中多少次复核一次
+GAS_PROFILE_DRIFT = 0.25  # 复核结果偏离画像中位数超过25%时重新学习
+
+gas_profiles = GasProfiles(
+    min_samples=GAS_PROFILE_MIN_SAMPLES,
+    ttl=GAS_PROFILE_TTL,
+    reestimate_every=GAS_PROFILE_REESTIMATE_EVERY,
+    drift_tolerance=GAS_PROFILE_DRIFT
+) if GAS_PROFILE_ENABLED else None
+
+# ==================== Nonce ====================
+
+# 每个地址首次准备交易时读取链上 pending nonce，宽限期内的后续准备在本地递增分配；后台与链上 pending 状态对账
+NONCE_GRACE_PERIOD = 60  # 秒，距最近一次分配超过该时间时重新读取链上 pending nonce
+NONCE_RECONCILE_INTERVAL = 5  # 秒
+
+nonce_manager = NonceManager(w3, grace=NONCE_GRACE_PERIOD, reconcile_interval=NONCE_RECONCILE_INTERVAL)
+
+# ==================== 链上状态索引 ====================
+
+indexer = None
+if INDEXER_ENABLED:
+    indexer = ChainIndexer(
+        w3,
+        unified_contract,
+        INDEX_DB_PATH,
+        start_block=INDEX_START_BLOCK,
+        reorg_depth=INDEX_REORG_DEPTH,
+        cursor=block_cursor if CACHE_MODE == 'block' or LOG_FOLLOWER_ENABLED else None
+    )
+
+def index_response(data):
+    """从索引返回的响应，附带索引所在区块"""
+    incr_metric('index_reads')
+    response = data_response(data, {'cached': False, 'source': 'index'})
+    response.headers['X-Index-Block'] = str(indexer.processed_block)
+    return response
+
+def index_user_miners(address):
+    """从索引读取用户矿机列表（格式与 load_user_miners 一致）"""
+    current_time = int(time.time())
+    miners = [
+        format_miner(row['token_id'], row['level'], row['hash_power'],
+                     row['purchase_time'], row['expiry_time'], current_time=current_time)
+        for row in indexer.get_miners(address)
+    ]
+    return format_user_miners(address, miners, 'index')
+
 # ==================== 缓存函数 ====================
 
 def get_cache(key):
     """获取缓存"""
-    if key in cache:
-        data, timestamp = cache[key]
-        if time.time() - timestamp < CACHE_DURATION:
-            return data
-    return None
+    return cache.get(key)
 
 def set_cache(key, data):
     """设置缓存"""
-    cache[key] = (data, time.time())
+    cache.set(key, data)
 
-# ==================== 静态文件服务 ====================
+def current_cache_block():
+    """block模式下回源前记录的区块号，游标失联或TTL模式时为None"""
+    if CACHE_MODE == 'block' and block_cursor.is_healthy():
+        return block_cursor.block
+    return None
+
+def store_cache(cache_key, data, block):
+    """写入回源结果，block 为回源前记录的区块号；不完整的结果（incomplete）不写入"""
+    if is_incomplete(data):
+        incr_metric('cache_skipped_incomplete')
+        return
+    if block is not None:
+        cache.set(cache_key, data, ttl=CACHE_BLOCK_MAX_AGE, block=block)
+    else:
+        set_cache(cache_key, data)
+
+def load_and_cache(cache_key, loader):
+    """回源并写入缓存（并发请求合并为一次），返回 (data, shared)"""
+    def load():
+        # 在回源之前记录区块号，回源期间出块则条目在下一次读取时失效
+        block = current_cache_block()
+        data = loader()
+        store_cache(cache_key, data, block)
+        return data
+
+    return singleflight.do(cache_key, load)
+
+def is_fresh(cache_key, stored_at, expires_at, block, now):
+    """判断缓存条目是否新鲜"""
+    if now >= expires_at:
+        return False
+    if block is None:
+        return True
+    if block_cursor.is_healthy():
+        return block_cursor.is_current(cache_key, block)
+    # 区块游标失联时退回按命名空间TTL判断
+    return now - stored_at < cache.ttl_for(cache_key)
+
+def schedule_refresh(cache_key, loader):
+    """在后台线程中刷新缓存，同一个键同时只刷新一次"""
+    with refreshing_lock:
+        if cache_key in refreshing_keys:
+            return
+        refreshing_keys.add(cache_key)
+
+    def refresh():
+        try:
+            load_and_cache(cache_key, loader)
+            incr_metric('cache_background_refreshes')
+        except Exception as e:
+            incr_metric('cache_background_refresh_errors')
+            logger.warning(f"⚠️ 后台刷新缓存失败 {cache_key}: {str(e)}")
+        finally:
+            with refreshing_lock:
+                refreshing_keys.discard(cache_key)
+
+    refresh_executor.submit(refresh)
+
+def cached_value(cache_key, entry, loader, now):
+    """
+    缓存条目可直接返回时返回 (data, meta)，需要回源时返回 None
+
+    过期但在 CACHE_STALE_WHILE_REVALIDATE 内的条目返回旧数据并后台刷新
+    """
+    if entry is None:
+        return None
+    data, stored_at, expires_at, block = entry
+    if is_fresh(cache_key, stored_at, expires_at, block, now):
+        return data, {'cached': True}
+    # 新区块已使条目失效时不返回旧数据，保证出块后读取不过期
+    invalidated_by_block = now < expires_at
+    if not invalidated_by_block and now - expires_at < CACHE_STALE_WHILE_REVALIDATE:
+        schedule_refresh(cache_key, loader)
+        incr_metric('cache_stale_served')
+        return data, {'cached': True, 'stale': True, 'age': int(now - stored_at)}
+    return None
+
+def get_or_load(cache_key, loader, load=None):
+    """
+    读取缓存，返回 (data, meta)，meta 合并到响应中
+
+    - 未过期: 直接返回
+    - 过期但在 CACHE_STALE_WHILE_REVALIDATE 内: 返回旧数据并后台刷新
+    - 已出新区块（block模式）或其他情况: 同步回源（并发请求合并），
+      失败时在 CACHE_STALE_IF_ERROR 内返回旧数据
 
-@app.route('/')
-def index():
-    return send_from_directory('.', 'index.html')
+    load: 同步回源函数，返回 (data, shared)，默认为 load_and_cache(cache_key, loader)
+    """
+    entry = cache.get_entry(cache_key)
+    now = time.time()
+
+    cached = cached_value(cache_key, entry, loader, now)
+    if cached is not None:
+        return cached
 
-@app.route('/<path:path>')
-def serve_static(path):
     try:
-        return send_from_directory('.', path)
-    except:
-        return "File not found", 404
+        if load is not None:
+            data, shared = load()
+        else:
+            data, shared = load_and_cache(cache_key, loader)
+        return data, {'cached': shared}
+    except Exception as e:
+        if entry is not None and now - entry[2] < CACHE_STALE_IF_ERROR:
+            logger.warning(f"⚠️ 回源失败，返回旧缓存 {cache_key}: {str(e)}")
+            incr_metric('cache_stale_if_error')
+            return entry[0], {'cached': True, 'stale': True, 'age': int(now - entry[1])}
+        raise
+
+# ==================== 运行指标 ====================
+
+metrics = {}
+metrics_lock = threading.Lock()
+
+def incr_metric(name, amount=1):
+    """累加运行指标"""
+    with metrics_lock:
+        metrics[name] = metrics.get(name, 0) + amount
+
+def get_metrics():
+    """获取运行指标快照"""
+    with metrics_lock:
+        return dict(metrics)
+
+# ==================== 条件请求与响应压缩 ====================
+
+# 轮询接口（挖矿信息/矿机列表/余额/全网统计）按数据内容返回 ETag（data_etag），数据未变时返回 304
+# 注意：ETag 只取决于数据内容，不含区块号（BSC约3秒出块，含区块号时每次轮询都会变化）
+
+# 较大的 /api/* JSON 响应按 Accept-Encoding 压缩
+API_COMPRESS_MIN_SIZE = 1024  # 字节
+API_GZIP_LEVEL = 6
+API_BROTLI_QUALITY = 5  # 动态响应使用较低压缩级别，压缩耗时远小于传输节省
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def data_response(data, cache_meta):
+    """数据接口响应：带 ETag，请求的 If-None-Match 匹配时返回 304（不序列化响应体）"""
+    etag = data_etag(data)
+    if request.if_none_match.contains_weak(etag):
+        incr_metric('api_not_modified')
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({
+            'success': True,
+            'data': data,
+            **cache_meta
+        })
+    response.set_etag(etag, weak=True)
+    # 浏览器每次轮询都带 If-None-Match 重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.after_request
+def compress_response(response):
+    """压缩较大的 /api/* JSON 响应"""
+    if (not request.path.startswith('/api/')
+            or response.status_code != 200
+            or response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    body = response.get_data()
+    if len(body) < API_COMPRESS_MIN_SIZE:
+        return response
+    if brotli is not None and request.accept_encodings['br']:
+        response.set_data(brotli.compress(body, quality=API_BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=API_GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+    incr_metric('api_compressed_bytes_saved', len(body) - response.content_length)
+    return response
+
+# ==================== 静态文件服务 ====================
+
+# 关闭后 API 进程只处理 /api/*，静态文件由 nginx/CDN 直接提供
+STATIC_SERVING_ENABLED = os.environ.get('STATIC_SERVING_ENABLED', '1') == '1'
+# 站点资源目录（只放 index.html、platform.html、css/、js/、images/ 等对外文件），
+# 不使用工作目录：其中有索引数据库、日志、配置与源码
+STATIC_ROOT = os.environ.get('STATIC_ROOT', 'public')
+STATIC_CACHE_DIR = os.environ.get('STATIC_CACHE_DIR', '/tmp/dreamle-static')  # 预压缩文件目录
+STATIC_COMPRESS_MIN_SIZE = 1024  # 字节，小于该大小不压缩
+STATIC_MAX_SIZE = 8 * 1024 * 1024  # 字节，超过该大小的文件不提供
+STATIC_EXCLUDE_DIRS = ('backup', 'logs', 'node_modules')  # 不提供的顶层目录
+# 索引数据库（及 SQLite 的 WAL/共享内存/日志文件）即使位于资源目录中也不提供
+STATIC_EXCLUDE_FILES = tuple(INDEX_DB_PATH + suffix for suffix in ('', '-wal', '-shm', '-journal'))
+
+static_assets = None
+if STATIC_SERVING_ENABLED:
+    if not os.path.isdir(STATIC_ROOT):
+        logger.warning(f"⚠️ 静态资源目录不存在: {os.path.abspath(STATIC_ROOT)}（设置 STATIC_ROOT 或 STATIC_SERVING_ENABLED=0）")
+    static_assets = StaticAssets(
+        STATIC_ROOT,
+        STATIC_CACHE_DIR,
+        min_size=STATIC_COMPRESS_MIN_SIZE,
+        max_size=STATIC_MAX_SIZE,
+        exclude_dirs=STATIC_EXCLUDE_DIRS,
+        exclude_files=STATIC_EXCLUDE_FILES
+    )
+    static_assets.precompress()
+
+    @app.route('/')
+    def index():
+        return serve_static('index.html')
+
+    @app.route('/<path:path>')
+    def serve_static(path):
+        response = static_assets.send(path)
+        if response is None:
+            return "File not found", 404
+        return response
 
 # ==================== API 端点 ====================
 
@@ -312,54 +599,29 @@ def get_config():
                 'rpcUrl': BSC_RPC_URL,
                 'explorer': 'https://testnet.bscscan.com'
             },
-            'cache_duration': CACHE_DURATION
+            'cache_duration': CACHE_DURATION,
+            'cache_ttls': CACHE_TTLS,
+            'cache_stale_while_revalidate': CACHE_STALE_WHILE_REVALIDATE,
+            'cache_stale_if_error': CACHE_STALE_IF_ERROR,
+            'cache_mode': CACHE_MODE,
+            'cache_backend': CACHE_BACKEND
         }
     })
 
+def load_mining_info(address):
+    """从合约读取用户挖矿信息"""
+    checksum_address = Web3.to_checksum_address(address)
+    mining_info = call_contract(unified_contract.functions.getUserMiningData(checksum_address))
+    return format_mining_info(address, mining_info)
+
 @app.route('/api/user/<address>/mining-info', methods=['GET'])
 def get_user_mining_info(address):
     """获取用户挖矿信息"""
-    cache_key = f'mining_info_{address}'
-    cached_data = get_cache(cache_key)
-    
-    if cached_data:
-        return jsonify({
-            'success': True,
-            'data': cached_data,
-            'cached': True
-        })
-    
     try:
-        checksum_address = Web3.to_checksum_address(address)
-        mining_info = unified_contract.functions.getUserMiningData(checksum_address).call()
-
-        # V19返回值: [totalHashPower, ownHashPower, referralHashPower, totalClaimed,
-        #             totalMined, minerCount, lastUpdateTime, isActive, pendingRewards,
-        #             lockEndTime, validMinerCount, validHashPower]
-        data = {
-            'address': address,
-            'totalHashPower': str(mining_info[0]),
-            'ownHashPower': str(mining_info[1]),
-            'referralHashPower': str(mining_info[2]),
-            'totalClaimed': str(Web3.from_wei(mining_info[3], 'ether')),
-            'totalMined': str(Web3.from_wei(mining_info[4], 'ether')),
-            'minerCount': mining_info[5],
-            'lastUpdateTime': mining_info[6],
-            'isActive': mining_info[7],
-            'pendingRewards': str(Web3.from_wei(mining_info[8], 'ether')),
-            'lockEndTime': mining_info[9],
-            'validMinerCount': mining_info[10],
-            'validHashPower': str(mining_info[11]),
-            'timestamp': int(time.time())
-        }
-        
-        set_cache(cache_key, data)
-        
-        return jsonify({
-            'success': True,
-            'data': data,
-            'cached': False
-        })
+        # 待领取收益、有效算力、是否活跃随时间变化而不产生事件，不从索引读取
+        data, cache_meta = get_address_facet(address, 'mining')
+
+        return data_response(data, cache_meta)
         
     except Exception as e:
         logger.error(f"获取挖矿信息错误: {str(e)}")
@@ -368,63 +630,108 @@ def get_user_mining_info(address):
             'error': str(e)
         }), 500
 
+# 合约是否支持 getUserMinersDetail（None 表示尚未探测）
+MINERS_DETAIL_SUPPORTED = None if any(
+    item.get('name') == 'getUserMinersDetail' for item in UNIFIED_SYSTEM_ABI
+) else False
+
+# 矿机等级 -> 算力（等级配置不变，进程内缓存）
+MINER_LEVELS = range(1, 9)  # 1-8级
+level_hash_power = {}
+
+def get_level_hash_power(levels):
+    """
+    获取各等级算力，未知等级通过一次Multicall批量查询
+
+    任一等级读取失败时抛出该子调用的异常（不能用算力0代替，否则矿机列表会按有效数据缓存）
+    """
+    missing = sorted(set(levels) - set(level_hash_power))
+    if missing:
+        batch = MulticallBatch(w3)
+        for level in missing:
+            batch.add(unified_contract.functions.minerLevels(level))
+        for level, level_info in zip(missing, batch.execute()):
+            # 返回值: [price, hashPower, maxSupply, currentSupply]
+            if level_info is not None:
+                level_hash_power[level] = level_info[1]
+        if batch.errors:
+            index = min(batch.errors)
+            logger.warning(f"⚠️ 读取等级算力失败: level={missing[index]}")
+            raise batch.errors[index]
+    return level_hash_power
+
+def fetch_miners_detail(checksum_address):
+    """主路径: getUserMinersDetail 一次调用返回全部矿机（getUserMinersDetail 返回值）"""
+    return call_contract(unified_contract.functions.getUserMinersDetail(checksum_address))
+
+def fetch_miners_multicall(checksum_address):
+    """兜底路径: getUserMiners + Multicall 批量 getNFTMetadata，返回 (miners, 读取失败的tokenId)"""
+    miner_ids = call_contract(unified_contract.functions.getUserMiners(checksum_address))
+
+    # 所有 getNFTMetadata 调用与区块时间戳合并为一次 Multicall3 调用
+    batch = MulticallBatch(w3)
+    timestamp_index = batch.add_block_timestamp()
+    for miner_id in miner_ids:
+        batch.add(unified_contract.functions.getNFTMetadata(miner_id))
+    results = batch.execute()
+
+    # 使用区块链时间而非系统时间
+    miners, missing = format_metadata_miners(miner_ids, results[timestamp_index + 1:], results[timestamp_index])
+    if missing:
+        logger.warning(f"⚠️ 获取矿机信息失败: tokenId={missing}")
+    return miners, missing
+
+def fetch_user_miners(checksum_address):
+    """获取矿机列表，返回 (miners, source, 读取失败的tokenId)"""
+    global MINERS_DETAIL_SUPPORTED
+
+    if MINERS_DETAIL_SUPPORTED is not False:
+        try:
+            detail = fetch_miners_detail(checksum_address)
+            if MINERS_DETAIL_SUPPORTED is None:
+                MINERS_DETAIL_SUPPORTED = True
+                logger.info("✅ 合约支持 getUserMinersDetail，使用批量查询")
+            try:
+                # detail[1] 为各矿机等级；等级算力读取失败不影响是否支持 getUserMinersDetail
+                miners = format_miners_detail(detail, get_level_hash_power(detail[1]))
+                incr_metric('miners_source_detail')
+                return miners, 'detail', []
+            except Exception as e:
+                logger.warning(f"⚠️ 等级算力读取失败，本次使用兜底路径: {str(e)}")
+                incr_metric('miners_detail_errors')
+        except (ContractLogicError, BadFunctionCallOutput) as e:
+            # 合约没有该函数（回滚或返回空数据）：仅在尚未确认支持时关闭主路径
+            if MINERS_DETAIL_SUPPORTED is None:
+                MINERS_DETAIL_SUPPORTED = False
+                logger.warning(f"⚠️ 合约不支持 getUserMinersDetail，切换到逐个查询: {str(e)}")
+            else:
+                logger.warning(f"⚠️ getUserMinersDetail 调用失败，本次使用兜底路径: {str(e)}")
+        except Exception as e:
+            logger.warning(f"⚠️ getUserMinersDetail 调用失败，本次使用兜底路径: {str(e)}")
+            incr_metric('miners_detail_errors')
+
+    incr_metric('miners_source_multicall')
+    miners, missing = fetch_miners_multicall(checksum_address)
+    return miners, 'multicall', missing
+
+def load_user_miners(address):
+    """从合约读取用户矿机列表"""
+    checksum_address = Web3.to_checksum_address(address)
+    miners, source, missing = fetch_user_miners(checksum_address)
+    # 部分矿机读取失败：返回已读取的部分，但不写入缓存
+    return format_user_miners(address, miners, source, missing)
+
 @app.route('/api/user/<address>/miners', methods=['GET'])
 def get_user_miners(address):
     """获取用户矿机列表"""
-    cache_key = f'miners_{address}'
-    cached_data = get_cache(cache_key)
-    
-    if cached_data:
-        return jsonify({
-            'success': True,
-            'data': cached_data,
-            'cached': True
-        })
-    
     try:
-        checksum_address = Web3.to_checksum_address(address)
-        miner_ids = unified_contract.functions.getUserMiners(checksum_address).call()
-
-        miners = []
-        # 使用区块链时间而非系统时间
-        latest_block = w3.eth.get_block('latest')
-        current_time = latest_block['timestamp']
-
-        for miner_id in miner_ids:
-            # 使用getNFTMetadata获取矿机信息
-            miner_info = unified_contract.functions.getNFTMetadata(miner_id).call()
-            # 返回值: [level, hashPower, purchaseTime, expiryTime]
-            purchase_time = miner_info[2]
-            expiry_time = miner_info[3]
-            is_expired = current_time >= expiry_time
-            remaining_time = max(0, expiry_time - current_time)
-            remaining_days = remaining_time / 86400
-
-            miners.append({
-                'tokenId': int(miner_id),
-                'level': miner_info[0],
-                'hashPower': str(miner_info[1]),
-                'purchaseTime': purchase_time,
-                'expiryTime': expiry_time,
-                'isExpired': is_expired,
-                'remainingTime': remaining_time,
-                'remainingDays': round(remaining_days, 2)
-            })
-        
-        data = {
-            'address': address,
-            'miners': miners,
-            'total_count': len(miners),
-            'timestamp': int(time.time())
-        }
-        
-        set_cache(cache_key, data)
-        
-        return jsonify({
-            'success': True,
-            'data': data,
-            'cached': False
-        })
+        if indexer is not None and indexer.is_ready():
+            Web3.to_checksum_address(address)
+            return index_response(index_user_miners(address))
+
+        data, cache_meta = get_address_facet(address, 'miners')
+
+        return data_response(data, cache_meta)
         
     except Exception as e:
         logger.error(f"获取矿机列表错误: {str(e)}")
@@ -433,49 +740,37 @@ def get_user_miners(address):
             'error': str(e)
         }), 500
 
+def add_balance_reads(batch, checksum_address):
+    """
+    向 RPCBatch 添加余额读取：BNB、USDT、DRM余额及USDT/DRM对统一系统合约的授权额度，
+    返回第一个结果索引（结果依次为 format_balances 的参数）
+    """
+    unified_system = Web3.to_checksum_address(CONTRACT_ADDRESSES['UNIFIED_SYSTEM'])
+    start = batch.add_balance(checksum_address)
+    batch.add_call(usdt_contract.functions.balanceOf(checksum_address))
+    batch.add_call(drm_contract.functions.balanceOf(checksum_address))
+    batch.add_call(usdt_contract.functions.allowance(checksum_address, unified_system))
+    batch.add_call(drm_contract.functions.allowance(checksum_address, unified_system))
+    return start
+
+BALANCE_READS = 5  # add_balance_reads 添加的调用数
+
+def load_balances(address):
+    """从链上读取用户所有代币余额"""
+    checksum_address = Web3.to_checksum_address(address)
+    
+    # 余额与授权额度合并为一次JSON-RPC批量请求
+    batch = RPCBatch(w3)
+    add_balance_reads(batch, checksum_address)
+    return format_balances(address, *batch.execute())
+
 @app.route('/api/user/<address>/balances', methods=['GET'])
 def get_user_balances(address):
     """获取用户所有代币余额"""
-    cache_key = f'balances_{address}'
-    cached_data = get_cache(cache_key)
-    
-    if cached_data:
-        return jsonify({
-            'success': True,
-            'data': cached_data,
-            'cached': True
-        })
-    
     try:
-        checksum_address = Web3.to_checksum_address(address)
-        
-        # 获取BNB余额
-        bnb_balance = w3.eth.get_balance(checksum_address)
-        
-        # 获取USDT余额
-        usdt_balance = usdt_contract.functions.balanceOf(checksum_address).call()
-        
-        # 获取DRM余额
-        drm_balance = drm_contract.functions.balanceOf(checksum_address).call()
-        
-        data = {
-            'address': address,
-            'bnb': str(Web3.from_wei(bnb_balance, 'ether')),
-            'bnb_wei': str(bnb_balance),
-            'usdt': str(Web3.from_wei(usdt_balance, 'ether')),
-            'usdt_wei': str(usdt_balance),
-            'drm': str(Web3.from_wei(drm_balance, 'ether')),
-            'drm_wei': str(drm_balance),
-            'timestamp': int(time.time())
-        }
-        
-        set_cache(cache_key, data)
-        
-        return jsonify({
-            'success': True,
-            'data': data,
-            'cached': False
-        })
+        data, cache_meta = get_address_facet(address, 'balances')
+
+        return data_response(data, cache_meta)
         
     except Exception as e:
         logger.error(f"获取余额错误: {str(e)}")
@@ -484,658 +779,893 @@ def get_user_balances(address):
             'error': str(e)
         }), 500
 
-@app.route('/api/transaction/prepare', methods=['POST'])
-def prepare_transaction():
-    """准备交易数据"""
-    try:
-        data = request.get_json()
-        action = data.get('action')
-        params = data.get('params', {})
-        from_address = data.get('from')
+# 合约是否提供 getReferralInfo（内置ABI不含该函数）
+REFERRAL_INFO_SUPPORTED = any(item.get('name') == 'getReferralInfo' for item in UNIFIED_SYSTEM_ABI)
+
+def load_referral_info(address):
+    """从合约读取用户推荐信息"""
+    checksum_address = Web3.to_checksum_address(address)
+    referral_info = call_contract(unified_contract.functions.getReferralInfo(checksum_address))
+    return format_referral_info(address, referral_info)
 
-        if not from_address:
+@app.route('/api/user/<address>/referral-info', methods=['GET'])
+def get_user_referral_info(address):
+    """获取用户推荐信息"""
+    try:
+        if not REFERRAL_INFO_SUPPORTED:
             return jsonify({
                 'success': False,
-                'error': 'Missing from address'
-            }), 400
+                'error': 'getReferralInfo not available in contract ABI'
+            }), 501
 
-        checksum_address = Web3.to_checksum_address(from_address)
-
-        # 购买矿机
-        if action == 'purchaseMiner':
-            level = params.get('level')
-            # 使用管理员作为默认推荐人，而不是零地址
-            referrer = params.get('referrer', '0xfC3b7735Dae4C7AB3Ab85Ffa9987661e795B74b7')
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.purchaseMinerWithUSDT(
-                level, Web3.to_checksum_address(referrer)
-            ).estimate_gas({'from': checksum_address})
-
-            # 获取Gas价格
-            gas_price = w3.eth.gas_price
-
-            # 构造交易数据
-            purchase_data = unified_contract.functions.purchaseMinerWithUSDT(level, Web3.to_checksum_address(referrer))._encode_transaction_data()
-
-            # 构造交易参数
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': purchase_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+        data, cache_meta = get_address_facet(address, 'referral')
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+        return data_response(data, cache_meta)
 
-        # 授权USDT
-        elif action == 'authorizeUSDT':
-            amount = params.get('amount', '1000000000000000000000000')  # 默认1,000,000 USDT
-
-            # USDT合约的approve方法
-            approve_data = usdt_contract.functions.approve(
-                Web3.to_checksum_address(CONTRACT_ADDRESSES['UNIFIED_SYSTEM']),
-                int(amount)
-            )._encode_transaction_data()
-
-            # 估算Gas
-            gas_estimate = 100000  # approve通常需要约50k-70k gas
-            gas_price = w3.eth.gas_price
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['USDT_TOKEN'],
-                'data': approve_data,
-                'gas': hex(gas_estimate),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+    except Exception as e:
+        logger.error(f"获取推荐信息错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+# ==================== 批量查询 ====================
 
-        # 领取奖励
-        elif action == 'claimRewards':
-            # 估算Gas
-            try:
-                gas_estimate = unified_contract.functions.claimRewards().estimate_gas({'from': checksum_address})
-            except:
-                gas_estimate = 200000  # 默认值
-
-            gas_price = w3.eth.gas_price
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': unified_contract.functions.claimRewards()._encode_transaction_data(),
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+BULK_MAX_ADDRESSES = 500  # 单次批量查询的最大地址数
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+# 地址数据的各个部分: 字段 -> (缓存命名空间, 单地址回源函数)
+ADDRESS_FACETS = {
+    'mining': ('mining_info', load_mining_info),
+    'balances': ('balances', load_balances),
+    'miners': ('miners', load_user_miners)
+}
+if REFERRAL_INFO_SUPPORTED:
+    ADDRESS_FACETS['referral'] = ('referral_info', load_referral_info)
+
+# 本地索引就绪后由索引提供的字段（不再从链上预取）
+INDEXED_FACETS = ('miners',)
+
+def facet_calls(checksum_address, field):
+    """地址字段对应的合约读取（顺序即 format_* 的参数），不支持批量读取的字段返回 None"""
+    if field == 'mining':
+        return [unified_contract.functions.getUserMiningData(checksum_address)]
+    if field == 'balances':
+        unified_system = Web3.to_checksum_address(CONTRACT_ADDRESSES['UNIFIED_SYSTEM'])
+        return [
+            multicall_contract.functions.getEthBalance(checksum_address),
+            usdt_contract.functions.balanceOf(checksum_address),
+            drm_contract.functions.balanceOf(checksum_address),
+            usdt_contract.functions.allowance(checksum_address, unified_system),
+            drm_contract.functions.allowance(checksum_address, unified_system)
+        ]
+    if field == 'miners' and MINERS_DETAIL_SUPPORTED is not False:
+        return [unified_contract.functions.getUserMinersDetail(checksum_address)]
+    if field == 'referral':
+        return [unified_contract.functions.getReferralInfo(checksum_address)]
+    return None
 
-        # 授权DRM
-        elif action == 'authorizeDRM':
-            amount = params.get('amount', '1000000000000000000000000')  # 默认1,000,000 DRM
-
-            # DRM合约的approve方法
-            approve_data = drm_contract.functions.approve(
-                Web3.to_checksum_address(CONTRACT_ADDRESSES['UNIFIED_SYSTEM']),
-                int(amount)
-            )._encode_transaction_data()
-
-            # 估算Gas
-            gas_estimate = 100000  # approve通常需要约50k-70k gas
-            gas_price = w3.eth.gas_price
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['DREAMLE_TOKEN'],
-                'data': approve_data,
-                'gas': hex(gas_estimate),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+def bulk_load(misses):
+    """
+    批量回源 [(address, field)]：所有地址的合约读取合并为尽量少的调用（经由 read_calls），
+    返回 ({(address, field): data}, {(address, field): error})
+
+    各字段互不影响：子调用回滚/无法解码（如合约不支持批量函数）的字段单独回源，
+    整批读取失败时每个字段各自单独回源
+    """
+    calls = []
+    plan = []
+    for address, field in misses:
+        functions = facet_calls(Web3.to_checksum_address(address), field)
+        if functions is None:
+            plan.append((address, field, None))
+            continue
+        plan.append((address, field, range(len(calls), len(calls) + len(functions))))
+        calls.extend(functions)
+
+    results, errors = [], {}
+    if calls:
+        try:
+            results, errors = read_calls(calls)
+        except Exception as e:
+            logger.warning(f"⚠️ 批量回源失败，各字段单独回源: {str(e)}")
+            plan = [(address, field, None) for address, field, _ in plan]
+
+    detail_levels = set()
+    for address, field, indexes in plan:
+        if field == 'miners' and indexes and results[indexes[0]] is not None:
+            detail_levels.update(results[indexes[0]][1])
+    # 等级算力读取失败时，包含未知等级的 miners 字段以该错误失败（不按算力0返回）
+    level_error = None
+    if detail_levels:
+        try:
+            get_level_hash_power(detail_levels)
+        except Exception as e:
+            level_error = e
+
+    loaded = {}
+    failed = {}
+    for address, field, indexes in plan:
+        try:
+            facet_errors = [errors[i] for i in indexes if i in errors] if indexes else []
+            if facet_errors and not all(is_call_error(e) for e in facet_errors):
+                # 节点/网络故障：不再单独回源
+                raise next(e for e in facet_errors if not is_call_error(e))
+            values = [results[i] for i in indexes] if indexes else None
+            if values is None or facet_errors:
+                # 不支持批量读取或子调用失败：单独回源
+                loaded[(address, field)] = ADDRESS_FACETS[field][1](address)
+            elif field == 'mining':
+                loaded[(address, field)] = format_mining_info(address, values[0])
+            elif field == 'balances':
+                loaded[(address, field)] = format_balances(address, *values)
+            elif field == 'referral':
+                loaded[(address, field)] = format_referral_info(address, values[0])
+            else:
+                if level_error is not None and not set(values[0][1]) <= set(level_hash_power):
+                    raise level_error
+                incr_metric('miners_source_detail')
+                loaded[(address, field)] = format_user_miners(
+                    address, format_miners_detail(values[0], level_hash_power), 'detail'
+                )
+        except Exception as e:
+            failed[(address, field)] = e
+    return loaded, failed
+
+@app.route('/api/users/mining-info', methods=['POST'])
+def get_users_mining_info():
+    """
+    批量获取多个地址的数据
+
+    请求: {"addresses": [...], "fields": ["mining", "balances", "miners"]}（fields 默认 ["mining"]）
+    缓存命中的直接返回，未命中的合并为尽量少的RPC请求
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        addresses = body.get('addresses')
+        fields = body.get('fields', ['mining'])
 
+        if not isinstance(addresses, list) or not addresses:
             return jsonify({
-                'success': True,
-                'data': tx_data
-            })
-
-        # USDT兑换DRM
-        elif action == 'exchangeUsdtToDrm':
-            usdt_amount = params.get('usdtAmount')
-            if not usdt_amount:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing usdtAmount parameter'
-                }), 400
-
-            # 估算Gas
-            try:
-                gas_estimate = unified_contract.functions.exchangeUsdtToDrm(
-                    int(usdt_amount)
-                ).estimate_gas({'from': checksum_address})
-            except:
-                gas_estimate = 300000  # 默认值
-
-            gas_price = w3.eth.gas_price
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': unified_contract.functions.exchangeUsdtToDrm(int(usdt_amount))._encode_transaction_data(),
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
-
+                'success': False,
+                'error': 'Missing or invalid addresses parameter (must be array)'
+            }), 400
+        if not all(isinstance(address, str) for address in addresses):
             return jsonify({
-                'success': True,
-                'data': tx_data
-            })
-
-        # DRM兑换USDT
-        elif action == 'exchangeDrmToUsdt':
-            drm_amount = params.get('drmAmount')
-            if not drm_amount:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing drmAmount parameter'
-                }), 400
-
-            # 估算Gas
-            try:
-                gas_estimate = unified_contract.functions.exchangeDrmToUsdt(
-                    int(drm_amount)
-                ).estimate_gas({'from': checksum_address})
-            except:
-                gas_estimate = 300000  # 默认值
-
-            gas_price = w3.eth.gas_price
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': unified_contract.functions.exchangeDrmToUsdt(int(drm_amount))._encode_transaction_data(),
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
-
+                'success': False,
+                'error': 'Invalid addresses parameter (items must be strings)'
+            }), 400
+        if len(addresses) > BULK_MAX_ADDRESSES:
             return jsonify({
-                'success': True,
-                'data': tx_data
-            })
-
-        # 转让矿机
-        elif action == 'transferMiner':
-            token_id = params.get('tokenId')
-            to_address = params.get('toAddress')
+                'success': False,
+                'error': f'Too many addresses (max {BULK_MAX_ADDRESSES})'
+            }), 400
+        if not isinstance(fields, list) or not fields or any(
+            not isinstance(f, str) or f not in ADDRESS_FACETS for f in fields
+        ):
+            return jsonify({
+                'success': False,
+                'error': f'Invalid fields (allowed: {", ".join(ADDRESS_FACETS)})'
+            }), 400
 
-            if not token_id or not to_address:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing tokenId or toAddress parameter'
-                }), 400
+        data = {}
+        errors = {}
+        misses = []
+        hits = 0
+        use_index = indexer is not None and indexer.is_ready()
+        now = time.time()
 
-            # 验证接收地址
-            try:
-                to_checksum = Web3.to_checksum_address(to_address)
-            except:
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid toAddress'
-                }), 400
-
-            # 使用ERC721的transferFrom函数
-            # transferFrom(address from, address to, uint256 tokenId)
-            transfer_data = unified_contract.functions.transferFrom(
-                checksum_address,  # from
-                to_checksum,       # to
-                int(token_id)      # tokenId
-            )._encode_transaction_data()
-
-            # 估算Gas
+        requested = {}  # 请求中的地址写法 -> 规范化地址
+        for address in dict.fromkeys(addresses):
             try:
-                gas_estimate = unified_contract.functions.transferFrom(
-                    checksum_address,
-                    to_checksum,
-                    int(token_id)
-                ).estimate_gas({'from': checksum_address})
-            except Exception as e:
-                logger.error(f'Gas估算失败: {str(e)}')
-                gas_estimate = 150000  # 默认值
-
-            gas_price = w3.eth.gas_price
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': transfer_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+                requested[address] = normalize_address(address)
+            except Exception:
+                errors[address] = {field: 'Invalid address' for field in fields}
+                continue
+            data[address] = {}
+
+        for canonical in dict.fromkeys(requested.values()):
+            for field in fields:
+                if use_index and field == 'miners':
+                    value = index_user_miners(canonical)
+                else:
+                    namespace, loader = ADDRESS_FACETS[field]
+                    cache_key = f'{namespace}_{canonical}'
+                    cached = cached_value(
+                        cache_key, cache.get_entry(cache_key), lambda a=canonical, l=loader: l(a), now
+                    )
+                    if cached is None:
+                        misses.append((canonical, field))
+                        continue
+                    value = cached[0]
+                    hits += 1
+                for address in requested:
+                    if requested[address] == canonical:
+                        data[address][field] = for_address(value, address)
+
+        if misses:
+            block = current_cache_block()
+            loaded, failed = bulk_load(misses)
+            for address, canonical in requested.items():
+                for field in fields:
+                    if (canonical, field) in loaded:
+                        data[address][field] = for_address(loaded[(canonical, field)], address)
+                    elif (canonical, field) in failed:
+                        errors.setdefault(address, {})[field] = str(failed[(canonical, field)])
+            for (canonical, field), value in loaded.items():
+                store_cache(f'{ADDRESS_FACETS[field][0]}_{canonical}', value, block)
+            incr_metric('bulk_loaded', len(misses))
+        incr_metric('bulk_requests')
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+        return jsonify({
+            'success': True,
+            'data': data,
+            'errors': errors,
+            'count': len(data),
+            'cached': hits,
+            'loaded': len(misses)
+        })
 
-        # 续费矿机
-        elif action == 'renewMiner':
-            token_id = params.get('tokenId')
-
-            if not token_id:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing tokenId parameter'
-                }), 400
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.renewMiner(
-                int(token_id)
-            ).estimate_gas({'from': checksum_address})
-
-            # 获取Gas价格
-            gas_price = w3.eth.gas_price
-
-            # 构造交易数据
-            renew_data = unified_contract.functions.renewMiner(int(token_id))._encode_transaction_data()
-
-            # 构造交易参数
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': renew_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+    except Exception as e:
+        logger.error(f"批量查询错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-            logger.info(f"✅ 续费矿机交易已准备: tokenId={token_id}")
+# ==================== 地址数据记录 ====================
+
+def facet_needs_load(canonical, facet, now):
+    """地址的某个字段是否缺失或已不新鲜"""
+    cache_key = f'{ADDRESS_FACETS[facet][0]}_{canonical}'
+    entry = cache.get_entry(cache_key)
+    if entry is None:
+        return True
+    data, stored_at, expires_at, block = entry
+    return not is_fresh(cache_key, stored_at, expires_at, block, now)
+
+def load_address_record(canonical, facet):
+    """
+    回源一个地址的数据记录：请求的字段连同该地址其他缺失/不新鲜的字段合并为一次批量读取，
+    各字段分别写入缓存（各自的TTL与失效规则不变）；返回 ({字段: 数据}, {字段: 异常})
+    """
+    now = time.time()
+    use_index = indexer is not None and indexer.is_ready()
+    facets = [
+        f for f in ADDRESS_FACETS
+        if f == facet or not (use_index and f in INDEXED_FACETS) and facet_needs_load(canonical, f, now)
+    ]
+    block = current_cache_block()
+    loaded, failed = bulk_load([(canonical, f) for f in facets])
+    for (_, f), value in loaded.items():
+        store_cache(f'{ADDRESS_FACETS[f][0]}_{canonical}', value, block)
+    if len(facets) > 1:
+        incr_metric('address_record_prefetched', len(facets) - 1)
+    return {f: v for (_, f), v in loaded.items()}, {f: e for (_, f), e in failed.items()}
+
+def get_address_facet(address, facet):
+    """
+    读取地址数据的一个字段，返回 (data, meta)
+
+    缓存键使用规范化地址；未命中时按地址合并回源（同一地址并发的不同字段请求共用一次回源），
+    页面同时请求挖矿信息/余额/矿机列表时只产生一次上游往返
+    """
+    canonical = normalize_address(address)
+    namespace, loader = ADDRESS_FACETS[facet]
+    cache_key = f'{namespace}_{canonical}'
+
+    def load():
+        (loaded, failed), shared = singleflight.do(
+            f'address_{canonical}', lambda: load_address_record(canonical, facet)
+        )
+        if facet in loaded:
+            return loaded[facet], shared
+        if facet in failed:
+            raise failed[facet]
+        # 加入的是不含该字段的回源（当时该字段仍新鲜）
+        return load_and_cache(cache_key, lambda: loader(canonical))
+
+    data, meta = get_or_load(cache_key, lambda: loader(canonical), load)
+    return for_address(data, address), meta
+
+# ==================== 交易准备 ====================
+
+GAS_MARGIN = 1.2  # 估算Gas的安全系数
+DEFAULT_APPROVE_AMOUNT = '1000000000000000000000000'  # 默认授权 1,000,000 代币
+TX_BATCH_MAX_ACTIONS = 10  # 单次批量准备的最大交易数
+DEPENDENT_STEP_GAS = 500000  # 节点不支持状态覆盖时，依赖前序授权的步骤使用的Gas
+
+# 代币 _allowances 映射的存储槽位，用于批量准备时以状态覆盖模拟前序授权
+# BSC-USD 为 Ownable + BEP20（_owner, _balances, _allowances）；DRM 为 OpenZeppelin ERC20
+TOKEN_ALLOWANCE_SLOTS = {
+    'USDT_TOKEN': 2,
+    'DREAMLE_TOKEN': 1
+}
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+# 节点是否支持 eth_estimateGas/eth_call 的状态覆盖参数（None 表示尚未探测）
+STATE_OVERRIDE_SUPPORTED = None
 
-        # 批量续费矿机
-        elif action == 'renewMultipleMiners':
-            token_ids = params.get('tokenIds')
-
-            if not token_ids or not isinstance(token_ids, list):
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing or invalid tokenIds parameter (must be array)'
-                }), 400
-
-            # 转换为整数数组
-            token_ids_int = [int(tid) for tid in token_ids]
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.renewMultipleMiners(
-                token_ids_int
-            ).estimate_gas({'from': checksum_address})
-
-            # 获取Gas价格
-            gas_price = w3.eth.gas_price
-
-            # 构造交易数据
-            batch_renew_data = unified_contract.functions.renewMultipleMiners(token_ids_int)._encode_transaction_data()
-
-            # 构造交易参数
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': batch_renew_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+class ActionError(Exception):
+    """交易参数错误，status 为HTTP状态码，step 为批量准备中出错的步骤序号"""
 
-            logger.info(f"✅ 批量续费矿机交易已准备: tokenIds={token_ids_int}")
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+        self.step = None
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+def parse_int(name, value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ActionError(f'Invalid {name}')
 
-        # ==================== 管理员功能 ====================
+def parse_address(name, value):
+    try:
+        return Web3.to_checksum_address(value)
+    except Exception:
+        raise ActionError(f'Invalid {name}')
+
+def parse_int_list(name, value):
+    if not value or not isinstance(value, list):
+        raise ActionError(f'Missing or invalid {name} parameter (must be array)')
+    return [parse_int(name, item) for item in value]
+
+# 参数类型 -> 解析函数
+PARAM_PARSERS = {
+    'int': parse_int,
+    'address': parse_address,
+    'int_list': parse_int_list
+}
 
-        # 添加特殊推荐人
-        elif action == 'addSpecialReferrer':
-            referrer_address = params.get('referrerAddress')
+# 合约地址配置名 -> 合约实例
+TX_CONTRACTS = {
+    'UNIFIED_SYSTEM': unified_contract,
+    'USDT_TOKEN': usdt_contract,
+    'DREAMLE_TOKEN': drm_contract
+}
 
-            if not referrer_address:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing referrerAddress parameter'
-                }), 400
+# 交易动作注册表
+#   contract: 目标合约（CONTRACT_ADDRESSES 中的配置名）
+#   function: 合约函数名
+#   params: [(参数名, 类型, 默认值)]，默认值为 None 的参数必填
+#   args: (发送方地址, 解析后的参数) -> 合约函数参数
+#   admin: 仅管理员可用
+#   fixed_gas: 固定Gas（不估算、不乘安全系数）
+#   default_gas: 估算失败时使用的Gas，未设置则估算失败直接报错
+#   log: 准备完成后的日志模板
+#   spend: [(代币, 金额)]，需要授权统一系统合约扣款的代币；金额为 参数 -> 整数 或 读取价格的合约函数
+TX_ACTIONS = {
+    # 购买矿机（默认推荐人为管理员，而不是零地址）
+    # 缺少 level 时与其他动作一致返回 400（改为注册表之前 level=None 在编码calldata时抛出异常，返回 500）
+    'purchaseMiner': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'purchaseMinerWithUSDT',
+        'params': [('level', 'int', None), ('referrer', 'address', ADMIN_ADDRESS)],
+        'args': lambda sender, p: (p['level'], p['referrer']),
+        # minerLevels 返回 [price, hashPower, maxSupply, currentSupply]
+        'spend': [('USDT_TOKEN', lambda p: unified_contract.functions.minerLevels(p['level']))]
+    },
+    # 授权USDT
+    'authorizeUSDT': {
+        'contract': 'USDT_TOKEN',
+        'function': 'approve',
+        'params': [('amount', 'int', DEFAULT_APPROVE_AMOUNT)],
+        'args': lambda sender, p: (Web3.to_checksum_address(CONTRACT_ADDRESSES['UNIFIED_SYSTEM']), p['amount']),
+        'fixed_gas': 100000  # approve通常需要约50k-70k gas
+    },
+    # 领取奖励
+    'claimRewards': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'claimRewards',
+        'params': [],
+        'args': lambda sender, p: (),
+        'default_gas': 200000
+    },
+    # 授权DRM
+    'authorizeDRM': {
+        'contract': 'DREAMLE_TOKEN',
+        'function': 'approve',
+        'params': [('amount', 'int', DEFAULT_APPROVE_AMOUNT)],
+        'args': lambda sender, p: (Web3.to_checksum_address(CONTRACT_ADDRESSES['UNIFIED_SYSTEM']), p['amount']),
+        'fixed_gas': 100000  # approve通常需要约50k-70k gas
+    },
+    # USDT兑换DRM
+    'exchangeUsdtToDrm': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'exchangeUsdtToDrm',
+        'params': [('usdtAmount', 'int', None)],
+        'args': lambda sender, p: (p['usdtAmount'],),
+        'default_gas': 300000,
+        'spend': [('USDT_TOKEN', lambda p: p['usdtAmount'])]
+    },
+    # DRM兑换USDT
+    'exchangeDrmToUsdt': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'exchangeDrmToUsdt',
+        'params': [('drmAmount', 'int', None)],
+        'args': lambda sender, p: (p['drmAmount'],),
+        'default_gas': 300000,
+        'spend': [('DREAMLE_TOKEN', lambda p: p['drmAmount'])]
+    },
+    # 转让矿机（ERC721 transferFrom(from, to, tokenId)）
+    'transferMiner': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'transferFrom',
+        'params': [('tokenId', 'int', None), ('toAddress', 'address', None)],
+        'args': lambda sender, p: (sender, p['toAddress'], p['tokenId']),
+        'default_gas': 150000
+    },
+    # 续费矿机
+    'renewMiner': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'renewMiner',
+        'params': [('tokenId', 'int', None)],
+        'args': lambda sender, p: (p['tokenId'],),
+        'spend': [('USDT_TOKEN', lambda p: unified_contract.functions.getRenewalPrice(p['tokenId']))],
+        'log': '✅ 续费矿机交易已准备: tokenId={tokenId}'
+    },
+    # 批量续费矿机
+    'renewMultipleMiners': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'renewMultipleMiners',
+        'params': [('tokenIds', 'int_list', None)],
+        'args': lambda sender, p: (p['tokenIds'],),
+        'spend': [('USDT_TOKEN', lambda p: unified_contract.functions.getBatchRenewalPrice(p['tokenIds']))],
+        'log': '✅ 批量续费矿机交易已准备: tokenIds={tokenIds}'
+    },
 
-            # 验证是否为管理员
-            if checksum_address.lower() != ADMIN_ADDRESS.lower():
-                return jsonify({
-                    'success': False,
-                    'error': 'Only admin can perform this action'
-                }), 403
+    # ==================== 管理员功能 ====================
 
-            # 验证推荐人地址
-            try:
-                referrer_checksum = Web3.to_checksum_address(referrer_address)
-            except:
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid referrerAddress'
-                }), 400
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.addSpecialReferrer(
-                referrer_checksum
-            ).estimate_gas({'from': checksum_address})
-
-            gas_price = w3.eth.gas_price
-
-            # 构造交易数据
-            add_referrer_data = unified_contract.functions.addSpecialReferrer(referrer_checksum)._encode_transaction_data()
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': add_referrer_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+    # 添加特殊推荐人
+    'addSpecialReferrer': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'addSpecialReferrer',
+        'params': [('referrerAddress', 'address', None)],
+        'args': lambda sender, p: (p['referrerAddress'],),
+        'admin': True,
+        'log': '✅ 添加特殊推荐人交易已准备: referrer={referrerAddress}'
+    },
+    # 移除特殊推荐人
+    'removeSpecialReferrer': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'removeSpecialReferrer',
+        'params': [('referrerAddress', 'address', None)],
+        'args': lambda sender, p: (p['referrerAddress'],),
+        'admin': True,
+        'log': '✅ 移除特殊推荐人交易已准备: referrer={referrerAddress}'
+    },
+    # 注入流动性
+    'adminInjectLiquidity': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'adminInjectLiquidity',
+        'params': [('usdtAmount', 'int', None), ('drmAmount', 'int', None)],
+        'args': lambda sender, p: (p['usdtAmount'], p['drmAmount']),
+        'spend': [('USDT_TOKEN', lambda p: p['usdtAmount']), ('DREAMLE_TOKEN', lambda p: p['drmAmount'])],
+        'admin': True,
+        'log': '✅ 注入流动性交易已准备: USDT={usdtAmount}, DRM={drmAmount}'
+    },
+    # 管理员提取
+    'adminWithdraw': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'adminWithdraw',
+        'params': [('tokenAddress', 'address', None), ('amount', 'int', None)],
+        'args': lambda sender, p: (p['tokenAddress'], p['amount']),
+        'admin': True,
+        'log': '✅ 管理员提取交易已准备: token={tokenAddress}, amount={amount}'
+    },
+    # 紧急暂停
+    'emergencyPause': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'emergencyPause',
+        'params': [],
+        'args': lambda sender, p: (),
+        'admin': True,
+        'log': '✅ 紧急暂停交易已准备'
+    },
+    # 更新过期矿机
+    'updateExpiredMiners': {
+        'contract': 'UNIFIED_SYSTEM',
+        'function': 'updateExpiredMiners',
+        'params': [('userAddress', 'address', None)],
+        'args': lambda sender, p: (p['userAddress'],),
+        'log': '✅ 更新过期矿机交易已准备: user={userAddress}'
+    }
+}
 
-            logger.info(f"✅ 添加特殊推荐人交易已准备: referrer={referrer_checksum}")
+def parse_action_params(spec, checksum_address, params):
+    """按动作的参数表校验并转换参数：必填检查 -> 管理员检查 -> 类型转换"""
+    schema = spec['params']
+    required = [name for name, kind, default in schema if default is None and kind != 'int_list']
+    if any(not params.get(name) for name in required):
+        raise ActionError(f"Missing {' or '.join(required)} parameter")
+
+    if spec.get('admin') and checksum_address.lower() != ADMIN_ADDRESS.lower():
+        raise ActionError('Only admin can perform this action', 403)
+
+    values = {}
+    for name, kind, default in schema:
+        value = params.get(name, default)
+        values[name] = PARAM_PARSERS[kind](name, value)
+    return values
+
+def allowance_override(step, owner):
+    """授权步骤对应的状态覆盖：{代币地址: {存储槽: 授权额度}}，代币槽位未配置时返回 None"""
+    slot = TOKEN_ALLOWANCE_SLOTS.get(step['spec']['contract'])
+    if slot is None:
+        return None
+    spender, amount = step['function'].args
+    owner_slot = Web3.keccak(bytes.fromhex(owner[2:].rjust(64, '0')) + slot.to_bytes(32, 'big'))
+    storage_key = Web3.keccak(bytes.fromhex(spender[2:].rjust(64, '0')) + owner_slot)
+    return {
+        Web3.to_checksum_address(CONTRACT_ADDRESSES[step['spec']['contract']]): {
+            'stateDiff': {Web3.to_hex(storage_key): '0x' + amount.to_bytes(32, 'big').hex()}
+        }
+    }
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+def prepare_step(action, checksum_address, params):
+    """校验单个动作的参数并编码 calldata（只编码一次，估算Gas与交易数据共用）"""
+    spec = TX_ACTIONS[action]
+    values = parse_action_params(spec, checksum_address, params or {})
+    contract_function = getattr(TX_CONTRACTS[spec['contract']].functions, spec['function'])(
+        *spec['args'](checksum_address, values)
+    )
+    return {
+        'spec': spec,
+        'values': values,
+        'function': contract_function,
+        'calldata': contract_function._encode_transaction_data()
+    }
 
-        # 移除特殊推荐人
-        elif action == 'removeSpecialReferrer':
-            referrer_address = params.get('referrerAddress')
+def state_override_unsupported(error):
+    """节点拒绝状态覆盖参数（参数个数或格式错误），而不是交易在状态覆盖下回滚"""
+    if isinstance(error, ContractLogicError) or not isinstance(error, Web3RPCError):
+        return False
+    rpc_error = (error.rpc_response or {}).get('error') or {}
+    message = str(error).lower()
+    return rpc_error.get('code') in (-32601, -32602) or any(
+        word in message for word in ('override', 'argument', 'param')
+    )
 
-            if not referrer_address:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing referrerAddress parameter'
-                }), 400
+def failed_step_gas(index, step, error, overridden):
+    """
+    估算或回滚检查失败的步骤使用的Gas（未乘安全系数；画像命中的步骤只做回滚检查，返回时仍使用画像中的Gas）
+
+    配置了 default_gas 的步骤使用 default_gas；附带状态覆盖（依赖前序授权）的步骤仅在节点不支持状态覆盖时
+    使用 DEPENDENT_STEP_GAS。其余失败（包括状态覆盖生效后仍回滚）抛出 ActionError，step 为出错的步骤序号
+    """
+    global STATE_OVERRIDE_SUPPORTED
+
+    spec = step['spec']
+    if 'default_gas' in spec:
+        return spec['default_gas']
+    if overridden and state_override_unsupported(error):
+        if STATE_OVERRIDE_SUPPORTED is None:
+            STATE_OVERRIDE_SUPPORTED = False
+            logger.warning(f"⚠️ RPC节点不支持状态覆盖，依赖授权的步骤使用回退Gas: {str(error)}")
+        return DEPENDENT_STEP_GAS
+    if not is_call_error(error):
+        raise error
+    logger.warning(f"⚠️ 交易步骤 {index} ({spec['function']}) 将回滚: {str(error)}")
+    action_error = ActionError(str(error), 500)
+    action_error.step = index
+    raise action_error
+
+def fetch_tx_params(checksum_address, steps):
+    """
+    获取各步骤的 (gas列表, gasPrice, 起始nonce)
+
+    gasPrice 取自Gas价格预言机（所有步骤共用），gas估算优先取自Gas用量画像（命中时仍以 eth_call 检查回滚），
+    nonce 由nonce管理器在本地连续分配，地址没有宽限期内的分配记录时才读取链上 pending nonce；
+    估算、回滚检查与nonce读取合并为一次JSON-RPC批量请求。
+    前序步骤为授权时，后续步骤的估算附带状态覆盖模拟授权已生效；失败的步骤见 failed_step_gas。
+    """
+    global STATE_OVERRIDE_SUPPORTED
+
+    gases = [None] * len(steps)
+
+    batch = RPCBatch(w3)
+    checks = []  # (步骤序号, 批量结果索引, 画像键, 是否为估算, 是否附带状态覆盖)
+    overrides = {}
+    for i, step in enumerate(steps):
+        spec = step['spec']
+        state_override = dict(overrides) or None
+        if 'fixed_gas' in spec:
+            gases[i] = spec['fixed_gas']
+        elif state_override and STATE_OVERRIDE_SUPPORTED is False:
+            # 无法模拟前序授权：依赖授权的步骤不估算
+            gases[i] = int(spec.get('default_gas', DEPENDENT_STEP_GAS) * GAS_MARGIN)
+        else:
+            profile_key = None
+            profiled = None
+            if gas_profiles is not None:
+                profile_key = gas_profiles.key_for(step['function'])
+                profiled = gas_profiles.lookup(profile_key)
+            # 失败的子调用在批量请求完成后按步骤处理
+            if profiled is not None:
+                # 画像命中省去估算，但仍以 eth_call 模拟执行：余额/授权不足等按用户回滚的交易照常报错
+                gases[i] = int(profiled * GAS_MARGIN)
+                index = batch.add_simulate(
+                    step['function'], {'from': checksum_address},
+                    allow_failure=True, data=step['calldata'], state_override=state_override
+                )
+            else:
+                index = batch.add_estimate_gas(
+                    step['function'], {'from': checksum_address},
+                    allow_failure=True, data=step['calldata'], state_override=state_override
+                )
+            checks.append((i, index, profile_key, profiled is None, state_override is not None))
+
+        if spec['function'] == 'approve':
+            override = allowance_override(step, checksum_address)
+            for address, state in (override or {}).items():
+                overrides.setdefault(address, {'stateDiff': {}})['stateDiff'].update(state['stateDiff'])
+
+    nonce_index = None
+    if nonce_manager.next_nonce(checksum_address) is None:
+        nonce_index = batch.add_transaction_count(checksum_address, 'pending')
+    results = batch.execute()
+    gas_price = gas_oracle.gas_price()
+
+    for i, index, profile_key, estimated, overridden in checks:
+        if index in batch.errors:
+            gas_estimate = failed_step_gas(i, steps[i], batch.errors[index], overridden)
+            if estimated:
+                gases[i] = int(gas_estimate * GAS_MARGIN)
+            continue
+        if overridden and STATE_OVERRIDE_SUPPORTED is None:
+            STATE_OVERRIDE_SUPPORTED = True
+            logger.info("✅ RPC节点支持状态覆盖，依赖授权的步骤按模拟授权后的状态估算")
+        if estimated:
+            if profile_key is not None:
+                gas_profiles.record(profile_key, results[index])
+            gases[i] = int(results[index] * GAS_MARGIN)
+
+    # 估算全部成功后才记录分配
+    nonce = nonce_manager.reserve(
+        checksum_address, count=len(steps),
+        chain_nonce=results[nonce_index] if nonce_index is not None else None
+    )
+    return gases, gas_price, nonce
+
+def build_transactions(from_address, actions):
+    """
+    按注册表构造一组连续交易（如先授权再购买）
+
+    actions: [(动作名, 参数)]；返回与之顺序一致的交易参数，nonce 连续递增
+    """
+    for i, (action, params) in enumerate(actions):
+        if action not in TX_ACTIONS:
+            error = ActionError(f'Unknown action: {action}')
+            error.step = i
+            raise error
+    if not from_address:
+        raise ActionError('Missing from address')
+    checksum_address = Web3.to_checksum_address(from_address)
+
+    steps = []
+    for i, (action, params) in enumerate(actions):
+        try:
+            steps.append(prepare_step(action, checksum_address, params))
+        except ActionError as e:
+            e.step = i
+            raise
+
+    gases, gas_price, nonce = fetch_tx_params(checksum_address, steps)
+
+    transactions = []
+    for i, (step, gas) in enumerate(zip(steps, gases)):
+        spec = step['spec']
+        if 'log' in spec:
+            logger.info(spec['log'].format(**step['values']))
+        transactions.append({
+            'from': from_address,
+            'to': CONTRACT_ADDRESSES[spec['contract']],
+            'data': step['calldata'],
+            'gas': hex(gas),
+            'gasPrice': hex(gas_price),
+            'nonce': hex(nonce + i),
+            'chainId': CHAIN_ID,
+            'value': '0x0'
+        })
+    return transactions
 
-            # 验证是否为管理员
-            if checksum_address.lower() != ADMIN_ADDRESS.lower():
-                return jsonify({
-                    'success': False,
-                    'error': 'Only admin can perform this action'
-                }), 403
+def build_transaction(action, from_address, params):
+    """构造单个交易"""
+    return build_transactions(from_address, [(action, params)])[0]
 
-            # 验证推荐人地址
-            try:
-                referrer_checksum = Web3.to_checksum_address(referrer_address)
-            except:
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid referrerAddress'
-                }), 400
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.removeSpecialReferrer(
-                referrer_checksum
-            ).estimate_gas({'from': checksum_address})
-
-            gas_price = w3.eth.gas_price
-
-            # 构造交易数据
-            remove_referrer_data = unified_contract.functions.removeSpecialReferrer(referrer_checksum)._encode_transaction_data()
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': remove_referrer_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+@app.route('/api/transaction/prepare', methods=['POST'])
+def prepare_transaction():
+    """准备交易数据"""
+    try:
+        data = request.get_json()
+        tx_data = build_transaction(data.get('action'), data.get('from'), data.get('params', {}))
 
-            logger.info(f"✅ 移除特殊推荐人交易已准备: referrer={referrer_checksum}")
+        return jsonify({
+            'success': True,
+            'data': tx_data
+        })
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+    except ActionError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), e.status
 
-        # 注入流动性
-        elif action == 'adminInjectLiquidity':
-            usdt_amount = params.get('usdtAmount')
-            drm_amount = params.get('drmAmount')
-
-            if not usdt_amount or not drm_amount:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing usdtAmount or drmAmount parameter'
-                }), 400
-
-            # 验证是否为管理员
-            if checksum_address.lower() != ADMIN_ADDRESS.lower():
-                return jsonify({
-                    'success': False,
-                    'error': 'Only admin can perform this action'
-                }), 403
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.adminInjectLiquidity(
-                int(usdt_amount),
-                int(drm_amount)
-            ).estimate_gas({'from': checksum_address})
-
-            gas_price = w3.eth.gas_price
-
-            # 构造交易数据
-            inject_data = unified_contract.functions.adminInjectLiquidity(int(usdt_amount), int(drm_amount))._encode_transaction_data()
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': inject_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+    except Exception as e:
+        logger.error(f"准备交易错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-            logger.info(f"✅ 注入流动性交易已准备: USDT={usdt_amount}, DRM={drm_amount}")
+@app.route('/api/transaction/prepare-batch', methods=['POST'])
+def prepare_transaction_batch():
+    """
+    批量准备交易（多步流程一次完成，如 authorizeUSDT + purchaseMiner）
 
+    请求体: {"from": "0x...", "actions": [{"action": "authorizeUSDT", "params": {...}}, ...]}
+    返回按顺序排列、nonce 连续的交易，共用同一个gasPrice
+    """
+    try:
+        data = request.get_json() or {}
+        actions = data.get('actions')
+        if not actions or not isinstance(actions, list):
             return jsonify({
-                'success': True,
-                'data': tx_data
-            })
-
-        # 管理员提取
-        elif action == 'adminWithdraw':
-            token_address = params.get('tokenAddress')
-            amount = params.get('amount')
-
-            if not token_address or not amount:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing tokenAddress or amount parameter'
-                }), 400
-
-            # 验证是否为管理员
-            if checksum_address.lower() != ADMIN_ADDRESS.lower():
-                return jsonify({
-                    'success': False,
-                    'error': 'Only admin can perform this action'
-                }), 403
-
-            # 验证代币地址
-            try:
-                token_checksum = Web3.to_checksum_address(token_address)
-            except:
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid tokenAddress'
-                }), 400
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.adminWithdraw(
-                token_checksum,
-                int(amount)
-            ).estimate_gas({'from': checksum_address})
-
-            gas_price = w3.eth.gas_price
-
-            # 构造交易数据
-            withdraw_data = unified_contract.functions.adminWithdraw(token_checksum, int(amount))._encode_transaction_data()
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': withdraw_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
-
-            logger.info(f"✅ 管理员提取交易已准备: token={token_checksum}, amount={amount}")
-
+                'success': False,
+                'error': 'Missing or invalid actions parameter (must be array)'
+            }), 400
+        if len(actions) > TX_BATCH_MAX_ACTIONS:
             return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+                'success': False,
+                'error': f'Too many actions (max {TX_BATCH_MAX_ACTIONS})'
+            }), 400
+        if not all(isinstance(item, dict) for item in actions):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid actions parameter (items must be objects)'
+            }), 400
 
-        # 紧急暂停
-        elif action == 'emergencyPause':
-            # 验证是否为管理员
-            if checksum_address.lower() != ADMIN_ADDRESS.lower():
-                return jsonify({
-                    'success': False,
-                    'error': 'Only admin can perform this action'
-                }), 403
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.emergencyPause().estimate_gas({
-                'from': checksum_address
-            })
+        transactions = build_transactions(
+            data.get('from'),
+            [(item.get('action'), item.get('params', {})) for item in actions]
+        )
 
-            gas_price = w3.eth.gas_price
+        return jsonify({
+            'success': True,
+            'data': transactions,
+            'count': len(transactions)
+        })
 
-            # 构造交易数据
-            pause_data = unified_contract.functions.emergencyPause()._encode_transaction_data()
+    except ActionError as e:
+        response = {
+            'success': False,
+            'error': str(e)
+        }
+        if e.step is not None:
+            response['step'] = e.step
+        return jsonify(response), e.status
 
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': pause_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
+    except Exception as e:
+        logger.error(f"批量准备交易错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-            logger.info(f"✅ 紧急暂停交易已准备")
+# 代币 -> 授权动作 / balances 数据中的字段名
+APPROVE_ACTIONS = {
+    'USDT_TOKEN': 'authorizeUSDT',
+    'DREAMLE_TOKEN': 'authorizeDRM'
+}
+TOKEN_FIELDS = {
+    'USDT_TOKEN': 'usdt',
+    'DREAMLE_TOKEN': 'drm'
+}
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
+def plan_action(action, from_address, params):
+    """
+    授权预检：读取授权额度、余额与实际扣款金额，判断是否需要先授权
+
+    余额与授权额度取自新鲜的 balances 缓存（不使用 stale-while-revalidate/出错兜底返回的旧数据，
+    否则可能按已变化的授权额度跳过授权步骤）；未命中时与价格读取合并为一次JSON-RPC批量请求并写回缓存。
+    返回的 actions 为需要依次准备的动作（仅在授权不足时包含授权步骤）
+    """
+    spec = TX_ACTIONS.get(action)
+    if spec is None:
+        raise ActionError(f'Unknown action: {action}')
+    if not from_address:
+        raise ActionError('Missing from address')
+    checksum_address = Web3.to_checksum_address(from_address)
+    params = params or {}
+    values = parse_action_params(spec, checksum_address, params)
+    spends = spec.get('spend', [])
+
+    balances = None
+    address = checksum_address.lower()
+    cache_key = f'balances_{address}'
+    if spends:
+        entry = cache.get_entry(cache_key)
+        if entry is not None and is_fresh(cache_key, *entry[1:], time.time()) and 'allowances' in entry[0]:
+            balances = entry[0]
+
+    batch = RPCBatch(w3)
+    block = current_cache_block()
+    balance_index = add_balance_reads(batch, checksum_address) if spends and balances is None else None
+    amounts = []
+    for token, amount in spends:
+        amount = amount(values)
+        if isinstance(amount, int):
+            amounts.append((token, amount, None))
+        else:
+            amounts.append((token, None, batch.add_call(amount)))
+    results = batch.execute()
+
+    if balance_index is not None:
+        balances = format_balances(address, *results[balance_index:balance_index + BALANCE_READS])
+        store_cache(cache_key, balances, block)
+
+    checks = []
+    approvals = []
+    for token, amount, index in amounts:
+        if index is not None:
+            amount = results[index][0] if isinstance(results[index], list) else results[index]
+        field = TOKEN_FIELDS[token]
+        allowance = int(balances['allowances'][f'{field}_wei'])
+        balance = int(balances[f'{field}_wei'])
+        check = {
+            'token': field.upper(),
+            'required': str(amount),
+            'allowance': str(allowance),
+            'balance': str(balance),
+            'needsApproval': allowance < amount,
+            'sufficientBalance': balance >= amount
+        }
+        if check['needsApproval']:
+            check['approveAction'] = APPROVE_ACTIONS[token]
+            approvals.append({
+                'action': APPROVE_ACTIONS[token],
+                'params': {'amount': str(max(amount, int(DEFAULT_APPROVE_AMOUNT)))}
             })
+        checks.append(check)
+
+    return {
+        'action': action,
+        'needsApproval': bool(approvals),
+        'sufficientBalance': all(check['sufficientBalance'] for check in checks),
+        'checks': checks,
+        'actions': approvals + [{'action': action, 'params': params}]
+    }
 
-        # 更新过期矿机
-        elif action == 'updateExpiredMiners':
-            user_address = params.get('userAddress')
-
-            if not user_address:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing userAddress parameter'
-                }), 400
+@app.route('/api/transaction/plan', methods=['POST'])
+def prepare_transaction_plan():
+    """
+    交易计划：授权预检 + 按需准备交易
 
-            # 验证用户地址
-            try:
-                user_checksum = Web3.to_checksum_address(user_address)
-            except:
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid userAddress'
-                }), 400
-
-            # 估算Gas
-            gas_estimate = unified_contract.functions.updateExpiredMiners(
-                user_checksum
-            ).estimate_gas({'from': checksum_address})
-
-            gas_price = w3.eth.gas_price
-
-            # 构造交易数据
-            update_data = unified_contract.functions.updateExpiredMiners(user_checksum)._encode_transaction_data()
-
-            tx_data = {
-                'from': from_address,
-                'to': CONTRACT_ADDRESSES['UNIFIED_SYSTEM'],
-                'data': update_data,
-                'gas': hex(int(gas_estimate * 1.2)),
-                'gasPrice': hex(gas_price),
-                'nonce': hex(w3.eth.get_transaction_count(checksum_address)),
-                'chainId': CHAIN_ID,
-                'value': '0x0'
-            }
-
-            logger.info(f"✅ 更新过期矿机交易已准备: user={user_checksum}")
+    请求体: {"from": "0x...", "action": "purchaseMiner", "params": {...}, "prepare": false}
+    授权额度已足够时只返回业务交易，不再需要单独的授权交易；
+    默认只返回计划（预览不分配nonce），prepare 为 true 时同时返回准备好的交易
+    """
+    try:
+        data = request.get_json() or {}
+        plan = plan_action(data.get('action'), data.get('from'), data.get('params', {}))
+        if data.get('prepare', False):
+            plan['transactions'] = build_transactions(
+                data.get('from'),
+                [(item['action'], item['params']) for item in plan['actions']]
+            )
 
-            return jsonify({
-                'success': True,
-                'data': tx_data
-            })
+        return jsonify({
+            'success': True,
+            'data': plan
+        })
 
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'Unknown action: {action}'
-            }), 400
+    except ActionError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), e.status
 
     except Exception as e:
-        logger.error(f"准备交易错误: {str(e)}")
+        logger.error(f"交易计划错误: {str(e)}")
         return jsonify({
             'success': False,
             'error': str(e)
@@ -1157,6 +1687,22 @@ def health():
         'service': 'Dreamle API Server V2',
         'timestamp': int(time.time()),
         'cache_size': len(cache),
+        'cache': cache.stats(),
+        'singleflight': singleflight.stats(),
+        'cache_mode': CACHE_MODE,
+        'block_cursor': block_cursor.stats(),
+        'log_follower': log_follower.stats() if LOG_FOLLOWER_ENABLED else None,
+        'indexer': indexer.stats() if indexer is not None else None,
+        'rpc_pool': rpc_pool.stats() if rpc_pool is not None else None,
+        'rpc_transport': rpc_transport.stats() if rpc_transport is not None else None,
+        'rpc_batch': dict(batch_stats),
+        'call_aggregator': call_aggregator.stats() if call_aggregator is not None else None,
+        'gas_oracle': gas_oracle.stats(),
+        'gas_profiles': gas_profiles.stats() if gas_profiles is not None else None,
+        'nonce_manager': nonce_manager.stats(),
+        'static_assets': static_assets.stats() if static_assets is not None else None,
+        'miners_detail_supported': MINERS_DETAIL_SUPPORTED,
+        'metrics': get_metrics(),
         'rpc_status': rpc_status,
         'block_number': block_number,
         'contracts': CONTRACT_ADDRESSES
@@ -1165,7 +1711,6 @@ def health():
 @app.route('/api/cache/clear', methods=['POST'])
 def clear_cache():
     """清除缓存"""
-    global cache
     cache.clear()
     logger.info("🧹 缓存已清除")
     return jsonify({
@@ -1173,49 +1718,23 @@ def clear_cache():
         'message': '缓存已清除'
     })
 
+def load_network_stats():
+    """从合约读取网络统计数据"""
+    # 三个合约调用合并为一次JSON-RPC批量请求
+    batch = RPCBatch(w3)
+    batch.add_call(unified_contract.functions.getNetworkStats())
+    batch.add_call(unified_contract.functions.getContractInfo())
+    batch.add_call(unified_contract.functions.getPoolBalances())
+    network_stats, contract_info, pool_balances = batch.execute()
+    return format_network_stats(network_stats, contract_info, pool_balances)
+
 @app.route('/api/network/stats', methods=['GET'])
 def get_network_stats():
     """获取网络统计数据"""
-    cache_key = 'network_stats'
-    cached_data = get_cache(cache_key)
-
-    if cached_data:
-        return jsonify({
-            'success': True,
-            'data': cached_data,
-            'cached': True
-        })
-
     try:
-        # 从合约获取网络统计
-        network_stats = unified_contract.functions.getNetworkStats().call()
-        # 返回值: [totalNetworkHashPower, activeMinersCount, totalRewardsPaid]
-
-        contract_info = unified_contract.functions.getContractInfo().call()
-        # 返回值: [version, totalMiners, totalNetworkHash, activeMiners, admin]
-
-        pool_balances = unified_contract.functions.getPoolBalances().call()
-        # 返回值: [usdtBalance, drmBalance]
-
-        data = {
-            'totalNetworkHashPower': str(network_stats[0]),
-            'activeMinersCount': network_stats[1],
-            'totalRewardsPaid': str(Web3.from_wei(network_stats[2], 'ether')),
-            'totalMiners': int(contract_info[1]),
-            'version': contract_info[0],
-            'admin': contract_info[4],
-            'poolUSDT': str(Web3.from_wei(pool_balances[0], 'ether')),
-            'poolDRM': str(Web3.from_wei(pool_balances[1], 'ether')),
-            'timestamp': int(time.time())
-        }
-
-        set_cache(cache_key, data)
+        data, cache_meta = get_or_load('network_stats', load_network_stats)
 
-        return jsonify({
-            'success': True,
-            'data': data,
-            'cached': False
-        })
+        return data_response(data, cache_meta)
     except Exception as e:
         logger.error(f"获取网络统计失败: {str(e)}")
         return jsonify({
@@ -1239,6 +1758,83 @@ def internal_error(error):
         'error': 'Internal server error'
     }), 500
 
+# ==================== 进程生命周期 ====================
+
+def start_background_services(leader=True, shared=False):
+    """
+    启动后台线程：缓存清理、区块游标/日志跟踪、Gas价格、nonce对账、链上索引
+
+    多 worker 部署（shared=True）时只有 leader 跟踪链上状态，并通过共享缓存后端（shm/redis）
+    发布最新区块、事件涉及的地址和Gas价格，其余 worker 从共享缓存读取，不各自请求RPC；
+    内存缓存无法跨进程共享，各 worker 仍各自跟踪。链上索引只在 leader 中写入，其余 worker 只读。
+    nonce分配记录通过共享缓存后端在 worker 间共享，对账只涉及本 worker 分配过的地址，各 worker 各自运行。
+    """
+    follower = not leader
+    if shared and CACHE_BACKEND != 'memory':
+        block_cursor.use_shared_state(cache, follower)
+        log_follower.use_shared_state(cache, follower, ttl=CACHE_BLOCK_MAX_AGE)
+        gas_oracle.use_shared_state(cache, follower)
+        nonce_manager.use_shared_state(cache)
+        if leader:
+            cache.start_sweeper(CACHE_SWEEP_INTERVAL)
+    else:
+        cache.start_sweeper(CACHE_SWEEP_INTERVAL)
+    if LOG_FOLLOWER_ENABLED:
+        log_follower.start()
+    if CACHE_MODE == 'block' or LOG_FOLLOWER_ENABLED:
+        block_cursor.start()
+    gas_oracle.start()
+    nonce_manager.start()
+    if indexer is not None:
+        if leader:
+            indexer.start()
+        else:
+            indexer.follow()
+
+def warm_up():
+    """预热全网统计与矿机等级算力缓存（预加载部署中在 fork 之前执行一次，各 worker 继承）"""
+    started = time.time()
+    try:
+        block_number = w3.eth.block_number
+        get_or_load('network_stats', load_network_stats)
+        get_level_hash_power(MINER_LEVELS)
+        logger.info(f"🔥 预热完成，区块 {block_number}，耗时 {time.time() - started:.2f}秒")
+    except Exception as e:
+        logger.warning(f"⚠️ 预热失败: {str(e)}，首个请求时再加载")
+
+def reset_after_fork():
+    """fork 之后重建线程池与RPC连接（父进程的线程和 socket 不能在 worker 中使用）"""
+    global refresh_executor
+    refresh_executor = ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix='cache-refresh')
+    refreshing_keys.clear()
+    if rpc_pool is not None:
+        rpc_pool.reset_after_fork()
+    else:
+        rpc_transport.reset_connections()
+    if call_aggregator is not None:
+        call_aggregator.reset_after_fork()
+    if indexer is not None:
+        indexer.reset_after_fork()
+
+def shutdown_background_services():
+    """优雅退出：停止后台线程，等待进行中的RPC调用（后台刷新、合并调用、对冲请求）完成"""
+    block_cursor.stop()
+    gas_oracle.stop()
+    nonce_manager.stop()
+    if indexer is not None:
+        indexer.stop()
+    cache.stop_sweeper()
+    if call_aggregator is not None:
+        call_aggregator.stop()
+    # 排队中的后台刷新直接取消（下次请求会重新触发），执行中的等待完成
+    refresh_executor.shutdown(wait=True, cancel_futures=True)
+    if rpc_pool is not None:
+        rpc_pool.close()
+    logger.info("👋 后台服务已停止")
+
+if not API_PREFORK:
+    start_background_services()
+
 if __name__ == '__main__':
     logger.info("🚀 启动 Dreamle API 服务器 V2...")
     logger.info(f"📡 BSC RPC: {BSC_RPC_URL}")
@@ -1261,7 +1857,7 @@ if __name__ == '__main__':
         signal.alarm(0)  # 取消超时
         logger.warning(f"⚠️ RPC连接测试失败: {str(e)}，但服务器将继续启动")
     
-    # 启动服务器
+    # 启动服务器（开发用；生产部署使用 serve.py：多进程、keep-alive、并发上限、优雅退出）
     app.run(
         host='0.0.0.0',
         port=3000,
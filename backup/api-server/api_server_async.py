@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dreamle Mining Platform API 服务器（异步读取）
+ASGI 服务，基于 AsyncWeb3 并发发起同一请求内相互独立的 RPC 调用，
+接口响应格式与 api-server-v2.py 保持一致
+
+启动:
+    uvicorn api_server_async:app --host 0.0.0.0 --port 3001
+"""
+
+import asyncio
+import logging
+import time
+
+from eth_abi.exceptions import DecodingError
+from quart import Quart, jsonify, request
+from quart_cors import cors
+from web3 import AsyncWeb3
+from web3.exceptions import ContractLogicError, BadFunctionCallOutput
+
+from cache_store import TTLCache
+from multicall import (
+    MULTICALL3_ADDRESS, MULTICALL3_ABI, MULTICALL_MAX_CALLS, MULTICALL_RETRY_INTERVAL,
+    _abi_type, is_call_error
+)
+from server_config import BSC_RPC_URL, CHAIN_ID, CONTRACT_ADDRESSES, UNIFIED_SYSTEM_ABI, ERC20_ABI
+from response_format import (
+    format_mining_info, format_miners_detail, format_metadata_miners, format_user_miners,
+    format_balances, format_network_stats, normalize_address, for_address, is_incomplete, data_etag
+)
+
+app = cors(Quart(__name__))
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# ==================== 配置 ====================
+
+CACHE_DURATION = 30  # 秒（默认TTL）
+CACHE_TTLS = {
+    'network_stats': 30,
+    'mining_info': 30,
+    'miners': 60,
+    'balances': 15
+}
+# 与 api-server-v2.py 相同：过期后仍返回旧数据并后台刷新的时间窗口 / RPC出错时仍可返回旧数据的时间窗口
+CACHE_STALE_WHILE_REVALIDATE = 300  # 秒
+CACHE_STALE_IF_ERROR = 3600  # 秒
+RPC_CONCURRENCY = 32  # 单个请求内并发 eth_call 的上限（Multicall3 不可用、逐个查询矿机时）
+
+cache = TTLCache(
+    default_ttl=CACHE_DURATION,
+    namespace_ttls=CACHE_TTLS,
+    stale_ttl=max(CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR)
+)
+cache.start_sweeper()
+
+# 进行中的回源：同一缓存键的并发请求共享一个 Future
+in_flight = {}
+# 后台刷新中的缓存键及其任务（保持任务引用直到完成）
+refreshing_keys = set()
+background_tasks = set()
+
+# AsyncWeb3 实例
+w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(BSC_RPC_URL))
+
+# 添加POA中间件（BSC是POA链）
+try:
+    from web3.middleware import ExtraDataToPOAMiddleware
+    w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+except ImportError:
+    pass
+
+unified_contract = w3.eth.contract(
+    address=AsyncWeb3.to_checksum_address(CONTRACT_ADDRESSES['UNIFIED_SYSTEM']),
+    abi=UNIFIED_SYSTEM_ABI
+)
+
+usdt_contract = w3.eth.contract(
+    address=AsyncWeb3.to_checksum_address(CONTRACT_ADDRESSES['USDT_TOKEN']),
+    abi=ERC20_ABI
+)
+
+drm_contract = w3.eth.contract(
+    address=AsyncWeb3.to_checksum_address(CONTRACT_ADDRESSES['DREAMLE_TOKEN']),
+    abi=ERC20_ABI
+)
+
+multicall_contract = w3.eth.contract(
+    address=AsyncWeb3.to_checksum_address(MULTICALL3_ADDRESS),
+    abi=MULTICALL3_ABI
+)
+
+# 链上没有 Multicall3 时，在此时间之前改为并发逐个调用
+multicall_unavailable_until = 0
+
+# 合约是否支持 getUserMinersDetail（None 表示尚未探测）
+miners_detail_supported = None
+
+# 矿机等级 -> 算力（等级配置不变，进程内缓存）
+level_hash_power = {}
+
+# ==================== 缓存函数 ====================
+
+async def load_and_cache(cache_key, loader):
+    """回源并写入缓存（同一个键的并发回源合并为一次），返回 (data, shared)；不完整的结果不写入缓存"""
+    future = in_flight.get(cache_key)
+    if future is not None:
+        return await asyncio.shield(future), True
+
+    future = asyncio.get_running_loop().create_future()
+    in_flight[cache_key] = future
+    try:
+        data = await loader()
+        if not is_incomplete(data):
+            cache.set(cache_key, data)
+        future.set_result(data)
+        return data, False
+    except Exception as e:
+        future.set_exception(e)
+        # 没有其他请求等待时避免 "exception was never retrieved" 警告
+        future.exception()
+        raise
+    finally:
+        in_flight.pop(cache_key, None)
+
+def schedule_refresh(cache_key, loader):
+    """在后台任务中刷新缓存，同一个键同时只刷新一次"""
+    if cache_key in refreshing_keys:
+        return
+    refreshing_keys.add(cache_key)
+
+    async def refresh():
+        try:
+            await load_and_cache(cache_key, loader)
+        except Exception as e:
+            logger.warning(f"⚠️ 后台刷新缓存失败 {cache_key}: {str(e)}")
+        finally:
+            refreshing_keys.discard(cache_key)
+
+    task = asyncio.get_running_loop().create_task(refresh())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def get_or_load(cache_key, loader):
+    """
+    读取缓存，返回 (data, meta)，meta 合并到响应中（与 api-server-v2.py 的 get_or_load 一致）
+
+    - 未过期: 直接返回
+    - 过期但在 CACHE_STALE_WHILE_REVALIDATE 内: 返回旧数据并后台刷新
+    - 其他情况: 回源（并发请求合并），失败时在 CACHE_STALE_IF_ERROR 内返回旧数据
+    """
+    entry = cache.get_entry(cache_key)
+    now = time.time()
+    if entry is not None:
+        data, stored_at, expires_at, _ = entry
+        if now < expires_at:
+            return data, {'cached': True}
+        if now - expires_at < CACHE_STALE_WHILE_REVALIDATE:
+            schedule_refresh(cache_key, loader)
+            return data, {'cached': True, 'stale': True, 'age': int(now - stored_at)}
+
+    try:
+        data, shared = await load_and_cache(cache_key, loader)
+        return data, {'cached': shared}
+    except Exception as e:
+        if entry is not None and now - entry[2] < CACHE_STALE_IF_ERROR:
+            logger.warning(f"⚠️ 回源失败，返回旧缓存 {cache_key}: {str(e)}")
+            return entry[0], {'cached': True, 'stale': True, 'age': int(now - entry[1])}
+        raise
+
+async def get_address_data(address, namespace, loader):
+    """读取地址数据：缓存键使用规范化地址，响应中的 address 恢复为请求中的写法"""
+    canonical = normalize_address(address)
+    data, cache_meta = await get_or_load(f'{namespace}_{canonical}', lambda: loader(canonical))
+    return for_address(data, address), cache_meta
+
+# ==================== 批量读取 ====================
+
+async def multicall(functions):
+    """
+    Multicall3 aggregate3 批量读取（允许失败），分块并发发送；
+    返回与 functions 一一对应的结果，失败的子调用为异常。链上没有 Multicall3 时抛出 BadFunctionCallOutput
+    """
+    payload = [(f.address, True, f._encode_transaction_data()) for f in functions]
+    chunks = [payload[i:i + MULTICALL_MAX_CALLS] for i in range(0, len(payload), MULTICALL_MAX_CALLS)]
+    responses = await asyncio.gather(
+        *(multicall_contract.functions.aggregate3(chunk).call() for chunk in chunks)
+    )
+
+    results = []
+    for function, (success, return_data) in zip(functions, (r for chunk in responses for r in chunk)):
+        if not success:
+            results.append(ContractLogicError(f'execution reverted: {function.fn_name}'))
+            continue
+        try:
+            values = w3.codec.decode([_abi_type(o) for o in function.abi.get('outputs', [])], bytes(return_data))
+            results.append(values[0] if len(values) == 1 else list(values))
+        except DecodingError as e:
+            results.append(BadFunctionCallOutput(f'{function.fn_name}: {str(e)}'))
+    return results
+
+async def read_calls(functions):
+    """
+    批量读取合约 view 调用：优先一次 Multicall3，不可用时并发逐个调用；
+    调用本身失败（回滚、无法解码）的结果为异常，节点/网络故障直接抛出
+    """
+    global multicall_unavailable_until
+    if not functions:
+        return []
+    if time.time() >= multicall_unavailable_until:
+        try:
+            return await multicall(functions)
+        except BadFunctionCallOutput as e:
+            logger.warning(f"⚠️ Multicall3 不可用，改为并发逐个调用: {str(e)}")
+            multicall_unavailable_until = time.time() + MULTICALL_RETRY_INTERVAL
+
+    semaphore = asyncio.Semaphore(RPC_CONCURRENCY)
+
+    async def call(function):
+        async with semaphore:
+            return await function.call()
+
+    results = await asyncio.gather(*(call(f) for f in functions), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception) and not is_call_error(result):
+            raise result
+    return results
+
+# ==================== 数据读取 ====================
+# 加载函数与 api-server-v2.py 一一对应，返回相同结构的数据（response_format）
+
+async def load_mining_info(address):
+    """从合约读取用户挖矿信息"""
+    checksum_address = AsyncWeb3.to_checksum_address(address)
+    mining_info = await unified_contract.functions.getUserMiningData(checksum_address).call()
+    return format_mining_info(address, mining_info)
+
+async def get_level_hash_power(levels):
+    """获取各等级算力，未知等级并发查询；任一等级读取失败时抛出其异常"""
+    missing = sorted(set(levels) - set(level_hash_power))
+    if missing:
+        results = await asyncio.gather(
+            *(unified_contract.functions.minerLevels(level).call() for level in missing),
+            return_exceptions=True
+        )
+        for level, level_info in zip(missing, results):
+            # 返回值: [price, hashPower, maxSupply, currentSupply]
+            if not isinstance(level_info, Exception):
+                level_hash_power[level] = level_info[1]
+        for level, level_info in zip(missing, results):
+            if isinstance(level_info, Exception):
+                logger.warning(f"⚠️ 读取等级算力失败: level={level}")
+                raise level_info
+    return level_hash_power
+
+async def fetch_miners_detail(checksum_address):
+    """主路径: getUserMinersDetail 一次调用返回全部矿机（getUserMinersDetail 返回值）"""
+    return await unified_contract.functions.getUserMinersDetail(checksum_address).call()
+
+async def fetch_miners_multicall(checksum_address):
+    """兜底路径: getUserMiners 后批量读取每个矿机的 getNFTMetadata，返回 (miners, 读取失败的tokenId)"""
+    miner_ids = await unified_contract.functions.getUserMiners(checksum_address).call()
+    latest_block, results = await asyncio.gather(
+        w3.eth.get_block('latest'),
+        read_calls([unified_contract.functions.getNFTMetadata(miner_id) for miner_id in miner_ids])
+    )
+    # 使用区块链时间而非系统时间
+    miners, missing = format_metadata_miners(miner_ids, results, latest_block['timestamp'])
+    if missing:
+        logger.warning(f"⚠️ 获取矿机信息失败: tokenId={missing}")
+    return miners, missing
+
+async def load_user_miners(address):
+    """从合约读取用户矿机列表"""
+    global miners_detail_supported
+    checksum_address = AsyncWeb3.to_checksum_address(address)
+
+    if miners_detail_supported is not False:
+        try:
+            detail = await fetch_miners_detail(checksum_address)
+            if miners_detail_supported is None:
+                miners_detail_supported = True
+                logger.info("✅ 合约支持 getUserMinersDetail，使用批量查询")
+            try:
+                # detail[1] 为各矿机等级；等级算力读取失败不影响是否支持 getUserMinersDetail
+                miners = format_miners_detail(detail, await get_level_hash_power(detail[1]))
+                return format_user_miners(address, miners, 'detail')
+            except Exception as e:
+                logger.warning(f"⚠️ 等级算力读取失败，本次使用兜底路径: {str(e)}")
+        except (ContractLogicError, BadFunctionCallOutput) as e:
+            # 合约没有该函数（回滚或返回空数据）：仅在尚未确认支持时关闭主路径
+            if miners_detail_supported is None:
+                miners_detail_supported = False
+                logger.warning(f"⚠️ 合约不支持 getUserMinersDetail，切换到逐个查询: {str(e)}")
+            else:
+                logger.warning(f"⚠️ getUserMinersDetail 调用失败，本次使用兜底路径: {str(e)}")
+        except Exception as e:
+            logger.warning(f"⚠️ getUserMinersDetail 调用失败，本次使用兜底路径: {str(e)}")
+
+    miners, missing = await fetch_miners_multicall(checksum_address)
+    # 部分矿机读取失败：返回已读取的部分，但不写入缓存
+    return format_user_miners(address, miners, 'multicall', missing)
+
+async def load_balances(address):
+    """并发读取用户所有代币余额及USDT/DRM对统一系统合约的授权额度"""
+    checksum_address = AsyncWeb3.to_checksum_address(address)
+    unified_system = AsyncWeb3.to_checksum_address(CONTRACT_ADDRESSES['UNIFIED_SYSTEM'])
+    results = await asyncio.gather(
+        w3.eth.get_balance(checksum_address),
+        usdt_contract.functions.balanceOf(checksum_address).call(),
+        drm_contract.functions.balanceOf(checksum_address).call(),
+        usdt_contract.functions.allowance(checksum_address, unified_system).call(),
+        drm_contract.functions.allowance(checksum_address, unified_system).call()
+    )
+    return format_balances(address, *results)
+
+async def load_network_stats():
+    """并发读取网络统计数据"""
+    network_stats, contract_info, pool_balances = await asyncio.gather(
+        unified_contract.functions.getNetworkStats().call(),
+        unified_contract.functions.getContractInfo().call(),
+        unified_contract.functions.getPoolBalances().call()
+    )
+    return format_network_stats(network_stats, contract_info, pool_balances)
+
+# ==================== API 端点 ====================
+
+def data_response(data, cache_meta):
+    """数据接口响应：带 ETag（与 api-server-v2.py 相同的内容哈希），请求的 If-None-Match 匹配时返回 304"""
+    etag = data_etag(data)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class('', status=304)
+    else:
+        response = jsonify({
+            'success': True,
+            'data': data,
+            **cache_meta
+        })
+    response.set_etag(etag, weak=True)
+    # 浏览器每次轮询都带 If-None-Match 重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+async def cached_response(load, error_message):
+    """通用读取接口：load() 返回 (data, meta)，统一响应与错误格式"""
+    try:
+        data, cache_meta = await load()
+        return data_response(data, cache_meta)
+    except Exception as e:
+        logger.error(f"{error_message}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/config', methods=['GET'])
+async def get_config():
+    """获取配置信息"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'contracts': CONTRACT_ADDRESSES,
+            'network': {
+                'chainId': CHAIN_ID,
+                'chainName': 'BSC Testnet',
+                'rpcUrl': BSC_RPC_URL,
+                'explorer': 'https://testnet.bscscan.com'
+            },
+            'cache_duration': CACHE_DURATION,
+            'cache_ttls': CACHE_TTLS,
+            'cache_stale_while_revalidate': CACHE_STALE_WHILE_REVALIDATE,
+            'cache_stale_if_error': CACHE_STALE_IF_ERROR
+        }
+    })
+
+@app.route('/api/user/<address>/mining-info', methods=['GET'])
+async def get_user_mining_info(address):
+    """获取用户挖矿信息"""
+    return await cached_response(
+        lambda: get_address_data(address, 'mining_info', load_mining_info), '获取挖矿信息错误'
+    )
+
+@app.route('/api/user/<address>/miners', methods=['GET'])
+async def get_user_miners(address):
+    """获取用户矿机列表"""
+    return await cached_response(
+        lambda: get_address_data(address, 'miners', load_user_miners), '获取矿机列表错误'
+    )
+
+@app.route('/api/user/<address>/balances', methods=['GET'])
+async def get_user_balances(address):
+    """获取用户所有代币余额"""
+    return await cached_response(
+        lambda: get_address_data(address, 'balances', load_balances), '获取余额错误'
+    )
+
+@app.route('/api/network/stats', methods=['GET'])
+async def get_network_stats():
+    """获取网络统计数据"""
+    return await cached_response(lambda: get_or_load('network_stats', load_network_stats), '获取网络统计失败')
+
+@app.route('/api/health', methods=['GET'])
+async def health():
+    """健康检查"""
+    try:
+        # 检查RPC连接
+        block_number = await w3.eth.block_number
+        rpc_status = 'connected'
+    except Exception:
+        block_number = 0
+        rpc_status = 'disconnected'
+
+    return jsonify({
+        'status': 'healthy',
+        'service': 'Dreamle API Server V2 (async)',
+        'timestamp': int(time.time()),
+        'cache_size': len(cache),
+        'cache': cache.stats(),
+        'miners_detail_supported': miners_detail_supported,
+        'rpc_status': rpc_status,
+        'block_number': block_number,
+        'contracts': CONTRACT_ADDRESSES
+    })
+
+# ==================== 错误处理 ====================
+
+@app.errorhandler(404)
+async def not_found(error):
+    return jsonify({
+        'success': False,
+        'error': 'Not found'
+    }), 404
+
+@app.errorhandler(500)
+async def internal_error(error):
+    return jsonify({
+        'success': False,
+        'error': 'Internal server error'
+    }), 500
+
+if __name__ == '__main__':
+    import uvicorn
+
+    logger.info("🚀 启动 Dreamle 异步 API 服务器...")
+    logger.info(f"📡 BSC RPC: {BSC_RPC_URL}")
+    uvicorn.run(app, host='0.0.0.0', port=3001)
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨进程共享缓存后端
+多个 worker 进程共用一份缓存：同机共享内存（mmap 文件）或 Redis 协议服务器。
+条目以紧凑二进制格式存储（定长头部 + msgpack/JSON 数据，较大时 zlib 压缩）
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import logging
+import zlib
+from contextlib import contextmanager
+
+from cache_store import CacheBackend
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# ==================== 条目序列化 ====================
+
+# 头部: flags, stored_at, expires_at, block
+_ENTRY_HEADER = struct.Struct('<Bddq')
+FLAG_COMPRESSED = 0x01
+FLAG_MSGPACK = 0x02
+FLAG_BLOCK = 0x04
+
+COMPRESS_MIN_BYTES = 512  # 数据超过该长度时尝试压缩
+
+
+def encode_entry(data, stored_at, expires_at, block=None):
+    """缓存条目 -> bytes；优先 msgpack（未安装或遇到超出64位的整数时使用JSON）"""
+    flags = 0
+    payload = None
+    if msgpack is not None:
+        try:
+            payload = msgpack.packb(data, use_bin_type=True)
+            flags |= FLAG_MSGPACK
+        except (TypeError, ValueError, OverflowError):
+            payload = None
+    if payload is None:
+        payload = json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+
+    if len(payload) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(payload, 1)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_COMPRESSED
+    if block is not None:
+        flags |= FLAG_BLOCK
+    return _ENTRY_HEADER.pack(flags, stored_at, expires_at, block or 0) + payload
+
+
+def decode_entry(raw):
+    """bytes -> (data, stored_at, expires_at, block)"""
+    flags, stored_at, expires_at, block = _ENTRY_HEADER.unpack_from(raw)
+    payload = bytes(raw[_ENTRY_HEADER.size:])
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    if flags & FLAG_MSGPACK:
+        data = msgpack.unpackb(payload, raw=False)
+    else:
+        data = json.loads(payload)
+    return data, stored_at, expires_at, block if flags & FLAG_BLOCK else None
+
+
+# ==================== 共享内存 ====================
+
+# 文件头: magic, version, groups, ways, slot_size
+_FILE_HEADER = struct.Struct('<4sIIII')
+_FILE_MAGIC = b'DRMC'
+_FILE_VERSION = 1
+_DATA_OFFSET = 64
+
+# 槽位头: used, key_len, value_len, key_hash, expires_at
+_SLOT_HEADER = struct.Struct('<BHIQd')
+
+
+class SharedMemoryCache(CacheBackend):
+    """
+    基于 mmap 文件的跨进程缓存（同一台机器上的多个 worker 共用）
+
+    文件划分为 groups 组、每组 ways 个定长槽位（组相联）：键按哈希落入一组，只在组内查找/替换，
+    组内无空位时替换最早过期的条目。每组由进程内线程锁 + fcntl 记录锁（按组分段）保护。
+    单个条目（键 + 编码后数据）超过槽位大小时不缓存。
+    """
+
+    def __init__(self, path, slots=4096, slot_size=8192, ways=8, lock_stripes=256,
+                 default_ttl=30, namespace_ttls=None, stale_ttl=0):
+        """
+        path: 共享文件路径（建议位于 /dev/shm）
+        slots: 总槽位数（按 ways 向上取整为整组）
+        slot_size: 每个槽位的字节数
+        """
+        super().__init__(default_ttl, namespace_ttls, stale_ttl)
+        self.path = path
+        self.ways = ways
+        self.groups = max(1, -(-slots // ways))
+        self.slot_size = slot_size
+        self.lock_stripes = lock_stripes
+        self.size = _DATA_OFFSET + self.groups * ways * slot_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._open()
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+
+        self.oversize = 0
+
+    def _open(self):
+        """映射共享文件；文件不存在或布局不同则重新初始化"""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, _FILE_HEADER.size, 0)
+            expected = _FILE_HEADER.pack(_FILE_MAGIC, _FILE_VERSION, self.groups, self.ways, self.slot_size)
+            if header != expected or os.fstat(self._fd).st_size != self.size:
+                if header[:4] == _FILE_MAGIC:
+                    logger.warning(f"⚠️ 共享缓存文件布局变化，重新初始化: {self.path}")
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, expected, 0)
+            self._mm = mmap.mmap(self._fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    # ---------- 槽位 ----------
+
+    @staticmethod
+    def _hash(key_bytes):
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+
+    def _slot_offset(self, group, way):
+        return _DATA_OFFSET + (group * self.ways + way) * self.slot_size
+
+    @contextmanager
+    def _lock(self, group):
+        """锁住一组：进程内线程锁 + 跨进程 fcntl 记录锁（记录锁按进程持有，线程间需另加锁）"""
+        stripe = group % self.lock_stripes
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe, os.SEEK_SET)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe, os.SEEK_SET)
+
+    def _find(self, group, key_bytes, key_hash):
+        """在组内查找键，返回槽位偏移或 None"""
+        for way in range(self.ways):
+            offset = self._slot_offset(group, way)
+            used, key_len, value_len, slot_hash, expires_at = _SLOT_HEADER.unpack_from(self._mm, offset)
+            if used and slot_hash == key_hash and key_len == len(key_bytes):
+                start = offset + _SLOT_HEADER.size
+                if self._mm[start:start + key_len] == key_bytes:
+                    return offset
+        return None
+
+    def _victim(self, group, now):
+        """选择写入位置：空槽位 > 超出保留期的槽位 > 最早过期的槽位"""
+        oldest = None
+        oldest_expires = None
+        for way in range(self.ways):
+            offset = self._slot_offset(group, way)
+            used, _, _, _, expires_at = _SLOT_HEADER.unpack_from(self._mm, offset)
+            if not used:
+                return offset, False
+            if expires_at + self.stale_ttl <= now:
+                return offset, False
+            if oldest is None or expires_at < oldest_expires:
+                oldest, oldest_expires = offset, expires_at
+        return oldest, True
+
+    def _locate(self, key):
+        key_bytes = key.encode('utf-8')
+        key_hash = self._hash(key_bytes)
+        return key_bytes, key_hash, key_hash % self.groups
+
+    # ---------- 读写 ----------
+
+    def get_entry(self, key):
+        key_bytes, key_hash, group = self._locate(key)
+        now = time.time()
+        with self._lock(group):
+            offset = self._find(group, key_bytes, key_hash)
+            if offset is None:
+                self.misses += 1
+                return None
+            _, key_len, value_len, _, expires_at = _SLOT_HEADER.unpack_from(self._mm, offset)
+            if expires_at + self.stale_ttl <= now:
+                self._mm[offset:offset + 1] = b'\x00'
+                self.expirations += 1
+                self.misses += 1
+                return None
+            start = offset + _SLOT_HEADER.size + key_len
+            raw = self._mm[start:start + value_len]
+
+        if expires_at <= now:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return decode_entry(raw)
+
+    def set(self, key, data, ttl=None, block=None):
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        now = time.time()
+        raw = encode_entry(data, now, now + ttl, block)
+        key_bytes, key_hash, group = self._locate(key)
+        if _SLOT_HEADER.size + len(key_bytes) + len(raw) > self.slot_size:
+            self.oversize += 1
+            self.delete(key)
+            return
+
+        with self._lock(group):
+            offset = self._find(group, key_bytes, key_hash)
+            if offset is None:
+                offset, evicted = self._victim(group, now)
+                if evicted:
+                    self.evictions += 1
+            # 先标记为空再写数据，最后写头部
+            self._mm[offset:offset + 1] = b'\x00'
+            start = offset + _SLOT_HEADER.size
+            self._mm[start:start + len(key_bytes)] = key_bytes
+            self._mm[start + len(key_bytes):start + len(key_bytes) + len(raw)] = raw
+            _SLOT_HEADER.pack_into(self._mm, offset, 1, len(key_bytes), len(raw), key_hash, now + ttl)
+
+    def delete(self, key):
+        key_bytes, key_hash, group = self._locate(key)
+        with self._lock(group):
+            offset = self._find(group, key_bytes, key_hash)
+            if offset is None:
+                return False
+            self._mm[offset:offset + 1] = b'\x00'
+            return True
+
+    def clear(self):
+        for group in range(self.groups):
+            with self._lock(group):
+                for way in range(self.ways):
+                    offset = self._slot_offset(group, way)
+                    self._mm[offset:offset + 1] = b'\x00'
+
+    def _scan(self):
+        """遍历所有槽位头部（不加锁，用于统计）"""
+        for group in range(self.groups):
+            for way in range(self.ways):
+                yield _SLOT_HEADER.unpack_from(self._mm, self._slot_offset(group, way))
+
+    def __len__(self):
+        return sum(1 for header in self._scan() if header[0])
+
+    # ---------- 过期清理 ----------
+
+    def sweep(self):
+        now = time.time()
+        removed = 0
+        for group in range(self.groups):
+            with self._lock(group):
+                for way in range(self.ways):
+                    offset = self._slot_offset(group, way)
+                    used, _, _, _, expires_at = _SLOT_HEADER.unpack_from(self._mm, offset)
+                    if used and expires_at + self.stale_ttl <= now:
+                        self._mm[offset:offset + 1] = b'\x00'
+                        removed += 1
+        self.expirations += removed
+        return removed
+
+    # ---------- 统计 ----------
+
+    def stats(self):
+        """缓存统计信息（命中计数为本进程）"""
+        entries = 0
+        used_bytes = 0
+        for used, key_len, value_len, _, _ in self._scan():
+            if used:
+                entries += 1
+                used_bytes += key_len + value_len
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'shm',
+            'path': self.path,
+            'entries': entries,
+            'bytes': used_bytes,
+            'capacity': self.groups * self.ways,
+            'slot_size': self.slot_size,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'oversize': self.oversize,
+            'ttls': dict(self.namespace_ttls, default=self.default_ttl),
+            'stale_ttl': self.stale_ttl
+        }
+
+
+# ==================== Redis ====================
+
+class RedisCache(CacheBackend):
+    """
+    Redis 协议缓存（Redis / KeyDB / Valkey 等，可跨机器共享）
+
+    条目以 PX 过期时间写入（TTL + stale_ttl），保留期由服务器负责清理；
+    服务器不可用时读取视为未命中、写入忽略，不影响请求。
+    """
+
+    def __init__(self, url='redis://127.0.0.1:6379/0', client=None, prefix='dreamle:cache:',
+                 socket_timeout=0.5, default_ttl=30, namespace_ttls=None, stale_ttl=0,
+                 size_refresh_interval=60):
+        """
+        client: 已创建的 redis 客户端（redis.Redis 或兼容实现，如 fakeredis），为 None 时按 url 创建
+        prefix: 键前缀，clear() 只删除该前缀下的键
+        size_refresh_interval: len() 的结果缓存时间（秒）；统计键数量需要 SCAN 整个键空间
+        """
+        super().__init__(default_ttl, namespace_ttls, stale_ttl)
+        if client is None:
+            if redis is None:
+                raise RuntimeError('Redis缓存需要安装 redis 包')
+            client = redis.Redis.from_url(
+                url, socket_timeout=socket_timeout, socket_connect_timeout=socket_timeout
+            )
+        self.client = client
+        self.url = url
+        self.prefix = prefix
+        self.errors = 0
+        self._last_error_log = 0
+        self.size_refresh_interval = size_refresh_interval
+        self._size = None
+        self._size_at = 0
+
+    def _error(self, action, e):
+        """记录服务器错误（每10秒最多打印一次日志）"""
+        self.errors += 1
+        now = time.time()
+        if now - self._last_error_log > 10:
+            self._last_error_log = now
+            logger.warning(f"⚠️ Redis缓存{action}失败: {str(e)}")
+
+    # ---------- 读写 ----------
+
+    def get_entry(self, key):
+        try:
+            raw = self.client.get(self.prefix + key)
+        except Exception as e:
+            self._error('读取', e)
+            self.misses += 1
+            return None
+        if raw is None:
+            self.misses += 1
+            return None
+        entry = decode_entry(raw)
+        if entry[2] <= time.time():
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, data, ttl=None, block=None):
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        now = time.time()
+        raw = encode_entry(data, now, now + ttl, block)
+        try:
+            self.client.set(self.prefix + key, raw, px=max(1, int((ttl + self.stale_ttl) * 1000)))
+        except Exception as e:
+            self._error('写入', e)
+
+    def delete(self, key):
+        try:
+            return bool(self.client.delete(self.prefix + key))
+        except Exception as e:
+            self._error('删除', e)
+            return False
+
+    def _keys(self):
+        return self.client.scan_iter(match=self.prefix + '*', count=1000)
+
+    def clear(self):
+        try:
+            chunk = []
+            for name in self._keys():
+                chunk.append(name)
+                if len(chunk) >= 500:
+                    self.client.delete(*chunk)
+                    chunk = []
+            if chunk:
+                self.client.delete(*chunk)
+            self._size, self._size_at = 0, time.monotonic()
+        except Exception as e:
+            self._error('清空', e)
+
+    def __len__(self):
+        """键数量（近似值）：最多每 size_refresh_interval 秒 SCAN 一次，健康检查不会每次遍历键空间"""
+        now = time.monotonic()
+        if self._size is not None and now - self._size_at < self.size_refresh_interval:
+            return self._size
+        self._size_at = now  # 并发调用在本次统计期间返回旧值
+        try:
+            self._size = sum(1 for _ in self._keys())
+        except Exception as e:
+            self._error('统计', e)
+        return self._size or 0
+
+    # ---------- 统计 ----------
+
+    def stats(self):
+        """缓存统计信息（命中计数为本进程）"""
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'redis',
+            'prefix': self.prefix,
+            'entries': self._size,  # 最近一次 len() 的结果
+            'entries_age': round(time.monotonic() - self._size_at, 1) if self._size is not None else None,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+            'errors': self.errors,
+            'ttls': dict(self.namespace_ttls, default=self.default_ttl),
+            'stale_ttl': self.stale_ttl
+        }
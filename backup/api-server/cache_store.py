@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+有界缓存
+缓存后端接口与进程内实现：线程安全的 LRU + TTL 缓存，支持按命名空间配置过期时间、
+条目数/字节数上限和后台过期清理（跨进程共享的后端见 cache_backends）
+"""
+
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(data):
+    """估算缓存数据占用的字节数（按JSON序列化长度计）"""
+    try:
+        return len(json.dumps(data, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class CacheBackend:
+    """
+    缓存后端接口
+
+    键按前缀归属命名空间（如 'balances_0x...' 属于 'balances'），每个命名空间可单独配置 TTL。
+    条目为 (data, stored_at, expires_at, block)；过期条目额外保留 stale_ttl 秒，
+    供 get_entry() 读取旧值（stale-while-revalidate）。
+
+    子类实现 get_entry / set / delete / clear / __len__ / stats，需要时实现 sweep。
+    """
+
+    def __init__(self, default_ttl=30, namespace_ttls=None, stale_ttl=0):
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.namespace_ttls = dict(namespace_ttls or {})
+        # 长前缀优先匹配，避免 'miners' 抢占 'miners_detail' 之类的命名空间
+        self._prefixes = sorted(self.namespace_ttls, key=len, reverse=True)
+        self._sweeper = None
+        self._stop = threading.Event()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # ---------- 命名空间 ----------
+
+    def namespace(self, key):
+        """获取键所属的命名空间"""
+        for prefix in self._prefixes:
+            if key == prefix or key.startswith(prefix + '_'):
+                return prefix
+        return 'default'
+
+    def ttl_for(self, key):
+        """获取键对应的TTL（秒）"""
+        return self.namespace_ttls.get(self.namespace(key), self.default_ttl)
+
+    # ---------- 读写 ----------
+
+    def get(self, key):
+        """读取未过期的缓存，未命中返回 None"""
+        entry = self.get_entry(key)
+        if entry is None or entry[2] <= time.time():
+            return None
+        return entry[0]
+
+    def get_entry(self, key):
+        """读取缓存条目（包括保留期内的过期条目），返回 (data, stored_at, expires_at, block) 或 None"""
+        raise NotImplementedError
+
+    def set(self, key, data, ttl=None, block=None):
+        """写入缓存，block 为读取数据时的区块号（按区块失效时使用）"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """删除缓存条目，返回是否存在"""
+        raise NotImplementedError
+
+    def clear(self):
+        """清空缓存"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, key):
+        return self.get_entry(key) is not None
+
+    # ---------- 过期清理 ----------
+
+    def sweep(self):
+        """清理所有超出保留期的条目，返回清理数量（后端自行过期时无需实现）"""
+        return 0
+
+    def start_sweeper(self, interval=60):
+        """启动后台过期清理线程"""
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    removed = self.sweep()
+                    if removed:
+                        logger.debug(f"🧹 清理过期缓存 {removed} 条")
+                except Exception as e:
+                    logger.error(f"缓存清理错误: {str(e)}")
+
+        self._sweeper = threading.Thread(target=run, name='cache-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        """停止后台清理线程"""
+        self._stop.set()
+        self._sweeper = None
+
+    # ---------- 统计 ----------
+
+    def stats(self):
+        """缓存统计信息"""
+        raise NotImplementedError
+
+
+class TTLCache(CacheBackend):
+    """
+    进程内 LRU/TTL 缓存（线程安全）
+
+    超出条目数或字节数上限时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, default_ttl=30, namespace_ttls=None, max_entries=10000,
+                 max_bytes=64 * 1024 * 1024, stale_ttl=0):
+        super().__init__(default_ttl, namespace_ttls, stale_ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # key -> (data, stored_at, expires_at, size, block)
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    # ---------- 读写 ----------
+
+    def get(self, key):
+        """读取未过期的缓存，未命中返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if entry[2] <= now:
+                if entry[2] + self.stale_ttl <= now:
+                    self._remove(key)
+                    self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_entry(self, key):
+        """
+        读取缓存条目（包括保留期内的过期条目）
+
+        返回 (data, stored_at, expires_at, block)，不存在或超出保留期返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if entry[2] + self.stale_ttl <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry[2] <= now:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return entry[0], entry[1], entry[2], entry[4]
+
+    def set(self, key, data, ttl=None, block=None):
+        """写入缓存，block 为读取数据时的区块号（按区块失效时使用）"""
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        size = estimate_size(data)
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (data, now, now + ttl, size, block)
+            self._bytes += size
+            self._evict()
+
+    def delete(self, key):
+        """删除缓存条目"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[3]
+
+    def _evict(self):
+        """按LRU顺序淘汰，直到满足上限"""
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= entry[3]
+            self.evictions += 1
+
+    # ---------- 过期清理 ----------
+
+    def sweep(self):
+        """清理所有超出保留期的条目，返回清理数量"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry[2] + self.stale_ttl <= now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    # ---------- 统计 ----------
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'ttls': dict(self.namespace_ttls, default=self.default_ttl),
+                'stale_ttl': self.stale_ttl
+            }
+
+
+class _InFlight:
+    """一次进行中的回源调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    请求合并（single-flight）
+
+    同一个键的并发调用只有第一个（leader）真正执行回源函数，
+    其余调用等待其结果；等待超时后自行回源。
+    """
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.leaders = 0
+        self.deduplicated = 0
+        self.timeouts = 0
+
+    def do(self, key, fn):
+        """执行 fn 并返回 (result, shared)，shared 表示结果来自其他请求的回源"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _InFlight()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                self.deduplicated += 1
+                leader = False
+
+        if not leader:
+            if call.event.wait(self.timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            with self._lock:
+                self.timeouts += 1
+            logger.warning(f"⚠️ 等待回源超时({self.timeout}秒)，自行请求: {key}")
+            return fn(), False
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stats(self):
+        """合并统计信息"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'deduplicated': self.deduplicated,
+                'timeouts': self.timeouts,
+                'timeout': self.timeout
+            }
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨请求 eth_call 合并
+不同请求在同一个短时间窗口内发起的合约 view 调用被收集起来，合并为一次 Multicall3 调用，
+结果再分发回各个等待的请求线程
+"""
+
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from multicall import MulticallBatch
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingCall:
+    __slots__ = ('contract_function', 'enqueued_at', 'event', 'result', 'error')
+
+    def __init__(self, contract_function):
+        self.contract_function = contract_function
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CallAggregator:
+    """
+    跨请求调用合并器
+
+    第一个调用进入空队列时开启窗口；窗口到期（window 秒）或队列达到 max_calls 时，
+    队列中的全部调用合并为一次 Multicall3 调用。合并会给每个调用增加最多 window 秒的排队延迟，
+    换取并发高峰时 RPC 请求数的大幅下降。
+    """
+
+    def __init__(self, w3, window=0.01, max_calls=50, workers=4, timeout=10):
+        """
+        window: 合并窗口（秒）
+        max_calls: 单批最大调用数，达到后立即发送
+        workers: 同时执行的批次数（窗口在上一批执行期间继续收集）
+        timeout: 调用方等待结果的最长时间（秒）
+        """
+        self.w3 = w3
+        self.window = window
+        self.max_calls = max_calls
+        self.timeout = timeout
+        self.workers = workers
+
+        self._queue = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='call-aggregator')
+        self._thread = None
+        self._stopping = False
+
+        self.batches = 0
+        self.calls = 0
+        self.errors = 0
+        self.max_batch_size = 0
+        self.total_queue_delay = 0.0
+        self.max_queue_delay = 0.0
+
+    # ---------- 调用 ----------
+
+    def call(self, contract_function):
+        """提交合约 view 调用并等待结果，与 contract_function.call() 等价"""
+        result, error = self.call_many([contract_function])[0]
+        if error is not None:
+            raise error
+        return result
+
+    def call_many(self, contract_functions):
+        """
+        提交一组合约 view 调用并等待全部完成，返回与之顺序一致的 [(结果, 异常)]
+
+        一组调用一次性入队，与其他请求的调用一起合并；单个调用失败不影响其他调用
+        """
+        self.start()
+        pending_calls = [_PendingCall(f) for f in contract_functions]
+        with self._cond:
+            self._queue.extend(pending_calls)
+            self._cond.notify()
+
+        deadline = time.monotonic() + self.timeout
+        outcomes = []
+        for pending in pending_calls:
+            if not pending.event.wait(max(deadline - time.monotonic(), 0)):
+                outcomes.append((None, TimeoutError(f'合并调用超时: {pending.contract_function.fn_name}')))
+            else:
+                outcomes.append((pending.result, pending.error))
+        return outcomes
+
+    # ---------- 批次 ----------
+
+    def _take_batch(self):
+        """等待窗口到期或队列满，取出一批调用"""
+        with self._cond:
+            while not self._queue:
+                if self._stopping:
+                    return None
+                self._cond.wait()
+            deadline = self._queue[0].enqueued_at + self.window
+            while len(self._queue) < self.max_calls and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_calls]
+            del self._queue[:self.max_calls]
+            return batch
+
+    def _execute(self, batch):
+        """执行一批调用并唤醒等待线程"""
+        started = time.monotonic()
+        delays = [started - p.enqueued_at for p in batch]
+        with self._cond:
+            self.batches += 1
+            self.calls += len(batch)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            self.total_queue_delay += sum(delays)
+            self.max_queue_delay = max(self.max_queue_delay, max(delays))
+
+        try:
+            # 单个调用时 MulticallBatch 直接 eth_call；没有 Multicall3 时其辅助函数（getEthBalance等）换成对应RPC方法
+            multicall = MulticallBatch(self.w3)
+            for pending in batch:
+                multicall.add(pending.contract_function)
+            for i, (pending, result) in enumerate(zip(batch, multicall.execute())):
+                # 失败的子调用带回原始异常类型（回滚为 ContractLogicError，
+                # 返回数据无法解码为 BadFunctionCallOutput），与单独调用时一致
+                pending.result = result
+                pending.error = multicall.errors.get(i)
+        except Exception as e:
+            # 节点/网络故障交给所有调用方
+            self.errors += 1
+            logger.warning(f"⚠️ 合并调用失败({len(batch)}个调用): {str(e)}")
+            for pending in batch:
+                pending.error = e
+        finally:
+            for pending in batch:
+                pending.event.set()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                break
+            self._executor.submit(self._execute, batch)
+
+    def start(self):
+        """启动后台合并线程（首次调用时自动启动）"""
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='call-aggregator', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        """停止合并线程：队列中已有的调用立即发送，等待进行中的批次完成"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+    def reset_after_fork(self):
+        """fork 之后重建队列与线程池（父进程的线程不会被复制到子进程）"""
+        self._queue = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='call-aggregator')
+        self._thread = None
+        self._stopping = False
+
+    def stats(self):
+        """合并统计信息：批次大小与排队延迟，用于调整窗口"""
+        return {
+            'window_ms': round(self.window * 1000, 1),
+            'max_calls': self.max_calls,
+            'batches': self.batches,
+            'calls': self.calls,
+            'errors': self.errors,
+            'queued': len(self._queue),
+            'avg_batch_size': round(self.calls / self.batches, 2) if self.batches else None,
+            'max_batch_size': self.max_batch_size,
+            'avg_queue_delay_ms': round(self.total_queue_delay / self.calls * 1000, 2) if self.calls else None,
+            'max_queue_delay_ms': round(self.max_queue_delay * 1000, 2)
+        }
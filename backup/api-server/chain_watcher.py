@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+链上状态跟踪
+BlockCursor: 跟踪最新区块号（轮询 eth_blockNumber，或通过 WebSocket 订阅 newHeads），
+作为缓存失效的依据
+LogFollower: 跟踪合约事件日志，按涉及的地址精确失效缓存
+多进程部署时由一个进程跟踪并写入共享缓存后端，其余进程只读取（use_shared_state）
+"""
+
+import json
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 共享缓存后端中的状态键
+SHARED_HEAD_KEY = 'chain_head'
+SHARED_LOG_BLOCK_KEY = 'log_follower_block'
+SHARED_ADDRESS_PREFIX = 'log_block_'
+
+
+class BlockCursor:
+    """
+    全局区块游标
+
+    单个后台线程推进最新区块号；缓存条目记录写入时的区块号，
+    当游标越过该条目的失效区块后，条目即视为过期。
+    """
+
+    def __init__(self, w3, poll_interval=1.0, ws_url=None, max_lag=15,
+                 resubscribe_interval=60):
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.ws_url = ws_url
+        self.max_lag = max_lag
+        self.resubscribe_interval = resubscribe_interval
+
+        self.block = 0
+        self.updated_at = 0
+        self.source = 'poll'
+
+        self._listeners = []
+        self._invalidation = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.store = None
+        self.follower = False
+
+        self.polls = 0
+        self.poll_errors = 0
+        self.advances = 0
+
+    # ---------- 状态 ----------
+
+    def is_healthy(self):
+        """游标是否在 max_lag 秒内更新过"""
+        return self.block > 0 and time.time() - self.updated_at < self.max_lag
+
+    def invalidation_block(self, key):
+        """
+        键对应缓存需要的最低区块号
+
+        默认每个新区块都使所有条目失效；设置了日志跟踪器时按地址失效
+        """
+        if self._invalidation is not None:
+            block = self._invalidation(key)
+            if block is not None:
+                return block
+        return self.block
+
+    def set_invalidation(self, invalidation):
+        """设置按键失效规则 invalidation(key) -> 区块号或None"""
+        self._invalidation = invalidation
+
+    def is_current(self, key, block):
+        """在 block 写入的缓存条目是否仍然有效"""
+        return block is not None and block >= self.invalidation_block(key)
+
+    def add_listener(self, listener):
+        """注册新区块回调 listener(block_number)"""
+        self._listeners.append(listener)
+
+    def use_shared_state(self, store, follower):
+        """
+        多进程共享最新区块：follower=False 时每次更新写入 store，
+        follower=True 时从 store 读取（不请求RPC，store 中的值过期时才退回轮询RPC）
+        """
+        self.store = store
+        self.follower = follower
+
+    def advance(self, block_number, updated_at=None):
+        """推进游标"""
+        if self.store is not None and not self.follower:
+            self.store.set(SHARED_HEAD_KEY, block_number, ttl=self.max_lag)
+        with self._lock:
+            self.updated_at = updated_at or time.time()
+            if block_number <= self.block:
+                return False
+            self.block = block_number
+            self.advances += 1
+
+        for listener in self._listeners:
+            try:
+                listener(block_number)
+            except Exception as e:
+                logger.error(f"区块回调错误: {str(e)}")
+        return True
+
+    # ---------- 轮询 / 订阅 ----------
+
+    def poll_once(self):
+        """轮询一次最新区块号"""
+        self.polls += 1
+        if self.follower:
+            entry = self.store.get_entry(SHARED_HEAD_KEY)
+            if entry is not None and entry[2] > time.time():
+                self.source = 'shared'
+                self.advance(entry[0], updated_at=entry[1])
+                return
+            self.source = 'poll'
+        try:
+            self.advance(self.w3.eth.block_number)
+        except Exception as e:
+            self.poll_errors += 1
+            logger.warning(f"⚠️ 获取最新区块失败: {str(e)}")
+
+    def _subscribe(self):
+        """通过 WebSocket eth_subscribe newHeads 接收新区块，连接断开时返回"""
+        from websockets.sync.client import connect
+
+        with connect(self.ws_url, open_timeout=10) as ws:
+            ws.send(json.dumps({
+                'jsonrpc': '2.0', 'id': 1,
+                'method': 'eth_subscribe', 'params': ['newHeads']
+            }))
+            ack = json.loads(ws.recv(timeout=10))
+            if 'error' in ack:
+                raise RuntimeError(ack['error'])
+            logger.info(f"✅ 已订阅 newHeads: {self.ws_url}")
+            self.source = 'subscribe'
+
+            while not self._stop.is_set():
+                try:
+                    message = json.loads(ws.recv(timeout=self.max_lag))
+                except TimeoutError:
+                    # 长时间无新区块，回到轮询确认连接状态
+                    raise RuntimeError('newHeads 订阅超时')
+                head = message.get('params', {}).get('result', {})
+                if 'number' in head:
+                    self.advance(int(head['number'], 16))
+
+    def _run(self):
+        next_subscribe = 0
+        while not self._stop.is_set():
+            if self.ws_url and not self.follower and time.time() >= next_subscribe:
+                try:
+                    self._subscribe()
+                except Exception as e:
+                    logger.warning(f"⚠️ newHeads 订阅中断，改用轮询: {str(e)}")
+                self.source = 'poll'
+                next_subscribe = time.time() + self.resubscribe_interval
+                continue
+            self.poll_once()
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """启动后台跟踪线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='block-cursor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台跟踪线程"""
+        self._stop.set()
+        self._thread = None
+
+    def stats(self):
+        """游标统计信息"""
+        return {
+            'block': self.block,
+            'age': round(time.time() - self.updated_at, 3) if self.updated_at else None,
+            'healthy': self.is_healthy(),
+            'source': self.source,
+            'polls': self.polls,
+            'poll_errors': self.poll_errors,
+            'advances': self.advances
+        }
+
+
+class LogFollower:
+    """
+    合约日志跟踪器
+
+    每推进一个区块，用 eth_getLogs 拉取被跟踪合约的新日志并按ABI解码，
+    提取所有涉及的地址，调用 on_addresses(addresses, block) 使对应缓存失效。
+    """
+
+    def __init__(self, w3, cursor, sources, on_addresses, namespaces=(),
+                 max_range=500, max_lag=3, retain_blocks=2000):
+        """
+        sources: [(address, abi, topic_filters)]，topic_filters 为 None 表示不过滤，
+                 否则为多个 topics 过滤条件的列表（分别查询）
+        namespaces: 由日志驱动失效的缓存命名空间，其余键仍按每个区块失效
+        retain_blocks: 地址事件记录的保留区块数，应覆盖缓存条目的最长存活时间
+        """
+        self.w3 = w3
+        self.cursor = cursor
+        self.on_addresses = on_addresses
+        self.namespaces = tuple(namespaces)
+        self.max_range = max_range
+        self.max_lag = max_lag
+        self.retain_blocks = retain_blocks
+
+        self.sources = []
+        for address, abi, topic_filters in sources:
+            events = {}
+            for item in abi:
+                if item.get('type') != 'event':
+                    continue
+                signature = f"{item['name']}({','.join(i['type'] for i in item['inputs'])})"
+                events[w3.keccak(text=signature)] = item
+            self.sources.append((w3.to_checksum_address(address), events, topic_filters))
+
+        self.processed_block = 0
+        self.address_blocks = {}  # 小写地址 -> 最近一次相关事件所在区块
+        self._lock = threading.Lock()
+
+        self.store = None
+        self.follower = False
+        self.shared_ttl = None
+        self._shared_block = (0, 0)  # (共享的已处理区块, 读取时间)
+
+        self.logs_seen = 0
+        self.logs_decoded = 0
+        self.errors = 0
+
+    # ---------- 解码 ----------
+
+    def decode_addresses(self, log, events):
+        """从日志中提取所有 address 类型参数（包括非indexed参数）"""
+        topics = log['topics']
+        if not topics:
+            return set()
+        event = events.get(bytes(topics[0]))
+        if event is None:
+            return set()
+
+        indexed = [i for i in event['inputs'] if i.get('indexed')]
+        plain = [i for i in event['inputs'] if not i.get('indexed')]
+        if len(topics) != len(indexed) + 1:
+            # 同签名但indexed布局不同（如ERC20/ERC721 Transfer），无法按此ABI解码
+            return set()
+
+        addresses = set()
+        for param, topic in zip(indexed, topics[1:]):
+            if param['type'] == 'address':
+                addresses.add('0x' + bytes(topic)[-20:].hex())
+        if any(p['type'] == 'address' for p in plain):
+            values = self.w3.codec.decode([p['type'] for p in plain], bytes(log['data']))
+            for param, value in zip(plain, values):
+                if param['type'] == 'address':
+                    addresses.add(value.lower())
+        self.logs_decoded += 1
+        return addresses
+
+    # ---------- 跟踪 ----------
+
+    def fetch_range(self, from_block, to_block):
+        """拉取并处理 [from_block, to_block] 区间的日志"""
+        touched = {}
+        for address, events, topic_filters in self.sources:
+            for topics in (topic_filters or [None]):
+                params = {'address': address, 'fromBlock': from_block, 'toBlock': to_block}
+                if topics is not None:
+                    params['topics'] = topics
+                for log in self.w3.eth.get_logs(params):
+                    self.logs_seen += 1
+                    block = log['blockNumber']
+                    for addr in self.decode_addresses(log, events):
+                        touched[addr] = max(touched.get(addr, 0), block)
+
+        with self._lock:
+            for addr, block in touched.items():
+                if block > self.address_blocks.get(addr, 0):
+                    self.address_blocks[addr] = block
+            self.processed_block = to_block
+            # 早于任何缓存条目的事件记录不再需要，返回0即可
+            horizon = to_block - self.retain_blocks
+            if horizon > 0 and len(self.address_blocks) > 1000:
+                self.address_blocks = {
+                    addr: block for addr, block in self.address_blocks.items() if block > horizon
+                }
+
+        if self.store is not None:
+            for addr, block in touched.items():
+                self.store.set(SHARED_ADDRESS_PREFIX + addr, block, ttl=self.shared_ttl)
+            self.store.set(SHARED_LOG_BLOCK_KEY, to_block, ttl=self.shared_ttl)
+        if touched:
+            self.on_addresses(touched, to_block)
+        return touched
+
+    def on_block(self, block_number):
+        """新区块回调：补齐到最新区块"""
+        if self.processed_block == 0:
+            # 首次启动从当前区块开始跟踪
+            self.processed_block = block_number - 1
+        try:
+            while self.processed_block < block_number:
+                from_block = self.processed_block + 1
+                to_block = min(block_number, from_block + self.max_range - 1)
+                self.fetch_range(from_block, to_block)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ 拉取合约日志失败: {str(e)}")
+
+    def use_shared_state(self, store, follower, ttl):
+        """
+        多进程共享事件记录：follower=False 时把已处理区块和地址事件区块写入 store，
+        follower=True 时不拉取日志，失效判断从 store 读取（缓存清除由写入方完成）
+
+        ttl: 共享记录的保留时间（秒），应覆盖按区块缓存条目的最长存活时间
+        """
+        self.store = store
+        self.follower = follower
+        self.shared_ttl = ttl
+
+    def start(self):
+        """挂接到区块游标"""
+        if not self.follower:
+            self.cursor.add_listener(self.on_block)
+
+    def _processed(self):
+        """已处理区块；follower 从共享状态读取（每秒最多读取一次）"""
+        if not self.follower:
+            return self.processed_block
+        block, read_at = self._shared_block
+        now = time.time()
+        if now - read_at >= 1:
+            entry = self.store.get_entry(SHARED_LOG_BLOCK_KEY)
+            block = entry[0] if entry is not None else 0
+            self._shared_block = (block, now)
+        return block
+
+    def is_healthy(self):
+        """日志跟踪是否跟上最新区块"""
+        processed = self._processed()
+        return processed > 0 and self.cursor.block - processed <= self.max_lag
+
+    # ---------- 失效判断 ----------
+
+    def key_address(self, key):
+        """从缓存键中提取地址（仅限日志驱动的命名空间）"""
+        for namespace in self.namespaces:
+            if key.startswith(namespace + '_'):
+                return key[len(namespace) + 1:].lower()
+        return None
+
+    def invalidation_block(self, key):
+        """键对应缓存需要的最低区块号，None 表示按每个区块失效"""
+        address = self.key_address(key)
+        if address is None or not self.is_healthy():
+            return None
+        if self.follower:
+            # 共享记录缺失时无法区分“没有相关事件”与记录已过期或被淘汰，按每个区块失效
+            entry = self.store.get_entry(SHARED_ADDRESS_PREFIX + address)
+            return entry[0] if entry is not None else None
+        with self._lock:
+            return self.address_blocks.get(address, 0)
+
+    def stats(self):
+        """跟踪统计信息"""
+        return {
+            'processed_block': self._processed(),
+            'healthy': self.is_healthy(),
+            'follower': self.follower,
+            'tracked_addresses': len(self.address_blocks),
+            'logs_seen': self.logs_seen,
+            'logs_decoded': self.logs_decoded,
+            'errors': self.errors
+        }
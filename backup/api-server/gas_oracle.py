@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gas价格预言机
+每个新区块（或每隔几秒）在后台刷新一次 eth_gasPrice，并可选地根据 eth_feeHistory
+计算各百分位的Gas价格；准备交易时直接从内存读取，不再单独请求RPC
+"""
+
+import statistics
+import threading
+import time
+import logging
+
+from rpc_batch import RPCBatch
+
+logger = logging.getLogger(__name__)
+
+SHARED_GAS_KEY = 'gas_price_state'  # 共享缓存后端中的状态键
+
+
+class GasPriceOracle:
+    """
+    共享Gas价格
+
+    传入区块游标时挂接为新区块回调（同一区块只刷新一次，且相邻刷新至少间隔 min_interval 秒）；
+    否则由后台线程每 refresh_interval 秒刷新一次。值超过 max_age 秒未刷新时，读取方同步刷新。
+    """
+
+    def __init__(self, w3, cursor=None, refresh_interval=3.0, min_interval=1.0, max_age=15,
+                 fee_history_blocks=20, percentiles=(10, 50, 90)):
+        """
+        fee_history_blocks: eth_feeHistory 统计的区块数，为0时不计算百分位
+        percentiles: 优先费百分位，对应 slow / standard / fast
+        """
+        self.w3 = w3
+        self.cursor = cursor
+        self.refresh_interval = refresh_interval
+        self.min_interval = min_interval
+        self.max_age = max_age
+        self.fee_history_blocks = fee_history_blocks
+        self.percentiles = tuple(percentiles)
+
+        self.price = None
+        self.suggestions = {}
+        self.block = None
+        self.updated_at = 0
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.store = None
+        self.follower = False
+
+        self.refreshes = 0
+        self.errors = 0
+        self.sync_refreshes = 0
+
+    # ---------- 刷新 ----------
+
+    def _suggest(self, fee_history):
+        """根据 eth_feeHistory 计算各百分位的Gas价格（下一区块基础费 + 各区块优先费中位数）"""
+        rewards = fee_history.get('reward') or []
+        base_fees = fee_history.get('baseFeePerGas') or ['0x0']
+        next_base_fee = int(base_fees[-1], 16)
+        names = ('slow', 'standard', 'fast')
+        suggestions = {}
+        for i, percentile in enumerate(self.percentiles):
+            tips = [int(block_rewards[i], 16) for block_rewards in rewards if len(block_rewards) > i]
+            if not tips:
+                continue
+            name = names[i] if len(self.percentiles) == len(names) else f'p{percentile}'
+            suggestions[name] = next_base_fee + int(statistics.median(tips))
+        return suggestions
+
+    def refresh(self, block=None):
+        """刷新一次：eth_gasPrice 与 eth_feeHistory 合并为一次批量请求"""
+        batch = RPCBatch(self.w3)
+        batch.add_gas_price()
+        if self.fee_history_blocks:
+            batch.add(
+                'eth_feeHistory', [hex(self.fee_history_blocks), 'latest', list(self.percentiles)],
+                allow_failure=True
+            )
+        try:
+            results = batch.execute()
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ 刷新Gas价格失败: {str(e)}")
+            return self.price
+
+        suggestions = self._suggest(results[1]) if len(results) > 1 and results[1] else {}
+        with self._lock:
+            self.price = results[0]
+            if suggestions:
+                self.suggestions = suggestions
+            self.block = block
+            self.updated_at = time.time()
+            self.refreshes += 1
+        if self.store is not None and not self.follower:
+            self.store.set(SHARED_GAS_KEY, {
+                'price': self.price, 'suggestions': self.suggestions, 'block': block
+            }, ttl=self.max_age)
+        return self.price
+
+    def use_shared_state(self, store, follower):
+        """
+        多进程共享Gas价格：follower=False 时每次刷新写入 store，
+        follower=True 时不在后台刷新，读取时从 store 同步（store 中没有时才请求RPC）
+        """
+        self.store = store
+        self.follower = follower
+
+    def _load_shared(self):
+        """从共享状态读取Gas价格，返回是否读取成功"""
+        entry = self.store.get_entry(SHARED_GAS_KEY)
+        if entry is None or entry[2] <= time.time():
+            return False
+        state, stored_at = entry[0], entry[1]
+        with self._lock:
+            self.price = state['price']
+            self.suggestions = state['suggestions']
+            self.block = state['block']
+            self.updated_at = stored_at
+        return True
+
+    def on_block(self, block_number):
+        """新区块回调"""
+        if time.time() - self.updated_at >= self.min_interval:
+            self.refresh(block_number)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        """开始后台刷新"""
+        if self.follower:
+            return
+        if self.cursor is not None:
+            self.cursor.add_listener(self.on_block)
+            self.refresh(self.cursor.block or None)
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='gas-oracle', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    # ---------- 读取 ----------
+
+    def age(self):
+        return time.time() - self.updated_at if self.updated_at else None
+
+    def gas_price(self):
+        """当前Gas价格（wei）；值过旧时同步刷新，刷新失败仍返回旧值"""
+        if self.price is None or time.time() - self.updated_at > self.max_age:
+            if self.follower and self._load_shared():
+                return self.price
+            self.sync_refreshes += 1
+            price = self.refresh()
+            if price is None:
+                # 从未成功获取过：直接请求，失败时抛出异常
+                return self.w3.eth.gas_price
+            return price
+        return self.price
+
+    def stats(self):
+        """预言机状态"""
+        age = self.age()
+        return {
+            'gas_price': self.price,
+            'gas_price_gwei': round(self.price / 10**9, 4) if self.price is not None else None,
+            'suggestions': dict(self.suggestions),
+            'block': self.block,
+            'age': round(age, 3) if age is not None else None,
+            'source': 'shared' if self.follower else 'block' if self.cursor is not None else 'interval',
+            'refreshes': self.refreshes,
+            'sync_refreshes': self.sync_refreshes,
+            'errors': self.errors
+        }
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+交易Gas用量画像
+按合约函数（批量函数再按数组长度分桶）记录最近的 estimate_gas 结果，
+样本足够且未过期时直接返回画像值，只在未命中、过期或定期复核时才真正估算
+"""
+
+import statistics
+import threading
+import time
+from collections import deque
+
+
+class GasProfiles:
+    """
+    Gas用量画像
+
+    命中时返回窗口内样本的最大值（调用方再乘以安全系数）；复核估算结果与画像中位数
+    偏差超过 drift_tolerance 时视为漂移，丢弃旧样本重新学习。
+    """
+
+    def __init__(self, window=20, min_samples=3, ttl=600, reestimate_every=50,
+                 drift_tolerance=0.25):
+        """
+        window: 每个画像保留的样本数
+        min_samples: 开始使用画像所需的最少样本数
+        ttl: 画像最后一次估算后的有效时间（秒）
+        reestimate_every: 每命中多少次后复核估算一次
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.ttl = ttl
+        self.reestimate_every = reestimate_every
+        self.drift_tolerance = drift_tolerance
+
+        self.profiles = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.drifts = 0
+
+    def key_for(self, contract_function):
+        """画像键: (函数名, 各数组参数长度)，如 renewMultipleMiners 按批量大小分桶"""
+        sizes = tuple(len(arg) for arg in (contract_function.args or ()) if isinstance(arg, (list, tuple)))
+        return contract_function.fn_name, sizes
+
+    def lookup(self, key):
+        """返回画像Gas值；需要真正估算时返回 None"""
+        now = time.time()
+        with self._lock:
+            profile = self.profiles.get(key)
+            if (profile is None
+                    or len(profile['samples']) < self.min_samples
+                    or now - profile['updated_at'] > self.ttl
+                    or profile['served'] >= self.reestimate_every):
+                self.misses += 1
+                return None
+            profile['served'] += 1
+            self.hits += 1
+            return max(profile['samples'])
+
+    def record(self, key, gas):
+        """记录一次估算结果"""
+        with self._lock:
+            profile = self.profiles.get(key)
+            if profile is None:
+                profile = self.profiles[key] = {'samples': deque(maxlen=self.window)}
+            elif profile['samples']:
+                median = statistics.median(profile['samples'])
+                if abs(gas - median) > median * self.drift_tolerance:
+                    # 合约状态或逻辑变化导致用量漂移：重新学习
+                    profile['samples'].clear()
+                    self.drifts += 1
+            profile['samples'].append(gas)
+            profile['updated_at'] = time.time()
+            profile['served'] = 0
+
+    def stats(self):
+        """画像统计信息"""
+        with self._lock:
+            profiles = {
+                name + (f'[{",".join(map(str, sizes))}]' if sizes else ''): {
+                    'samples': len(p['samples']),
+                    'gas': max(p['samples']) if p['samples'] else None,
+                    'age': round(time.time() - p['updated_at'], 1)
+                }
+                for (name, sizes), p in self.profiles.items()
+            }
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'drifts': self.drifts,
+            'profiles': profiles
+        }
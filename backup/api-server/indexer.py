@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+链上状态索引
+从合约部署区块开始回填并跟踪新区块，将矿机、用户挖矿数据和推荐关系物化到本地 SQLite（WAL模式），
+API 可直接从索引读取，无需实时 eth_call
+"""
+
+import os
+import sqlite3
+import threading
+import logging
+
+from multicall import MulticallBatch
+
+logger = logging.getLogger(__name__)
+
+ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    number INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS miners (
+    token_id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    hash_power TEXT NOT NULL,
+    purchase_time INTEGER NOT NULL,
+    expiry_time INTEGER NOT NULL,
+    updated_block INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_miners_owner ON miners(owner);
+CREATE TABLE IF NOT EXISTS users (
+    address TEXT PRIMARY KEY,
+    total_hash_power TEXT NOT NULL,
+    own_hash_power TEXT NOT NULL,
+    referral_hash_power TEXT NOT NULL,
+    total_claimed TEXT NOT NULL,
+    total_mined TEXT NOT NULL,
+    miner_count INTEGER NOT NULL,
+    last_update_time INTEGER NOT NULL,
+    is_active INTEGER NOT NULL,
+    pending_rewards TEXT NOT NULL,
+    lock_end_time INTEGER NOT NULL,
+    valid_miner_count INTEGER NOT NULL,
+    valid_hash_power TEXT NOT NULL,
+    updated_block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS referrals (
+    user TEXT PRIMARY KEY,
+    referrer TEXT NOT NULL,
+    block INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer);
+CREATE TABLE IF NOT EXISTS dirty (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+"""
+
+
+def _topic_address(topic):
+    """indexed address topic -> 小写地址"""
+    return '0x' + bytes(topic)[-20:].hex()
+
+
+class ChainIndexer:
+    """
+    合约状态索引器
+
+    事件只用于发现发生变化的矿机/用户，具体状态通过合约 view 函数（Multicall批量）读取，
+    因此回滚区块后只需把受影响的行重新读取一次即可恢复一致。
+    """
+
+    def __init__(self, w3, contract, db_path, start_block=None, reorg_depth=12,
+                 batch_blocks=2000, poll_interval=1.0, max_lag=3, cursor=None):
+        self.w3 = w3
+        self.contract = contract
+        self.db_path = db_path
+        self.start_block = start_block
+        self.reorg_depth = reorg_depth
+        self.batch_blocks = batch_blocks
+        self.poll_interval = poll_interval
+        self.max_lag = max_lag
+        self.cursor = cursor
+
+        self.events = {}
+        for item in contract.abi:
+            if item.get('type') == 'event':
+                signature = f"{item['name']}({','.join(i['type'] for i in item['inputs'])})"
+                self.events[bytes(w3.keccak(text=signature))] = item
+
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.head_block = 0
+        self.backfilled = False
+        self.follower = False
+        self.reorgs = 0
+        self.errors = 0
+
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._writer.commit()
+        self.processed_block = int(self._get_meta('processed_block', 0))
+
+    # ---------- 数据库 ----------
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self):
+        """每个线程一个只读连接（WAL模式下读写互不阻塞）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _get_meta(self, key, default=None, conn=None):
+        row = (conn or self._writer).execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    def _set_meta(self, key, value):
+        self._writer.execute(
+            'INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, str(value))
+        )
+
+    def _mark_dirty(self, token_ids, users):
+        """记录待刷新的矿机/用户（与 processed_block 在同一事务中提交，刷新成功后删除）"""
+        self._writer.executemany(
+            'INSERT OR IGNORE INTO dirty VALUES (?, ?)',
+            [('miner', str(t)) for t in token_ids] + [('user', u) for u in users]
+        )
+
+    def _pending_dirty(self):
+        """读取尚未刷新的矿机/用户（上次刷新失败或进程在回填中途退出）"""
+        token_ids, users = set(), set()
+        for row in self._writer.execute('SELECT kind, id FROM dirty'):
+            if row['kind'] == 'miner':
+                token_ids.add(int(row['id']))
+            else:
+                users.add(row['id'])
+        return token_ids, users
+
+    # ---------- 部署区块 ----------
+
+    def find_deployment_block(self):
+        """二分查找合约部署区块（需要节点支持历史状态查询）"""
+        low, high = 0, self.w3.eth.block_number
+        address = self.contract.address
+        while low < high:
+            middle = (low + high) // 2
+            if len(self.w3.eth.get_code(address, middle)) > 0:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _initial_block(self):
+        if self.start_block is not None:
+            return self.start_block
+        try:
+            block = self.find_deployment_block()
+        except Exception as e:
+            # 不能从当前区块开始：之前的矿机/推荐关系会缺失，索引却显示已就绪。
+            # 保持未就绪（接口继续实时读取），下次轮询重试，或通过 start_block 显式指定
+            raise RuntimeError(f"无法确定部署区块，请配置起始区块: {str(e)}") from e
+        logger.info(f"✅ 合约部署区块: {block}")
+        return block
+
+    # ---------- 回滚检测 ----------
+
+    def _check_reorg(self):
+        """检查已处理的最近区块哈希是否仍在主链上，返回分叉点或None"""
+        rows = self._writer.execute(
+            'SELECT number, hash FROM blocks ORDER BY number DESC LIMIT ?', (self.reorg_depth,)
+        ).fetchall()
+        if not rows or rows[0]['hash'] == self.w3.eth.get_block(rows[0]['number'])['hash'].hex():
+            return None
+        for row in rows[1:]:
+            if self.w3.eth.get_block(row['number'])['hash'].hex() == row['hash']:
+                return row['number']
+        return rows[-1]['number'] - 1
+
+    def _rollback(self, fork_block):
+        """回滚到分叉点：分叉后变化的行重新读取，推荐关系重新扫描"""
+        logger.warning(f"⚠️ 检测到区块回滚，回退到区块 {fork_block}")
+        self.reorgs += 1
+        with self._write_lock:
+            token_ids = [r['token_id'] for r in self._writer.execute(
+                'SELECT token_id FROM miners WHERE updated_block > ?', (fork_block,))]
+            users = [r['address'] for r in self._writer.execute(
+                'SELECT address FROM users WHERE updated_block > ?', (fork_block,))]
+            self._writer.execute('DELETE FROM referrals WHERE block > ?', (fork_block,))
+            self._writer.execute('DELETE FROM blocks WHERE number > ?', (fork_block,))
+            self._mark_dirty(token_ids, users)
+            self.processed_block = fork_block
+            self._set_meta('processed_block', fork_block)
+            self._writer.commit()
+        self._refresh(set(token_ids), set(users), fork_block)
+
+    # ---------- 事件处理 ----------
+
+    def _scan(self, from_block, to_block, dirty_miners, dirty_users):
+        """扫描区间日志，收集变化的矿机/用户，返回新推荐关系"""
+        referrals = []
+        logs = self.w3.eth.get_logs({
+            'address': self.contract.address,
+            'fromBlock': from_block,
+            'toBlock': to_block
+        })
+        for log in logs:
+            topics = log['topics']
+            event = self.events.get(bytes(topics[0])) if topics else None
+            if event is None:
+                continue
+            name = event['name']
+            indexed = [i for i in event['inputs'] if i.get('indexed')]
+            plain = [i for i in event['inputs'] if not i.get('indexed')]
+            args = {}
+            for param, topic in zip(indexed, topics[1:]):
+                args[param['name']] = _topic_address(topic) if param['type'] == 'address' else int.from_bytes(bytes(topic), 'big')
+            if plain:
+                values = self.w3.codec.decode([p['type'] for p in plain], bytes(log['data']))
+                for param, value in zip(plain, values):
+                    args[param['name']] = value.lower() if param['type'] == 'address' else value
+
+            for param in event['inputs']:
+                if param['type'] == 'address' and args.get(param['name'], ZERO_ADDRESS) != ZERO_ADDRESS:
+                    dirty_users.add(args[param['name']])
+            if 'tokenId' in args:
+                dirty_miners.add(int(args['tokenId']))
+            if name == 'MinerPurchased' and args.get('referrer', ZERO_ADDRESS) != ZERO_ADDRESS:
+                referrals.append((args['buyer'], args['referrer'], log['blockNumber']))
+        return referrals
+
+    def _refresh(self, token_ids, users, block):
+        """通过 Multicall 重新读取矿机和用户的当前状态并写入索引"""
+        token_ids = sorted(token_ids)
+        users = sorted(users)
+        if not token_ids and not users:
+            return
+
+        batch = MulticallBatch(self.w3)
+        for token_id in token_ids:
+            batch.add(self.contract.functions.getNFTMetadata(token_id))
+            batch.add(self.contract.functions.ownerOf(token_id))
+        for user in users:
+            batch.add(self.contract.functions.getUserMiningData(self.w3.to_checksum_address(user)))
+        results = batch.execute()
+
+        with self._write_lock:
+            for i, token_id in enumerate(token_ids):
+                metadata, owner = results[2 * i], results[2 * i + 1]
+                if metadata is None or owner is None:
+                    # 矿机不存在（如回滚掉的购买）
+                    self._writer.execute('DELETE FROM miners WHERE token_id = ?', (token_id,))
+                    continue
+                # getNFTMetadata 返回值: [level, hashPower, purchaseTime, expiryTime]
+                self._writer.execute(
+                    'INSERT OR REPLACE INTO miners VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (token_id, owner.lower(), metadata[0], str(metadata[1]),
+                     metadata[2], metadata[3], block)
+                )
+            offset = 2 * len(token_ids)
+            for i, user in enumerate(users):
+                info = results[offset + i]
+                if info is None:
+                    continue
+                self._writer.execute(
+                    'INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (user, str(info[0]), str(info[1]), str(info[2]), str(info[3]), str(info[4]),
+                     info[5], info[6], int(info[7]), str(info[8]), info[9], info[10],
+                     str(info[11]), block)
+                )
+            self._writer.executemany(
+                'DELETE FROM dirty WHERE kind = ? AND id = ?',
+                [('miner', str(t)) for t in token_ids] + [('user', u) for u in users]
+            )
+            self._writer.commit()
+
+    def index_range(self, from_block, to_block, dirty_miners, dirty_users):
+        """
+        索引区间 [from_block, to_block]，变化的矿机/用户收集到 dirty 集合中由调用方刷新
+
+        变化的矿机/用户与区间进度在同一事务中写入 dirty 表，刷新失败或进程退出后下次继续刷新
+        """
+        token_ids, users = set(), set()
+        referrals = self._scan(from_block, to_block, token_ids, users)
+        block_hash = self.w3.eth.get_block(to_block)['hash'].hex()
+
+        with self._write_lock:
+            self._mark_dirty(token_ids, users)
+            for user, referrer, block in referrals:
+                self._writer.execute(
+                    'INSERT OR IGNORE INTO referrals VALUES (?, ?, ?)', (user, referrer, block)
+                )
+            self._writer.execute('INSERT OR REPLACE INTO blocks VALUES (?, ?)', (to_block, block_hash))
+            self._writer.execute(
+                'DELETE FROM blocks WHERE number <= ?', (to_block - self.reorg_depth * 4,)
+            )
+            self.processed_block = to_block
+            self._set_meta('processed_block', to_block)
+            self._writer.commit()
+        dirty_miners |= token_ids
+        dirty_users |= users
+
+    def step(self):
+        """推进一次索引，返回是否已追上最新区块"""
+        head = self.cursor.block if self.cursor is not None and self.cursor.is_healthy() \
+            else self.w3.eth.block_number
+        self.head_block = head
+
+        if self.processed_block == 0:
+            self.processed_block = self._initial_block() - 1
+        else:
+            fork_block = self._check_reorg()
+            if fork_block is not None:
+                self._rollback(fork_block)
+
+        # 回填阶段累积变化，追上后统一读取一次状态（包括之前未刷新成功的）
+        dirty_miners, dirty_users = self._pending_dirty()
+        while self.processed_block < head and not self._stop.is_set():
+            from_block = self.processed_block + 1
+            to_block = min(head, from_block + self.batch_blocks - 1)
+            self.index_range(from_block, to_block, dirty_miners, dirty_users)
+            if len(dirty_miners) + len(dirty_users) > 5000:
+                self._refresh(dirty_miners, dirty_users, to_block)
+                dirty_miners, dirty_users = set(), set()
+        self._refresh(dirty_miners, dirty_users, self.processed_block)
+
+        if not self.backfilled and self.processed_block >= head:
+            self.backfilled = True
+            logger.info(f"✅ 索引回填完成，当前区块: {self.processed_block}")
+        with self._write_lock:
+            # 供只读进程判断索引状态
+            self._set_meta('head_block', head)
+            self._set_meta('backfilled', int(self.backfilled))
+            self._writer.commit()
+        return self.processed_block >= head
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"索引错误: {str(e)}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """启动后台索引线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='chain-indexer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台索引线程"""
+        self._stop.set()
+        self._thread = None
+
+    def follow(self):
+        """只读模式：索引由其他进程写入，本进程只查询（就绪状态从数据库读取）"""
+        self.follower = True
+
+    def reset_after_fork(self):
+        """fork 之后重新打开数据库连接（SQLite 连接不能跨进程使用）"""
+        self._writer = self._connect()
+        self._local = threading.local()
+
+    # ---------- 查询 ----------
+
+    def _sync_from_db(self):
+        """只读模式：从数据库读取写入进程的索引进度"""
+        reader = self._reader()
+        self.processed_block = int(self._get_meta('processed_block', 0, reader))
+        self.head_block = int(self._get_meta('head_block', 0, reader))
+        self.backfilled = self._get_meta('backfilled', '0', reader) == '1'
+
+    def is_ready(self):
+        """索引是否已回填完成且跟上最新区块"""
+        if self.follower:
+            self._sync_from_db()
+        head = self.cursor.block if self.cursor is not None and self.cursor.is_healthy() else self.head_block
+        return self.backfilled and head - self.processed_block <= self.max_lag
+
+    def get_user(self, address):
+        """读取用户挖矿数据，未参与过的用户返回 None"""
+        return self._reader().execute(
+            'SELECT * FROM users WHERE address = ?', (address.lower(),)
+        ).fetchone()
+
+    def get_miners(self, owner):
+        """读取用户持有的矿机"""
+        return self._reader().execute(
+            'SELECT * FROM miners WHERE owner = ? ORDER BY token_id', (owner.lower(),)
+        ).fetchall()
+
+    def get_referrals(self, referrer):
+        """读取直推用户列表"""
+        return [row['user'] for row in self._reader().execute(
+            'SELECT user FROM referrals WHERE referrer = ? ORDER BY block', (referrer.lower(),)
+        )]
+
+    def stats(self):
+        """索引统计信息"""
+        reader = self._reader()
+        return {
+            'db_path': os.path.abspath(self.db_path),
+            'follower': self.follower,
+            'processed_block': self.processed_block,
+            'head_block': self.head_block,
+            'backfilled': self.backfilled,
+            'ready': self.is_ready(),
+            'miners': reader.execute('SELECT COUNT(*) FROM miners').fetchone()[0],
+            'users': reader.execute('SELECT COUNT(*) FROM users').fetchone()[0],
+            'referrals': reader.execute('SELECT COUNT(*) FROM referrals').fetchone()[0],
+            'dirty': reader.execute('SELECT COUNT(*) FROM dirty').fetchone()[0],
+            'reorgs': self.reorgs,
+            'errors': self.errors
+        }
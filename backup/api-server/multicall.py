@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multicall3 批量读取
+将多个 view 调用打包为一次 aggregate3 eth_call，减少 RPC 往返次数
+"""
+
+import logging
+import time
+
+from eth_abi.exceptions import DecodingError
+from web3.exceptions import ContractLogicError, BadFunctionCallOutput
+
+logger = logging.getLogger(__name__)
+
+# ==================== 配置 ====================
+
+# Multicall3 在 BSC 主网及绝大多数 EVM 链上的统一部署地址
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+# 单次 aggregate3 调用的 calldata 上限（字节），超出则自动分块
+MULTICALL_MAX_CALLDATA_BYTES = 24000
+
+# 单次 aggregate3 调用包含的最大子调用数
+MULTICALL_MAX_CALLS = 200
+
+# 链上没有 Multicall3（aggregate3 返回空数据）时，多久之后再尝试（秒）
+MULTICALL_RETRY_INTERVAL = 600
+
+# Multicall3 地址 -> 不可用状态的截止时间
+_unavailable_until = {}
+
+
+class MulticallUnavailable(Exception):
+    """aggregate3 返回空数据：链上没有部署 Multicall3"""
+
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"}
+                ],
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"}
+                ],
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "getCurrentBlockTimestamp",
+        "outputs": [{"name": "timestamp", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "addr", "type": "address"}],
+        "name": "getEthBalance",
+        "outputs": [{"name": "balance", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "getBlockNumber",
+        "outputs": [{"name": "blockNumber", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+# aggregate3 中每个子调用的固定编码开销：
+# 元组偏移 + address + bool + bytes偏移 + bytes长度，各 32 字节
+_CALL_OVERHEAD_BYTES = 32 * 5
+
+
+def _abi_type(param):
+    """将ABI参数描述转换为类型字符串（支持tuple）"""
+    abi_type = param['type']
+    if abi_type.startswith('tuple'):
+        inner = ','.join(_abi_type(c) for c in param['components'])
+        return f'({inner}){abi_type[5:]}'
+    return abi_type
+
+
+def is_call_error(error):
+    """调用本身的失败（回滚、返回数据无法解码），区别于节点/网络故障"""
+    return isinstance(error, (ContractLogicError, BadFunctionCallOutput, DecodingError))
+
+
+def _encoded_size(calldata):
+    """估算单个子调用在 aggregate3 中的编码长度"""
+    data_len = (len(calldata) - 2) // 2
+    return _CALL_OVERHEAD_BYTES + ((data_len + 31) // 32) * 32
+
+
+class MulticallBatch:
+    """
+    Multicall3 批量调用
+
+    用法:
+        batch = MulticallBatch(w3)
+        batch.add(contract.functions.getNFTMetadata(1))
+        ts_index = batch.add_block_timestamp()
+        results = batch.execute()
+
+    execute() 返回与 add() 顺序一致的解码结果；允许失败的子调用回滚或解码失败时返回 None，
+    异常记录在 errors[索引]。节点/网络故障不做拆分重试，直接抛出。
+    """
+
+    def __init__(self, w3, address=MULTICALL3_ADDRESS,
+                 max_calldata_bytes=MULTICALL_MAX_CALLDATA_BYTES,
+                 max_calls=MULTICALL_MAX_CALLS):
+        self.w3 = w3
+        self.contract = w3.eth.contract(
+            address=w3.to_checksum_address(address),
+            abi=MULTICALL3_ABI
+        )
+        self.max_calldata_bytes = max_calldata_bytes
+        self.max_calls = max_calls
+        self.calls = []
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.calls)
+
+    def add(self, contract_function, allow_failure=True):
+        """添加一个已绑定参数的合约函数调用，返回其结果索引"""
+        self.calls.append({
+            'function': contract_function,
+            'target': contract_function.address,
+            'calldata': contract_function._encode_transaction_data(),
+            'output_types': [_abi_type(o) for o in contract_function.abi.get('outputs', [])],
+            'allow_failure': allow_failure,
+            'name': contract_function.fn_name
+        })
+        return len(self.calls) - 1
+
+    def add_block_timestamp(self):
+        """添加 Multicall3.getCurrentBlockTimestamp 调用，返回其结果索引"""
+        return self.add(self.contract.functions.getCurrentBlockTimestamp(), allow_failure=False)
+
+    def add_eth_balance(self, address):
+        """添加 Multicall3.getEthBalance 调用（原生币余额），返回其结果索引"""
+        return self.add(self.contract.functions.getEthBalance(address))
+
+    def _chunks(self, indexes):
+        """按 calldata 大小和调用数量将子调用分块"""
+        chunk = []
+        chunk_size = 0
+        for index in indexes:
+            size = _encoded_size(self.calls[index]['calldata'])
+            if chunk and (chunk_size + size > self.max_calldata_bytes or len(chunk) >= self.max_calls):
+                yield chunk
+                chunk = []
+                chunk_size = 0
+            chunk.append(index)
+            chunk_size += size
+        if chunk:
+            yield chunk
+
+    def _decode(self, call, return_data):
+        """解码子调用返回值，单返回值与 ContractFunction.call() 保持一致"""
+        values = self.w3.codec.decode(call['output_types'], bytes(return_data))
+        if len(values) == 1:
+            return values[0]
+        return list(values)
+
+    def _fail(self, index, error, results):
+        """记录子调用失败；不允许失败的调用直接抛出"""
+        call = self.calls[index]
+        if not call['allow_failure']:
+            raise error
+        logger.warning(f"⚠️ 子调用失败 {call['name']}: {str(error)}")
+        self.errors[index] = error
+        results[index] = None
+
+    def _add_direct(self, batch, call, block_identifier):
+        """向 RPCBatch 添加不经过 Multicall3 的等价调用（Multicall3 自身的辅助函数换成对应的 RPC 方法）"""
+        function = call['function']
+        if call['target'] == self.contract.address:
+            block = hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+            if call['name'] == 'getEthBalance':
+                return batch.add_balance(function.args[0], block_identifier)
+            if call['name'] == 'getCurrentBlockTimestamp':
+                return batch.add('eth_getBlockByNumber', [block, False], lambda b: int(b['timestamp'], 16))
+            if call['name'] == 'getBlockNumber':
+                return batch.add('eth_blockNumber', [], lambda n: int(n, 16))
+        return batch.add_call(function, block_identifier, allow_failure=True)
+
+    def _execute_direct(self, indexes, block_identifier, results):
+        """不经过 Multicall3，作为一次 JSON-RPC 批量请求逐个调用"""
+        from rpc_batch import RPCBatch  # rpc_batch 依赖本模块的 _abi_type
+
+        batch = RPCBatch(self.w3)
+        for i in indexes:
+            self._add_direct(batch, self.calls[i], block_identifier)
+        values = batch.execute()
+        for position, (i, value) in enumerate(zip(indexes, values)):
+            error = batch.errors.get(position)
+            if error is None:
+                results[i] = value
+            elif is_call_error(error):
+                if isinstance(error, DecodingError):
+                    # 与 aggregate3 路径及 web3 单独调用一致：返回数据无法解码为 BadFunctionCallOutput
+                    error = BadFunctionCallOutput(f'{self.calls[i]["name"]}: {str(error)}')
+                self._fail(i, error, results)
+            else:
+                raise error
+
+    def _execute_chunk(self, indexes, block_identifier, results):
+        """执行一个分块；aggregate3 本身回滚时二分重试（定位导致回滚的调用），其他错误直接抛出"""
+        if len(indexes) == 1:
+            self._execute_direct(indexes, block_identifier, results)
+            return
+
+        payload = [
+            (self.calls[i]['target'], self.calls[i]['allow_failure'], self.calls[i]['calldata'])
+            for i in indexes
+        ]
+        try:
+            responses = self.contract.functions.aggregate3(payload).call(
+                block_identifier=block_identifier
+            )
+        except (BadFunctionCallOutput, DecodingError) as e:
+            raise MulticallUnavailable(str(e))
+        except ContractLogicError as e:
+            logger.warning(f"⚠️ Multicall分块回滚({len(indexes)}个调用)，拆分重试: {str(e)}")
+            middle = len(indexes) // 2
+            self._execute_chunk(indexes[:middle], block_identifier, results)
+            self._execute_chunk(indexes[middle:], block_identifier, results)
+            return
+
+        for i, (success, return_data) in zip(indexes, responses):
+            call = self.calls[i]
+            if not success:
+                self._fail(i, ContractLogicError(f'execution reverted: {call["name"]}'), results)
+                continue
+            try:
+                results[i] = self._decode(call, return_data)
+            except DecodingError as e:
+                self._fail(i, BadFunctionCallOutput(f'{call["name"]}: {str(e)}'), results)
+
+    def execute(self, block_identifier='latest'):
+        """执行全部子调用，返回结果列表"""
+        results = [None] * len(self.calls)
+        self.errors = {}
+        indexes = list(range(len(self.calls)))
+        if not indexes:
+            return results
+
+        if time.time() < _unavailable_until.get(self.contract.address, 0):
+            self._execute_direct(indexes, block_identifier, results)
+            return results
+
+        for chunk in self._chunks(indexes):
+            try:
+                self._execute_chunk(chunk, block_identifier, results)
+            except MulticallUnavailable as e:
+                # 该链上没有部署 Multicall3：改为 JSON-RPC 批量请求
+                logger.warning(f"⚠️ Multicall3 不可用，改为JSON-RPC批量请求: {str(e)}")
+                _unavailable_until[self.contract.address] = time.time() + MULTICALL_RETRY_INTERVAL
+                remaining = [i for i in indexes if i >= chunk[0]]
+                self._execute_direct(remaining, block_identifier, results)
+                break
+        return results
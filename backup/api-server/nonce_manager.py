@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地nonce管理
+每个地址首次准备交易时读取链上 pending nonce（与准备交易的估算合并为一次JSON-RPC批量请求），
+之后在宽限期内连续准备的交易（如先授权再购买）直接在本地递增分配，不再请求RPC；
+后台定期与链上 pending 状态对账，超过宽限期未再分配的地址重新从链上读取
+"""
+
+import threading
+import time
+import logging
+
+from rpc_batch import RPCBatch
+
+logger = logging.getLogger(__name__)
+
+SHARED_NONCE_PREFIX = 'nonce_'  # 共享缓存后端中的分配状态键前缀（后接地址）
+
+
+class NonceManager:
+    """
+    nonce 分配器
+
+    宽限期内的分配从本地记录的下一个nonce开始（不低于对账读到的链上 pending nonce）；
+    距最近一次分配超过 grace 秒时视为之前的交易已上链或已放弃（未签名、在钱包中取消），
+    回退到链上值，钱包中取消的交易最多让该地址的后续交易在nonce空洞上等待一个宽限期。
+    """
+
+    def __init__(self, w3, grace=60, reconcile_interval=5, batch_size=100):
+        """
+        grace: 分配记录的宽限期（秒），超过后重新读取链上 pending nonce
+        reconcile_interval: 后台对账间隔（秒）
+        batch_size: 每次对账批量请求的地址数
+        """
+        self.w3 = w3
+        self.grace = grace
+        self.reconcile_interval = reconcile_interval
+        self.batch_size = batch_size
+
+        self.entries = {}  # 地址 -> {'next': 下一个可分配的nonce, 'chain': 链上pending nonce, 'reserved_at': 最近分配时间}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.store = None
+
+        self.reserved = 0
+        self.local = 0
+        self.reconciles = 0
+        self.confirmed = 0
+        self.released = 0
+
+    def use_shared_state(self, store):
+        """多进程共享分配记录：同一地址连续的两次准备落在不同 worker 时也不会分配到相同nonce"""
+        self.store = store
+
+    def _entry(self, address, now):
+        """宽限期内的分配记录（合并共享状态），没有时返回 None；调用方持有锁"""
+        entry = self.entries.get(address)
+        if self.store is not None:
+            shared = self.store.get(SHARED_NONCE_PREFIX + address.lower())
+            if shared is not None and (entry is None or shared['next'] > entry['next']):
+                entry = self.entries[address] = dict(shared)
+        if entry is not None and now - entry['reserved_at'] >= self.grace:
+            return None
+        return entry
+
+    def next_nonce(self, address):
+        """本地可分配的下一个nonce；没有宽限期内的记录时返回 None（需读取链上 pending nonce）"""
+        with self._lock:
+            entry = self._entry(address, time.time())
+            return max(entry['next'], entry['chain']) if entry is not None else None
+
+    def reserve(self, address, count=1, chain_nonce=None):
+        """
+        为一次准备的 count 笔交易分配连续 nonce，返回第一个
+
+        chain_nonce: 本次请求读取的链上 pending nonce（next_nonce() 返回 None 时读取）；
+        未给出且没有宽限期内的记录时同步读取一次
+        """
+        while True:
+            if chain_nonce is None and self.next_nonce(address) is None:
+                chain_nonce = self.w3.eth.get_transaction_count(address, 'pending')
+            now = time.time()
+            with self._lock:
+                entry = self._entry(address, now)
+                if entry is None:
+                    if chain_nonce is None:
+                        continue  # 记录恰好过期：读取链上值后重试
+                    nonce, chain = chain_nonce, chain_nonce
+                else:
+                    # 对账或本次读取到的链上值更高时（地址在其他地方发送过交易）跳到链上值
+                    chain = max(entry['chain'], chain_nonce or 0)
+                    nonce = max(entry['next'], chain)
+                    self.local += 1
+                entry = self.entries[address] = {'next': nonce + count, 'chain': chain, 'reserved_at': now}
+                if self.store is not None:
+                    self.store.set(SHARED_NONCE_PREFIX + address.lower(), entry, ttl=self.grace)
+                self.reserved += 1
+                return nonce
+
+    def reconcile(self):
+        """与链上 pending nonce 对账：已全部上链的地址移除，超过宽限期的回退到链上值"""
+        with self._lock:
+            addresses = list(self.entries)
+
+        for start in range(0, len(addresses), self.batch_size):
+            chunk = addresses[start:start + self.batch_size]
+            batch = RPCBatch(self.w3)
+            for address in chunk:
+                batch.add_transaction_count(address, 'pending')
+            try:
+                results = batch.execute()
+            except Exception as e:
+                logger.warning(f"⚠️ nonce对账失败: {str(e)}")
+                return
+
+            now = time.time()
+            with self._lock:
+                for address, chain_nonce in zip(chunk, results):
+                    entry = self.entries.get(address)
+                    if entry is None:
+                        continue
+                    entry['chain'] = max(entry['chain'], chain_nonce)
+                    if chain_nonce >= entry['next']:
+                        self.confirmed += 1
+                        del self.entries[address]
+                        self._drop_shared(address, chain_nonce)
+                    elif now - entry['reserved_at'] >= self.grace:
+                        # 交易未签名或在钱包中被取消
+                        self.released += 1
+                        del self.entries[address]
+        self.reconciles += 1
+
+    def _drop_shared(self, address, chain_nonce):
+        """其他 worker 未在其后继续分配时删除共享记录；调用方持有锁"""
+        if self.store is None:
+            return
+        key = SHARED_NONCE_PREFIX + address.lower()
+        shared = self.store.get(key)
+        if shared is not None and shared['next'] <= chain_nonce:
+            self.store.delete(key)
+
+    def _run(self):
+        while not self._stop.wait(self.reconcile_interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"nonce对账错误: {str(e)}")
+
+    def start(self):
+        """启动后台对账线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='nonce-manager', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def stats(self):
+        """nonce 分配统计"""
+        return {
+            'tracked_addresses': len(self.entries),
+            'reserved': self.reserved,
+            'local': self.local,
+            'reconciles': self.reconciles,
+            'confirmed': self.confirmed,
+            'released': self.released
+        }
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 响应数据格式
+将合约返回值转换为接口 JSON 结构，同步和异步服务器共用，保证响应格式一致
+"""
+
+import hashlib
+import json
+import time
+
+from web3 import Web3
+
+# 数据内容的 ETag 不包含的字段（任意层级）：加载时间戳，以及按当前时间计算的矿机剩余时间
+# （索引路径按请求时间计算，否则 ETag 每秒变化；isExpired 仍计入，到期时 ETag 随之变化）
+ETAG_EXCLUDED_FIELDS = ('timestamp', 'remainingTime', 'remainingDays')
+
+
+def normalize_address(address):
+    """规范化地址（校验后转为小写），同一钱包不同大小写写法共用一组缓存"""
+    return Web3.to_checksum_address(address.strip()).lower()
+
+
+def for_address(data, address):
+    """缓存的数据按规范化（小写）地址生成，响应中的 address 恢复为请求中的写法"""
+    if isinstance(data, dict) and data.get('address') not in (None, address):
+        return dict(data, address=address)
+    return data
+
+
+def is_incomplete(data):
+    """部分读取失败的数据（返回给请求方，但不写入缓存）"""
+    return isinstance(data, dict) and bool(data.get('incomplete'))
+
+
+def _etag_content(data):
+    """去掉 ETAG_EXCLUDED_FIELDS 后的数据"""
+    if isinstance(data, dict):
+        return {k: _etag_content(v) for k, v in data.items() if k not in ETAG_EXCLUDED_FIELDS}
+    if isinstance(data, list):
+        return [_etag_content(item) for item in data]
+    return data
+
+
+def data_etag(data):
+    """数据内容的哈希（弱 ETag：响应中的 cached/stale 等字段、剩余时间与压缩编码不影响其值）"""
+    payload = json.dumps(_etag_content(data), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:20]
+
+
+def format_mining_info(address, mining_info):
+    """getUserMiningData 返回值 -> mining-info 数据"""
+    # V19返回值: [totalHashPower, ownHashPower, referralHashPower, totalClaimed,
+    #             totalMined, minerCount, lastUpdateTime, isActive, pendingRewards,
+    #             lockEndTime, validMinerCount, validHashPower]
+    return {
+        'address': address,
+        'totalHashPower': str(mining_info[0]),
+        'ownHashPower': str(mining_info[1]),
+        'referralHashPower': str(mining_info[2]),
+        'totalClaimed': str(Web3.from_wei(mining_info[3], 'ether')),
+        'totalMined': str(Web3.from_wei(mining_info[4], 'ether')),
+        'minerCount': mining_info[5],
+        'lastUpdateTime': mining_info[6],
+        'isActive': mining_info[7],
+        'pendingRewards': str(Web3.from_wei(mining_info[8], 'ether')),
+        'lockEndTime': mining_info[9],
+        'validMinerCount': mining_info[10],
+        'validHashPower': str(mining_info[11]),
+        'timestamp': int(time.time())
+    }
+
+
+def format_miner(token_id, level, hash_power, purchase_time, expiry_time,
+                 current_time=None, is_expired=None, remaining_time=None):
+    """单个矿机数据；未给出 is_expired/remaining_time 时按 current_time 计算"""
+    if remaining_time is None:
+        remaining_time = max(0, expiry_time - current_time)
+    if is_expired is None:
+        is_expired = current_time >= expiry_time
+    remaining_time = int(remaining_time)
+    return {
+        'tokenId': int(token_id),
+        'level': level,
+        'hashPower': str(hash_power),
+        'purchaseTime': purchase_time,
+        'expiryTime': expiry_time,
+        'isExpired': is_expired,
+        'remainingTime': remaining_time,
+        'remainingDays': round(remaining_time / 86400, 2)
+    }
+
+
+def format_miners_detail(detail, hash_powers):
+    """getUserMinersDetail 返回值 -> 矿机列表（hash_powers 缺少某个等级时抛出 KeyError）"""
+    # 返回值: [tokenIds, levels, purchaseTimes, expiryTimes, isExpiredList, remainingTimes]
+    token_ids, levels, purchase_times, expiry_times, expired_list, remaining_times = detail
+    return [
+        format_miner(
+            token_id, levels[i], hash_powers[levels[i]],
+            purchase_times[i], expiry_times[i],
+            is_expired=expired_list[i], remaining_time=remaining_times[i]
+        )
+        for i, token_id in enumerate(token_ids)
+    ]
+
+
+def format_metadata_miners(miner_ids, results, current_time):
+    """
+    getUserMiners + 逐个 getNFTMetadata 的结果 -> (矿机列表, 读取失败的tokenId)
+
+    results 与 miner_ids 一一对应，读取失败的为 None 或异常
+    """
+    miners = []
+    missing = []
+    for miner_id, miner_info in zip(miner_ids, results):
+        if miner_info is None or isinstance(miner_info, Exception):
+            missing.append(miner_id)
+            continue
+        # 返回值: [level, hashPower, purchaseTime, expiryTime]
+        miners.append(format_miner(miner_id, *miner_info, current_time=current_time))
+    return miners, missing
+
+
+def format_user_miners(address, miners, source, missing=None):
+    """miners 数据；部分矿机读取失败时标记 incomplete 并列出失败的tokenId（不写入缓存）"""
+    data = {
+        'address': address,
+        'miners': miners,
+        'total_count': len(miners),
+        'source': source,
+        'timestamp': int(time.time())
+    }
+    if missing:
+        data['incomplete'] = True
+        data['missingTokenIds'] = list(missing)
+    return data
+
+
+def format_balances(address, bnb_balance, usdt_balance, drm_balance,
+                    usdt_allowance=None, drm_allowance=None):
+    """余额（及对统一系统合约的授权额度） -> balances 数据"""
+    data = {
+        'address': address,
+        'bnb': str(Web3.from_wei(bnb_balance, 'ether')),
+        'bnb_wei': str(bnb_balance),
+        'usdt': str(Web3.from_wei(usdt_balance, 'ether')),
+        'usdt_wei': str(usdt_balance),
+        'drm': str(Web3.from_wei(drm_balance, 'ether')),
+        'drm_wei': str(drm_balance),
+        'timestamp': int(time.time())
+    }
+    if usdt_allowance is not None and drm_allowance is not None:
+        data['allowances'] = {
+            'usdt': str(Web3.from_wei(usdt_allowance, 'ether')),
+            'usdt_wei': str(usdt_allowance),
+            'drm': str(Web3.from_wei(drm_allowance, 'ether')),
+            'drm_wei': str(drm_allowance)
+        }
+    return data
+
+
+def format_referral_info(address, referral_info):
+    """getReferralInfo 返回值 -> referral-info 数据"""
+    # 返回值: [directReferralsCount, totalUsdtRewards, totalHashPowerRewards, userReferredList]
+    return {
+        'address': address,
+        'directReferralsCount': referral_info[0],
+        'totalUsdtRewards': str(Web3.from_wei(referral_info[1], 'ether')),
+        'totalHashPowerRewards': str(referral_info[2]),
+        'referredUsers': list(referral_info[3]),
+        'timestamp': int(time.time())
+    }
+
+
+def format_network_stats(network_stats, contract_info, pool_balances):
+    """getNetworkStats/getContractInfo/getPoolBalances 返回值 -> network stats 数据"""
+    # network_stats: [totalNetworkHashPower, activeMinersCount, totalRewardsPaid]
+    # contract_info: [version, totalMiners, totalNetworkHash, activeMiners, admin]
+    # pool_balances: [usdtBalance, drmBalance]
+    return {
+        'totalNetworkHashPower': str(network_stats[0]),
+        'activeMinersCount': network_stats[1],
+        'totalRewardsPaid': str(Web3.from_wei(network_stats[2], 'ether')),
+        'totalMiners': int(contract_info[1]),
+        'version': contract_info[0],
+        'admin': contract_info[4],
+        'poolUSDT': str(Web3.from_wei(pool_balances[0], 'ether')),
+        'poolDRM': str(Web3.from_wei(pool_balances[1], 'ether')),
+        'timestamp': int(time.time())
+    }
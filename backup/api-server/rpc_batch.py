@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON-RPC 批量请求
+将同一处理流程中相互独立的 JSON-RPC 调用（eth_call / eth_getBalance / eth_gasPrice /
+eth_estimateGas / eth_getTransactionCount）打包为一次 JSON-RPC batch POST，
+节点不支持批量请求时退回逐个请求
+"""
+
+import logging
+import threading
+
+from web3.exceptions import ContractLogicError, Web3RPCError
+
+from multicall import _abi_type
+
+logger = logging.getLogger(__name__)
+
+# 批量请求统计
+batch_stats = {
+    'batches': 0,
+    'calls': 0,
+    'fallbacks': 0
+}
+_stats_lock = threading.Lock()
+
+
+def _incr(name, amount=1):
+    with _stats_lock:
+        batch_stats[name] += amount
+
+
+def _to_int(value):
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+def _block_param(block_identifier):
+    return hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+
+
+class RPCBatch:
+    """
+    JSON-RPC 批量请求
+
+    用法:
+        batch = RPCBatch(w3)
+        batch.add_balance(address)
+        batch.add_call(usdt_contract.functions.balanceOf(address))
+        bnb, usdt = batch.execute()
+
+    execute() 返回与 add_*() 顺序一致的结果；允许失败的调用出错时返回 None（异常记录在 errors[索引]），
+    否则抛出与 web3 单独调用相同类型的异常（回滚为 ContractLogicError）。
+    """
+
+    def __init__(self, w3):
+        self.w3 = w3
+        self.calls = []
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.calls)
+
+    def add(self, method, params, formatter=None, allow_failure=False, name=None):
+        """添加一个原始 JSON-RPC 调用，返回其结果索引"""
+        self.calls.append({
+            'method': method,
+            'params': params,
+            'formatter': formatter,
+            'allow_failure': allow_failure,
+            'name': name or method
+        })
+        return len(self.calls) - 1
+
+    def add_call(self, contract_function, block_identifier='latest', allow_failure=False):
+        """添加合约 view 调用（eth_call），结果按ABI解码"""
+        output_types = [_abi_type(o) for o in contract_function.abi.get('outputs', [])]
+
+        def decode(result):
+            values = self.w3.codec.decode(output_types, bytes.fromhex(result[2:]))
+            return values[0] if len(values) == 1 else list(values)
+
+        return self.add(
+            'eth_call',
+            [{'to': contract_function.address, 'data': contract_function._encode_transaction_data()},
+             _block_param(block_identifier)],
+            decode, allow_failure, contract_function.fn_name
+        )
+
+    def _transaction_params(self, contract_function, transaction, data, state_override):
+        """交易参数 [tx] 或 [tx, 'latest', 状态覆盖]"""
+        tx = {
+            'to': contract_function.address,
+            'data': data or contract_function._encode_transaction_data()
+        }
+        for key, value in transaction.items():
+            tx[key] = hex(value) if isinstance(value, int) else value
+        return [tx, 'latest', state_override] if state_override else [tx]
+
+    def add_estimate_gas(self, contract_function, transaction, allow_failure=False, data=None,
+                         state_override=None):
+        """
+        添加合约交易的 eth_estimateGas
+
+        data: 已编码的 calldata（避免重复编码）
+        state_override: 估算时的状态覆盖 {地址: {'stateDiff': {槽位: 值}}}，用于模拟前序交易已生效
+        """
+        params = self._transaction_params(contract_function, transaction, data, state_override)
+        return self.add('eth_estimateGas', params, _to_int, allow_failure, f'estimateGas:{contract_function.fn_name}')
+
+    def add_simulate(self, contract_function, transaction, allow_failure=False, data=None,
+                     state_override=None):
+        """
+        添加合约交易的 eth_call 模拟执行（只检查是否回滚，不估算Gas），参数同 add_estimate_gas
+        """
+        params = self._transaction_params(contract_function, transaction, data, state_override)
+        if len(params) == 1:
+            params.append('latest')
+        return self.add('eth_call', params, None, allow_failure, f'simulate:{contract_function.fn_name}')
+
+    def add_balance(self, address, block_identifier='latest'):
+        """添加 eth_getBalance"""
+        return self.add('eth_getBalance', [address, _block_param(block_identifier)], _to_int)
+
+    def add_gas_price(self):
+        """添加 eth_gasPrice"""
+        return self.add('eth_gasPrice', [], _to_int)
+
+    def add_transaction_count(self, address, block_identifier='latest'):
+        """添加 eth_getTransactionCount"""
+        return self.add('eth_getTransactionCount', [address, _block_param(block_identifier)], _to_int)
+
+    # ---------- 执行 ----------
+
+    def _send_batch(self):
+        """发送 JSON-RPC batch，节点拒绝批量请求时返回 None"""
+        provider = self.w3.provider
+        if not getattr(provider, 'batch_supported', True):
+            return None
+        try:
+            responses = provider.make_batch_request([(c['method'], c['params']) for c in self.calls])
+        except NotImplementedError:
+            provider.batch_supported = False
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ JSON-RPC批量请求失败，改为逐个请求: {str(e)}")
+            return None
+
+        if not isinstance(responses, list) or len(responses) != len(self.calls):
+            # 不支持批量的节点返回单个错误对象
+            provider.batch_supported = False
+            logger.warning(f"⚠️ RPC节点不支持JSON-RPC批量请求，改为逐个请求: {responses}")
+            return None
+        # JSON-RPC 规范允许批量响应乱序；provider 按请求顺序递增分配 id，按 id 排序恢复请求顺序
+        ids = [r.get('id') if isinstance(r, dict) else None for r in responses]
+        if all(isinstance(i, int) for i in ids) and len(set(ids)) == len(ids):
+            responses = sorted(responses, key=lambda r: r['id'])
+        return responses
+
+    def _result(self, call, response):
+        """解析单个响应"""
+        error = response.get('error')
+        if error is not None:
+            message = error.get('message', str(error)) if isinstance(error, dict) else str(error)
+            if isinstance(error, dict) and (error.get('code') == 3 or 'revert' in message.lower()):
+                raise ContractLogicError(message, data=error.get('data'))
+            raise Web3RPCError(message, rpc_response=response)
+        result = response.get('result')
+        return call['formatter'](result) if call['formatter'] else result
+
+    def execute(self):
+        """执行全部调用，返回结果列表"""
+        if not self.calls:
+            return []
+
+        responses = None
+        if len(self.calls) > 1:
+            responses = self._send_batch()
+        if responses is None:
+            if len(self.calls) > 1:
+                _incr('fallbacks')
+            responses = [self.w3.provider.make_request(c['method'], c['params']) for c in self.calls]
+        else:
+            _incr('batches')
+        _incr('calls', len(self.calls))
+
+        results = []
+        self.errors = {}
+        for index, (call, response) in enumerate(zip(self.calls, responses)):
+            try:
+                results.append(self._result(call, response))
+            except Exception as e:
+                if not call['allow_failure']:
+                    raise
+                logger.warning(f"⚠️ 批量请求子调用失败 {call['name']}: {str(e)}")
+                self.errors[index] = e
+                results.append(None)
+        return results
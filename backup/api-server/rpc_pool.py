@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多RPC节点池
+按 EWMA 延迟和错误率选择最快的健康节点，慢请求在 p95 截止时间后对冲到第二个节点，
+连续失败的节点熔断一段时间后再半开试探
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from web3 import Web3
+from web3.providers import JSONBaseProvider
+
+logger = logging.getLogger(__name__)
+
+# 只读且幂等的方法才允许对冲（同时发往两个节点）
+HEDGE_METHODS = {
+    'eth_call', 'eth_getBalance', 'eth_blockNumber', 'eth_getBlockByNumber',
+    'eth_getBlockByHash', 'eth_getLogs', 'eth_gasPrice', 'eth_estimateGas',
+    'eth_getTransactionCount', 'eth_chainId', 'eth_feeHistory', 'eth_getCode',
+    'eth_getTransactionReceipt', 'eth_maxPriorityFeePerGas'
+}
+
+# 表示节点本身有问题（限流、过载、不支持）的 JSON-RPC 错误码；
+# 执行回滚等业务错误不计入节点失败
+NODE_ERROR_CODES = {-32005, -32001, -32603, 429}
+
+
+class EndpointState:
+    """单个RPC节点的统计与熔断状态"""
+
+    def __init__(self, url, provider, alpha=0.2, window=200):
+        self.url = url
+        self.provider = provider
+        self.alpha = alpha
+        self.latencies = deque(maxlen=window)
+        self.ewma_latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.hedged_wins = 0
+
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.half_open = False
+        self._lock = threading.Lock()
+
+    def record_success(self, latency):
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency)
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+            self.error_rate = (1 - self.alpha) * self.error_rate
+            self.consecutive_failures = 0
+            self.half_open = False
+
+    def record_failure(self, failure_threshold, cooldown):
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+            self.consecutive_failures += 1
+            if self.half_open or self.consecutive_failures >= failure_threshold:
+                self.open_until = time.time() + cooldown
+                self.half_open = False
+                logger.warning(f"⚠️ RPC节点熔断 {cooldown}秒: {self.url}")
+
+    def available(self):
+        """熔断关闭，或冷却结束进入半开状态"""
+        if self.open_until == 0:
+            return True
+        if time.time() >= self.open_until:
+            with self._lock:
+                self.open_until = 0
+                self.half_open = True
+            return True
+        return False
+
+    def p95(self):
+        with self._lock:
+            if len(self.latencies) < 20:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def score(self):
+        """越小越好：EWMA延迟按错误率放大，尚无延迟数据时为0"""
+        if self.ewma_latency is None:
+            return 0
+        return self.ewma_latency * (1 + 4 * self.error_rate)
+
+    def stats(self):
+        p95 = self.p95()
+        return {
+            'url': self.url,
+            'ewma_latency_ms': round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'error_rate': round(self.error_rate, 4),
+            'requests': self.requests,
+            'failures': self.failures,
+            'hedged_wins': self.hedged_wins,
+            'circuit': 'open' if self.open_until else ('half-open' if self.half_open else 'closed'),
+            'transport': self.provider.stats() if hasattr(self.provider, 'stats') else None
+        }
+
+
+class PooledHTTPProvider(JSONBaseProvider):
+    """
+    多节点 JSON-RPC Provider
+
+    每个请求发往评分最好的可用节点；节点异常时依次故障转移，
+    只读请求超过主节点 p95 截止时间仍未返回时同时发往下一个节点，取先返回的结果。
+    """
+
+    def __init__(self, urls, request_kwargs=None, hedge_min=0.15, hedge_max=2.0,
+                 hedge_default=0.5, failure_threshold=3, cooldown=30, probe_every=50,
+                 max_workers=128, provider_factory=None):
+        """
+        probe_every: 每隔多少个请求把一次请求发往非最优节点，保持各节点延迟数据更新
+        provider_factory: url -> Provider，默认 HTTPProvider（关闭内置重试，由节点池故障转移）
+        """
+        super().__init__()
+        request_kwargs = request_kwargs or {'timeout': 10}
+        provider_factory = provider_factory or (lambda url: Web3.HTTPProvider(
+            url, request_kwargs=request_kwargs, exception_retry_configuration=None
+        ))
+        self.endpoints = [EndpointState(url, provider_factory(url)) for url in urls]
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self.hedge_default = hedge_default
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_every = probe_every
+        self._counter = 0
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rpc-pool')
+
+        self.hedged = 0
+        self.failovers = 0
+
+    def __str__(self):
+        return f"PooledHTTPProvider({len(self.endpoints)} endpoints)"
+
+    # ---------- 选路 ----------
+
+    def ranked_endpoints(self):
+        """
+        按评分排序的可用节点；全部熔断时退回全部节点
+
+        尚无延迟数据的节点优先（评分为0），每 probe_every 个请求轮流把一个非最优节点排到首位
+        """
+        available = [e for e in self.endpoints if e.available()]
+        if not available:
+            available = list(self.endpoints)
+        ranked = sorted(available, key=lambda e: e.score())
+
+        self._counter += 1
+        if self.probe_every and len(ranked) > 1 and self._counter % self.probe_every == 0:
+            probe = ranked[1 + (self._counter // self.probe_every) % (len(ranked) - 1)]
+            ranked.remove(probe)
+            ranked.insert(0, probe)
+        return ranked
+
+    def hedge_deadline(self, endpoint):
+        """对冲截止时间：主节点 p95，限制在 [hedge_min, hedge_max] 内"""
+        p95 = endpoint.p95()
+        if p95 is None:
+            p95 = endpoint.ewma_latency * 2 if endpoint.ewma_latency is not None else self.hedge_default
+        return min(self.hedge_max, max(self.hedge_min, p95))
+
+    # ---------- 请求 ----------
+
+    def _is_node_error(self, response):
+        error = response.get('error') if isinstance(response, dict) else None
+        return isinstance(error, dict) and error.get('code') in NODE_ERROR_CODES
+
+    def _send(self, endpoint, request):
+        """向单个节点发送请求并记录统计，节点故障时抛出异常"""
+        started = time.monotonic()
+        try:
+            response = request(endpoint.provider)
+        except Exception:
+            endpoint.record_failure(self.failure_threshold, self.cooldown)
+            raise
+        if self._is_node_error(response):
+            endpoint.record_failure(self.failure_threshold, self.cooldown)
+            raise IOError(f"{endpoint.url}: {response['error']}")
+        endpoint.record_success(time.monotonic() - started)
+        return response
+
+    def _dispatch(self, request, hedge):
+        """按评分依次尝试节点：request(provider) -> 响应"""
+        candidates = self.ranked_endpoints()
+        hedge = hedge and len(candidates) > 1
+        pending = {}
+        last_error = None
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            endpoint = candidates[next_index]
+            next_index += 1
+            pending[self._executor.submit(self._send, endpoint, request)] = endpoint
+            return endpoint
+
+        primary = launch()
+        while pending:
+            timeout = self.hedge_deadline(primary) if hedge and next_index < len(candidates) else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # 主节点超过截止时间：对冲到下一个节点
+                self.hedged += 1
+                launch()
+                hedge = False
+                continue
+
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if endpoint is not primary:
+                    endpoint.hedged_wins += 1
+                return response
+
+            # 全部进行中的请求都失败：故障转移到下一个节点
+            if not pending and next_index < len(candidates):
+                self.failovers += 1
+                logger.warning(f"⚠️ RPC请求失败，切换节点: {str(last_error)}")
+                primary = launch()
+
+        raise last_error if last_error is not None else IOError('No RPC endpoint available')
+
+    def make_request(self, method, params):
+        return self._dispatch(
+            lambda provider: provider.make_request(method, params),
+            method in HEDGE_METHODS
+        )
+
+    def make_batch_request(self, batch_requests):
+        """JSON-RPC batch 整体发往同一个节点；全部为只读方法时允许对冲"""
+        return self._dispatch(
+            lambda provider: provider.make_batch_request(batch_requests),
+            all(method in HEDGE_METHODS for method, _ in batch_requests)
+        )
+
+    # ---------- 进程生命周期 ----------
+
+    def reset_after_fork(self):
+        """fork 之后重建请求线程池与各节点连接（线程和 socket 不能跨进程使用）"""
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='rpc-pool')
+        for endpoint in self.endpoints:
+            reset = getattr(endpoint.provider, 'reset_connections', None)
+            if reset is not None:
+                reset()
+
+    def close(self):
+        """等待进行中的请求（含对冲请求）完成后关闭线程池"""
+        self._executor.shutdown(wait=True)
+
+    def is_connected(self, show_traceback=False):
+        return any(e.provider.is_connected(show_traceback) for e in self.ranked_endpoints()[:2])
+
+    def stats(self):
+        """节点池统计信息"""
+        return {
+            'hedged': self.hedged,
+            'failovers': self.failovers,
+            'endpoints': [e.stats() for e in sorted(self.endpoints, key=lambda e: e.score())]
+        }
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON-RPC HTTP 传输层
+每个上游节点一个固定大小的持久连接池（HTTP keep-alive），按方法区分连接/读取超时，
+可选 HTTP/2（需要安装 httpx[http2]），并统计连接池使用情况
+"""
+
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import HTTPProvider
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_CONNECT_TIMEOUT = 3   # 秒
+DEFAULT_READ_TIMEOUT = 10     # 秒
+
+
+class TunedHTTPProvider(HTTPProvider):
+    """
+    连接池可配置的 HTTPProvider
+
+    所有线程共享同一个 Session；连接池满时请求排队等待空闲连接（pool_block），
+    不会额外新建连接，因此突发并发请求始终复用已预热的连接。
+    """
+
+    def __init__(self, endpoint_uri, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 method_timeouts=None, http2=False, **kwargs):
+        """
+        pool_size: 到该节点的最大连接数
+        method_timeouts: {方法名: 读取超时}，如 eth_getLogs 需要更长的超时
+        http2: 使用 httpx 的 HTTP/2 客户端（单连接多路复用），未安装时退回 HTTP/1.1
+        """
+        kwargs.setdefault('exception_retry_configuration', None)
+        super().__init__(endpoint_uri, **kwargs)
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.method_timeouts = dict(method_timeouts or {})
+        self.headers = dict(self.get_request_headers(), Connection='keep-alive')
+        self.http2 = http2
+
+        self.requests = 0
+        self.errors = 0
+        self.peak_in_flight = 0
+        self.total_time = 0.0
+        self.reset_connections()
+
+    def reset_connections(self):
+        """
+        重建连接池
+
+        预加载（pre-fork）部署中 fork 之后调用：父进程中已建立的 socket 不能在多个进程间共享，
+        旧连接直接丢弃（不关闭，避免影响父进程）
+        """
+        self._client = None
+        if self.http2:
+            try:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                    headers=self.headers
+                )
+            except ImportError:
+                logger.warning("⚠️ 未安装 httpx[http2]，RPC传输使用 HTTP/1.1")
+
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True, max_retries=0)
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    @property
+    def protocol(self):
+        return 'http/2' if self._client is not None else 'http/1.1'
+
+    def timeout_for(self, method):
+        """(连接超时, 读取超时)"""
+        return self.connect_timeout, self.method_timeouts.get(method, self.read_timeout)
+
+    def _post(self, method, request_data):
+        connect_timeout, read_timeout = self.timeout_for(method)
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.monotonic()
+        try:
+            if self._client is not None:
+                import httpx
+                response = self._client.post(
+                    self.endpoint_uri, content=request_data,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                )
+            else:
+                response = self._session.post(
+                    self.endpoint_uri, data=request_data, headers=self.headers,
+                    timeout=(connect_timeout, read_timeout)
+                )
+            response.raise_for_status()
+            return response.content
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.total_time += time.monotonic() - started
+
+    def _make_request(self, method, request_data):
+        return self._post(method, request_data)
+
+    def make_batch_request(self, batch_requests):
+        request_data = self.encode_batch_rpc_request(batch_requests)
+        methods = {method for method, _ in batch_requests}
+        # 批量请求按其中最慢方法的超时
+        method = max(methods, key=lambda m: self.timeout_for(m)[1]) if methods else 'batch'
+        response = self.decode_rpc_response(self._post(method, request_data))
+        if not isinstance(response, list):
+            return response
+        return sorted(response, key=lambda r: r.get('id') if isinstance(r.get('id'), int) else 0)
+
+    def pool_stats(self):
+        """urllib3 连接池状态：已创建连接数、空闲连接数"""
+        if self._client is not None:
+            return {}
+        pools = self._adapter.poolmanager.pools
+        opened = idle = pooled_requests = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            pooled_requests += pool.num_requests
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {
+            'connections_opened': opened,
+            'idle_connections': idle,
+            'pooled_requests': pooled_requests
+        }
+
+    def stats(self):
+        """传输统计信息"""
+        stats = {
+            'protocol': self.protocol,
+            'pool_size': self.pool_size,
+            'requests': self.requests,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            # 大于1表示有请求在排队等待空闲连接
+            'utilization': round(self.in_flight / self.pool_size, 3),
+            'avg_ms': round(self.total_time / self.requests * 1000, 1) if self.requests else None
+        }
+        stats.update(self.pool_stats())
+        return stats
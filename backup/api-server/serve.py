@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dreamle API 服务器 V2 生产入口
+gunicorn 预加载（pre-fork）多进程部署：主进程导入 api-server-v2.py 并预热一次（ABI、合约实例、
+全网统计与等级算力缓存），fork 出的 worker 直接继承；每个 worker 重建RPC连接后启动自己的后台线程。
+worker 之间通过文件锁选出一个 leader 跟踪链上状态（区块、合约日志、Gas价格）并写入链上索引，
+其余 worker 从共享缓存/索引数据库读取；leader 退出后由 gunicorn 重新 fork 的 worker 接任。
+收到 SIGTERM 时停止接收新连接，等待进行中的请求与RPC调用完成后退出。
+
+启动:
+    python serve.py
+
+配置（环境变量）:
+    API_HOST / API_PORT              监听地址（默认 0.0.0.0:3000）
+    API_WORKERS                      worker 进程数（默认 CPU 核数，最多 8）
+    API_THREADS                      每个 worker 的线程数
+    API_KEEPALIVE                    keep-alive 空闲连接保持时间（秒）
+    API_MAX_CONCURRENCY              每个 worker 的最大并发连接数（gunicorn 达到后暂停 accept，
+                                     单进程模式超过后返回 503）
+    API_GRACEFUL_TIMEOUT             优雅退出等待时间（秒）
+    API_MAX_REQUESTS                 worker 处理多少请求后重启（0 表示不重启）
+    API_LEADER_LOCK                  leader 选举使用的锁文件
+    STATIC_SERVING_ENABLED=0         不提供静态文件，worker 只处理 /api/*（静态文件交给 nginx/CDN）
+
+多 worker 部署时建议设置 CACHE_BACKEND=shm 或 redis，worker 之间共享缓存。
+未安装 gunicorn 时退回单进程多线程服务器（仅适合开发/测试）。
+"""
+
+import fcntl
+import importlib.util
+import logging
+import os
+import signal
+import threading
+import time
+
+# 必须在导入服务器模块之前设置：后台线程推迟到 fork 之后启动
+os.environ.setdefault('API_PREFORK', '1')
+
+from werkzeug.wsgi import ClosingIterator
+
+logger = logging.getLogger('serve')
+
+# ==================== 配置 ====================
+
+HOST = os.environ.get('API_HOST', '0.0.0.0')
+PORT = int(os.environ.get('API_PORT', '3000'))
+WORKERS = int(os.environ.get('API_WORKERS', str(min(os.cpu_count() or 1, 8))))
+THREADS = int(os.environ.get('API_THREADS', '16'))
+KEEPALIVE = int(os.environ.get('API_KEEPALIVE', '5'))  # 秒
+MAX_CONCURRENCY = int(os.environ.get('API_MAX_CONCURRENCY', '512'))  # 每个 worker，含 keep-alive 空闲连接
+BACKLOG = 2048
+TIMEOUT = 60  # 秒，worker 无响应超过后被主进程重启
+GRACEFUL_TIMEOUT = int(os.environ.get('API_GRACEFUL_TIMEOUT', '30'))  # 秒，应大于 RPC 读取超时
+MAX_REQUESTS = int(os.environ.get('API_MAX_REQUESTS', '0'))
+MAX_REQUESTS_JITTER = 100
+BUSY_RETRY_AFTER = 1  # 秒，503 响应的 Retry-After
+LEADER_LOCK = os.environ.get('API_LEADER_LOCK', f'/tmp/dreamle-api-{PORT}.leader')
+
+SERVER_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api-server-v2.py')
+
+
+def load_server():
+    """导入 api-server-v2.py（文件名含连字符，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location('api_server_v2', SERVER_MODULE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ==================== 并发上限 ====================
+
+class ConcurrencyLimit:
+    """
+    WSGI 并发上限中间件
+
+    同时处理的请求数达到 limit 时直接返回 503（带 Retry-After），
+    避免过载时请求在线程池中排队、每个请求都超时；同时记录进行中的请求数，供优雅退出时等待。
+    """
+
+    def __init__(self, app, limit, retry_after=BUSY_RETRY_AFTER):
+        self.app = app
+        self.limit = limit
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def _release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def __call__(self, environ, start_response):
+        with self._cond:
+            if self.in_flight >= self.limit:
+                self.rejected += 1
+                busy = True
+            else:
+                self.in_flight += 1
+                busy = False
+        if busy:
+            body = b'{"success": false, "error": "Server busy"}'
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(body))),
+                ('Retry-After', str(self.retry_after))
+            ])
+            return [body]
+
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._release()
+            raise
+        # 响应体发送完毕（close）时才释放名额
+        return ClosingIterator(result, self._release)
+
+    def drain(self, timeout):
+        """等待进行中的请求完成，返回是否全部完成"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+# ==================== leader 选举 ====================
+
+_leader_lock = None
+
+
+def acquire_leadership(path=LEADER_LOCK):
+    """
+    尝试成为 leader：持有锁文件的排他锁直到进程退出（进程退出时内核自动释放），
+    返回是否成功
+    """
+    global _leader_lock
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _leader_lock = fd
+    return True
+
+
+# ==================== gunicorn ====================
+
+def run_gunicorn(server):
+    from gunicorn.app.base import BaseApplication
+
+    def post_fork(arbiter, worker):
+        server.reset_after_fork()
+        leader = acquire_leadership()
+        if leader:
+            logger.info(f"👑 worker {worker.pid} 负责跟踪链上状态")
+        server.start_background_services(leader=leader, shared=WORKERS > 1)
+
+    def worker_exit(arbiter, worker):
+        # gunicorn 已等待进行中的请求完成，此处等待后台RPC调用完成
+        server.shutdown_background_services()
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{HOST}:{PORT}',
+                'workers': WORKERS,
+                'worker_class': 'gthread',
+                'threads': THREADS,
+                'worker_connections': MAX_CONCURRENCY,
+                'keepalive': KEEPALIVE,
+                'backlog': BACKLOG,
+                'timeout': TIMEOUT,
+                'graceful_timeout': GRACEFUL_TIMEOUT,
+                'max_requests': MAX_REQUESTS,
+                'max_requests_jitter': MAX_REQUESTS_JITTER if MAX_REQUESTS else 0,
+                'preload_app': True,
+                'post_fork': post_fork,
+                'worker_exit': worker_exit
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return server.app
+
+    Application().run()
+
+
+# ==================== 单进程退回 ====================
+
+def run_threaded(server):
+    """未安装 gunicorn：单进程多线程服务器，同样支持并发上限与优雅退出"""
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class RequestHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'  # 启用 keep-alive
+        timeout = KEEPALIVE
+
+    application = ConcurrencyLimit(server.app, MAX_CONCURRENCY)
+    httpd = make_server(HOST, PORT, application, threaded=True, request_handler=RequestHandler)
+    httpd.socket.listen(BACKLOG)  # make_server 已按默认队列长度 listen
+
+    def shutdown(signum, frame):
+        logger.info("🛑 收到退出信号，停止接收新请求...")
+        # serve_forever 所在线程不能直接调用 shutdown()
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    server.start_background_services()
+    logger.info(f"🚀 单进程模式监听 {HOST}:{PORT}（{MAX_CONCURRENCY} 并发上限）")
+    httpd.serve_forever()
+
+    if not application.drain(GRACEFUL_TIMEOUT):
+        logger.warning(f"⚠️ {application.in_flight} 个请求未在 {GRACEFUL_TIMEOUT} 秒内完成")
+    server.shutdown_background_services()
+    httpd.server_close()
+
+
+if __name__ == '__main__':
+    server = load_server()
+    logger.info("🚀 启动 Dreamle API 服务器 V2...")
+    logger.info(f"📡 BSC RPC: {server.BSC_RPC_URL}")
+    server.warm_up()
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        gunicorn = None
+
+    if gunicorn is not None:
+        if server.CACHE_BACKEND == 'memory' and WORKERS > 1:
+            logger.warning("⚠️ 内存缓存不能跨进程共享，每个 worker 各自跟踪链上状态，建议设置 CACHE_BACKEND=shm 或 redis")
+        logger.info(f"🚀 gunicorn {WORKERS} workers x {THREADS} threads 监听 {HOST}:{PORT}")
+        run_gunicorn(server)
+    else:
+        logger.warning("⚠️ 未安装 gunicorn（pip install gunicorn），退回单进程多线程服务器")
+        run_threaded(server)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dreamle API 服务器共享配置
+网络、合约地址和合约ABI，同步（Flask）和异步（ASGI）服务器共用
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# ==================== 网络与合约 ====================
+
+# BSC 主网配置
+BSC_RPC_URL = 'https://lb.drpc.org/bsc/AqlGpHrYB01Fo1dFtBRULdHcTuavm9wR8L7hwg8TMB_n'
+CHAIN_ID = 56
+
+# RPC节点池（按 RPC_LATENCY_TEST_REPORT.md 的延迟排序，与前端 config/contracts.js 一致）
+BSC_RPC_URLS = [
+    BSC_RPC_URL,
+    'https://bsc-rpc.publicnode.com',
+    'https://1rpc.io/bnb',
+    'https://bsc-dataseed1.binance.org',
+    'https://bsc-dataseed2.binance.org',
+    'https://bsc-mainnet.nodereal.io/v1/1659dfb40aa24bbb8153a677b98064d7'
+]
+
+# 合约地址（Mainnet - 2025-09-30 部署）
+CONTRACT_ADDRESSES = {
+    'UNIFIED_SYSTEM': '0xf9462c7fE57Fc7Aff662204228cCdCd0a9d3398A',
+    'DREAMLE_TOKEN': '0x4440409e078D44A63c72696716b84A46814717e9',
+    'USDT_TOKEN': '0x55d398326f99059fF775485246999027B3197955'
+}
+
+# ==================== 加载合约ABI ====================
+
+# 管理员地址
+ADMIN_ADDRESS = '0xfC3b7735Dae4C7AB3Ab85Ffa9987661e795B74b7'
+
+# 加载V18合约ABI
+try:
+    abi_path = os.path.join(os.path.dirname(__file__), 'contract-info', 'UnifiedSystemV19_ABI.json')
+    with open(abi_path, 'r') as f:
+        UNIFIED_SYSTEM_ABI = json.load(f)
+    logger.info(f"✅ 成功加载V18合约ABI，共 {len(UNIFIED_SYSTEM_ABI)} 个函数/事件")
+except Exception as e:
+    logger.warning(f"⚠️ 无法加载ABI文件: {e}，使用内置ABI")
+    UNIFIED_SYSTEM_ABI = [
+    {
+        "inputs": [{"name": "user", "type": "address"}],
+        "name": "userMiningInfo",
+        "outputs": [
+            {"name": "totalHashPower", "type": "uint16"},
+            {"name": "ownHashPower", "type": "uint16"},
+            {"name": "teamHashPower", "type": "uint16"},
+            {"name": "minerCount", "type": "uint32"},
+            {"name": "lastUpdateTime", "type": "uint32"},
+            {"name": "isActive", "type": "bool"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "user", "type": "address"}],
+        "name": "userMiners",
+        "outputs": [{"name": "", "type": "uint256[]"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "tokenId", "type": "uint256"}],
+        "name": "getMinerInfo",
+        "outputs": [
+            {"name": "level", "type": "uint8"},
+            {"name": "purchaseTime", "type": "uint32"},
+            {"name": "expiryTime", "type": "uint32"},
+            {"name": "isActive", "type": "bool"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"name": "level", "type": "uint8"},
+            {"name": "referrer", "type": "address"}
+        ],
+        "name": "purchaseMinerWithUSDT",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "claimRewards",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "usdtAmount", "type": "uint256"}],
+        "name": "exchangeUsdtToDrm",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "drmAmount", "type": "uint256"}],
+        "name": "exchangeDrmToUsdt",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"name": "from", "type": "address"},
+            {"name": "to", "type": "address"},
+            {"name": "tokenId", "type": "uint256"}
+        ],
+        "name": "transferFrom",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "tokenId", "type": "uint256"}],
+        "name": "renewMiner",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "tokenIds", "type": "uint256[]"}],
+        "name": "renewMultipleMiners",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "tokenId", "type": "uint256"}],
+        "name": "getRenewalPrice",
+        "outputs": [{"name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "tokenIds", "type": "uint256[]"}],
+        "name": "getBatchRenewalPrice",
+        "outputs": [{"name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    # 管理员功能
+    {
+        "inputs": [{"name": "referrer", "type": "address"}],
+        "name": "addSpecialReferrer",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "referrer", "type": "address"}],
+        "name": "removeSpecialReferrer",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"name": "usdtAmount", "type": "uint256"},
+            {"name": "drmAmount", "type": "uint256"}
+        ],
+        "name": "adminInjectLiquidity",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"name": "token", "type": "address"},
+            {"name": "amount", "type": "uint256"}
+        ],
+        "name": "adminWithdraw",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "emergencyPause",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "user", "type": "address"}],
+        "name": "updateExpiredMiners",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    }
+]
+
+ERC20_ABI = [
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "name": "from", "type": "address"},
+            {"indexed": True, "name": "to", "type": "address"},
+            {"indexed": False, "name": "value", "type": "uint256"}
+        ],
+        "name": "Transfer",
+        "type": "event"
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "name": "owner", "type": "address"},
+            {"indexed": True, "name": "spender", "type": "address"},
+            {"indexed": False, "name": "value", "type": "uint256"}
+        ],
+        "name": "Approval",
+        "type": "event"
+    },
+    {
+        "inputs": [{"name": "account", "type": "address"}],
+        "name": "balanceOf",
+        "outputs": [{"name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"name": "owner", "type": "address"},
+            {"name": "spender", "type": "address"}
+        ],
+        "name": "allowance",
+        "outputs": [{"name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"name": "spender", "type": "address"},
+            {"name": "amount", "type": "uint256"}
+        ],
+        "name": "approve",
+        "outputs": [{"name": "", "type": "bool"}],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    }
+]
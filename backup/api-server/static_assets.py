@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态资源服务
+启动时扫描站点目录，为文本资源（html/css/js/svg/json）预生成 gzip/brotli 压缩版本并按内容哈希生成强 ETag；
+请求时按 Accept-Encoding 选择版本，经 send_file 返回（WSGI 服务器提供 wsgi.file_wrapper 时走 sendfile 零拷贝），
+文件名含内容哈希的资源返回 immutable 缓存头
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+
+from flask import request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_EXTENSIONS = ('.html', '.htm', '.css', '.js', '.mjs', '.json', '.svg', '.txt', '.xml', '.map')
+# 文件名中的内容哈希，如 app.3f9a2c1d.js / app-3f9a2c1d.css
+HASHED_NAME = re.compile(r'[.-][0-9a-f]{8,}\.\w+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # 秒
+
+
+def _compress_gzip(data, level):
+    # mtime=0：相同内容生成相同字节，多进程/重启后结果一致
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class StaticAsset:
+    __slots__ = ('path', 'size', 'mtime', 'etag', 'mimetype', 'variants')
+
+    def __init__(self, path, size, mtime, etag, mimetype, variants):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.etag = etag
+        self.mimetype = mimetype
+        self.variants = variants  # 编码 -> 压缩文件路径
+
+
+class StaticAssets:
+    """
+    静态资源目录
+
+    压缩版本按内容哈希写入 cache_dir（原子替换），多个 worker 进程或重启后直接复用；
+    文件修改（mtime/大小变化）后下次请求时重新生成。
+    """
+
+    def __init__(self, root, cache_dir, min_size=1024, max_size=8 * 1024 * 1024,
+                 exclude_dirs=(), exclude_files=(), gzip_level=9, brotli_quality=11):
+        """
+        min_size: 小于该大小的文件不压缩
+        max_size: 超过该大小的文件不提供（请求时读取、哈希并压缩整个文件）
+        exclude_dirs: 不提供的顶层目录
+        exclude_files: 不提供的文件路径（如位于站点目录中的数据库文件）
+        以 . 开头的目录和文件（.git、.env 等）不提供
+        """
+        self.root = os.path.abspath(root)
+        self.cache_dir = cache_dir
+        self.min_size = min_size
+        self.max_size = max_size
+        self.exclude_dirs = set(exclude_dirs)
+        self.exclude_files = {os.path.abspath(path) for path in exclude_files}
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        self.encodings = ['gzip']
+        if brotli is not None:
+            self.encodings.insert(0, 'br')
+
+        self.served = {'identity': 0, 'gzip': 0, 'br': 0}
+        self.not_modified = 0
+
+    # ---------- 压缩 ----------
+
+    def _compress(self, encoding, data):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return _compress_gzip(data, self.gzip_level)
+
+    def _variant(self, digest, encoding, data):
+        """返回压缩版本路径；压缩收益不足 10% 时返回 None"""
+        target = os.path.join(self.cache_dir, f'{digest}.{encoding}')
+        if os.path.exists(target):
+            return target
+        compressed = self._compress(encoding, data)
+        if len(compressed) > len(data) * 0.9:
+            return None
+        tmp = f'{target}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp, target)
+        return target
+
+    def _build(self, path, stat):
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        variants = {}
+        if path.endswith(COMPRESSIBLE_EXTENSIONS) and len(data) >= self.min_size:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for encoding in self.encodings:
+                variant = self._variant(digest, encoding, data)
+                if variant is not None:
+                    variants[encoding] = variant
+        return StaticAsset(
+            path, stat.st_size, stat.st_mtime, digest[:20],
+            mimetypes.guess_type(path)[0] or 'application/octet-stream', variants
+        )
+
+    def is_public(self, path, stat):
+        """站点目录中的文件是否对外提供（启动扫描与请求共用同一规则）"""
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        if parts[0] == '..' or any(part.startswith('.') for part in parts):
+            return False
+        if len(parts) > 1 and parts[0] in self.exclude_dirs:
+            return False
+        if path in self.exclude_files:
+            return False
+        return stat.st_size <= self.max_size
+
+    def precompress(self):
+        """启动时扫描站点目录，为文本资源生成压缩版本"""
+        files = compressed = saved = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            top = os.path.relpath(dirpath, self.root) == '.'
+            # 与 is_public 的规则一致，跳过不对外提供的目录
+            dirnames[:] = [
+                d for d in dirnames
+                if not d.startswith('.') and not (top and d in self.exclude_dirs)
+            ]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if not self.is_public(path, stat):
+                        continue
+                    entry = self._build(path, stat)
+                except OSError as e:
+                    logger.warning(f"⚠️ 预压缩失败 {path}: {str(e)}")
+                    continue
+                with self._lock:
+                    self.entries[path] = entry
+                files += 1
+                if entry.variants:
+                    compressed += 1
+                    saved += entry.size - min(os.path.getsize(p) for p in entry.variants.values())
+        logger.info(
+            f"✅ 静态资源预压缩: {files} 个文件，{compressed} 个生成压缩版本"
+            f"（{'+'.join(self.encodings)}），节省 {saved / 1024:.0f}KB"
+        )
+
+    # ---------- 请求 ----------
+
+    def lookup(self, relpath):
+        """相对路径 -> StaticAsset，不存在或不对外提供时返回 None"""
+        path = safe_join(self.root, relpath)
+        if path is None:
+            return None
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path) or not self.is_public(path, stat):
+            return None
+
+        entry = self.entries.get(path)
+        if entry is None or entry.mtime != stat.st_mtime or entry.size != stat.st_size:
+            entry = self._build(path, stat)
+            with self._lock:
+                self.entries[path] = entry
+        return entry
+
+    def is_immutable(self, relpath):
+        """
+        文件名含内容哈希的资源：内容不会在同一URL下变化
+
+        ?v= 版本号由客户端给出，不能保证与文件内容对应（任意 ?v= 都会命中同一文件），不作为 immutable 依据
+        """
+        return HASHED_NAME.search(relpath) is not None
+
+    def send(self, relpath):
+        """返回静态文件响应，文件不存在时返回 None"""
+        entry = self.lookup(relpath)
+        if entry is None:
+            return None
+
+        encoding = next(
+            (e for e in self.encodings if e in entry.variants and request.accept_encodings[e]),
+            None
+        )
+        path = entry.variants[encoding] if encoding else entry.path
+        # 强 ETag 区分编码：不同编码的字节不同
+        etag = f'{entry.etag}-{encoding}' if encoding else entry.etag
+
+        response = send_file(
+            path, mimetype=entry.mimetype, etag=etag,
+            last_modified=entry.mtime, conditional=True, max_age=None
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if entry.variants:
+            response.vary.add('Accept-Encoding')
+        if self.is_immutable(relpath):
+            response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        else:
+            # 文件名不含内容哈希的资源（如 platform.html）每次通过 ETag 重新验证
+            response.headers['Cache-Control'] = 'no-cache'
+
+        if response.status_code == 304:
+            self.not_modified += 1
+        else:
+            self.served[encoding or 'identity'] += 1
+        return response
+
+    def stats(self):
+        """静态资源统计"""
+        return {
+            'files': len(self.entries),
+            'precompressed': sum(1 for e in self.entries.values() if e.variants),
+            'encodings': self.encodings,
+            'served': dict(self.served),
+            'not_modified': self.not_modified
+        }
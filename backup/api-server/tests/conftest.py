@@ -0,0 +1,242 @@
+"""
+测试公共设施：把 api-server 目录加入导入路径，提供内存中的假 BSC 节点（不访问网络）
+"""
+
+import os
+import sys
+
+import pytest
+import requests
+from eth_abi import encode, decode
+from eth_utils import function_signature_to_4byte_selector
+from web3 import Web3
+from web3.providers.async_base import AsyncBaseProvider
+from web3.providers.base import BaseProvider
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+import multicall  # noqa: E402
+
+MULTICALL3 = multicall.MULTICALL3_ADDRESS.lower()
+TOKEN = '0x' + '11' * 20
+BROKEN = '0x' + '22' * 20  # 任何调用都回滚的合约
+
+
+def selector(signature):
+    return '0x' + function_signature_to_4byte_selector(signature).hex()
+
+
+class Revert(Exception):
+    pass
+
+
+def make_log(address, block, topics, data=b''):
+    """eth_getLogs 返回的日志；topics 为 bytes（32字节）列表"""
+    return {
+        'address': address.lower(),
+        'topics': ['0x' + bytes(t).hex() for t in topics],
+        'data': '0x' + data.hex(),
+        'blockNumber': hex(block),
+        'blockHash': '0x' + '00' * 32,
+        'transactionHash': '0x' + '00' * 32,
+        'transactionIndex': '0x0',
+        'logIndex': '0x0',
+        'removed': False
+    }
+
+
+def log_matches(log, params):
+    """按 eth_getLogs 过滤条件（address/fromBlock/toBlock/topics）匹配日志"""
+    addresses = params.get('address') or []
+    addresses = addresses if isinstance(addresses, list) else [addresses]
+    if addresses and log['address'] not in [a.lower() for a in addresses]:
+        return False
+    block = int(log['blockNumber'], 16)
+    if not int(params['fromBlock'], 16) <= block <= int(params['toBlock'], 16):
+        return False
+    for position, wanted in enumerate(params.get('topics') or []):
+        if wanted is None:
+            continue
+        wanted = wanted if isinstance(wanted, list) else [wanted]
+        if position >= len(log['topics']) or log['topics'][position] not in wanted:
+            return False
+    return True
+
+
+class FakeNode(BaseProvider):
+    """
+    假节点：代币 balanceOf/allowance、Multicall3（可关闭）、交易估算、合约日志，回滚返回 code 3；
+    down=True 时所有请求抛出网络错误
+    """
+
+    def __init__(self, balances=None, multicall_deployed=True):
+        super().__init__()
+        self.balances = {k.lower(): v for k, v in (balances or {}).items()}
+        self.multicall_deployed = multicall_deployed
+        self.down = False
+        self.reverting = set()  # 调用回滚的合约地址（小写）
+        self.tokens = {TOKEN}   # 提供 balanceOf/allowance 的代币合约地址（小写）
+        self.block = 100
+        self.timestamp = 1_700_000_000
+        self.posts = 0       # HTTP 请求数（批量请求算一次；不含 web3 内部的 eth_chainId/eth_getCode）
+        self.methods = []    # 每个 JSON-RPC 调用的方法名
+        self.logs = []       # eth_getLogs 返回的日志（见 make_log）
+        self.handlers = {}   # (合约地址小写, 函数选择器) -> handler(参数bytes) -> 返回数据bytes（抛出 Revert 表示回滚）
+
+    def is_connected(self, show_traceback=False):
+        return True
+
+    # ---------- eth_call ----------
+
+    def call(self, to, data):
+        to = to.lower()
+        sig, body = data[:10], bytes.fromhex(data[10:])
+        if to == BROKEN or to in self.reverting:
+            raise Revert()
+        if (to, sig) in self.handlers:
+            return self.handlers[(to, sig)](body)
+        if to in self.tokens and sig == selector('balanceOf(address)'):
+            (owner,) = decode(['address'], body)
+            if owner.lower() not in self.balances:
+                raise Revert()
+            return encode(['uint256'], [self.balances[owner.lower()]])
+        if to in self.tokens and sig == selector('allowance(address,address)'):
+            return encode(['uint256'], [0])
+        if to == MULTICALL3:
+            if not self.multicall_deployed:
+                return b''
+            if sig == selector('getCurrentBlockTimestamp()'):
+                return encode(['uint256'], [self.timestamp])
+            if sig == selector('getEthBalance(address)'):
+                return encode(['uint256'], [7])
+            if sig == selector('aggregate3((address,bool,bytes)[])'):
+                (calls,) = decode(['(address,bool,bytes)[]'], body)
+                out = []
+                for target, allow_failure, calldata in calls:
+                    try:
+                        out.append((True, self.call(target, '0x' + calldata.hex())))
+                    except Revert:
+                        if not allow_failure:
+                            raise
+                        out.append((False, b''))
+                return encode(['(bool,bytes)[]'], [out])
+        return b''
+
+    def respond(self, method, params, request_id=1):
+        self.methods.append(method)
+        response = {'jsonrpc': '2.0', 'id': request_id}
+        if method == 'eth_call':
+            try:
+                response['result'] = '0x' + self.call(params[0]['to'], params[0]['data']).hex()
+            except Revert:
+                response['error'] = {'code': 3, 'message': 'execution reverted', 'data': '0x'}
+        elif method == 'eth_getBalance':
+            response['result'] = hex(7)
+        elif method == 'eth_blockNumber':
+            response['result'] = hex(self.block)
+        elif method == 'eth_chainId':
+            response['result'] = '0x38'
+        elif method == 'eth_getCode':
+            deployed = params[0].lower() != MULTICALL3 or self.multicall_deployed
+            response['result'] = '0x6080' if deployed else '0x'
+        elif method == 'eth_getBlockByNumber':
+            response['result'] = {'number': hex(self.block), 'timestamp': hex(self.timestamp),
+                                  'hash': '0x' + self.block.to_bytes(32, 'big').hex()}
+        elif method == 'eth_gasPrice':
+            response['result'] = hex(10**9)
+        elif method == 'eth_estimateGas':
+            try:
+                self.call(params[0]['to'], params[0]['data'])
+                response['result'] = hex(90000)
+            except Revert:
+                response['error'] = {'code': 3, 'message': 'execution reverted', 'data': '0x'}
+        elif method == 'eth_getLogs':
+            response['result'] = [log for log in self.logs if log_matches(log, params[0])]
+        elif method == 'eth_getTransactionCount':
+            response['result'] = hex(getattr(self, 'pending_nonce', 0))
+        else:
+            response['error'] = {'code': -32601, 'message': f'unsupported {method}'}
+        return response
+
+    def make_request(self, method, params):
+        if method in ('eth_chainId', 'eth_getCode'):
+            return self.respond(method, params)
+        self.posts += 1
+        if self.down:
+            raise requests.ConnectionError('node down')
+        return self.respond(method, params)
+
+    def make_batch_request(self, batch_requests):
+        self.posts += 1
+        if self.down:
+            raise requests.ConnectionError('node down')
+        return [self.respond(m, p, i) for i, (m, p) in enumerate(batch_requests)]
+
+
+class AsyncFakeNode(AsyncBaseProvider):
+    """AsyncWeb3 使用的假节点，请求转交给同一个 FakeNode"""
+
+    def __init__(self, node):
+        super().__init__()
+        self.node = node
+
+    async def is_connected(self, show_traceback=False):
+        return True
+
+    async def make_request(self, method, params):
+        return self.node.make_request(method, params)
+
+    async def make_batch_request(self, batch_requests):
+        return self.node.make_batch_request(batch_requests)
+
+
+@pytest.fixture
+def node():
+    multicall._unavailable_until.clear()
+    return FakeNode(balances={'0x' + 'aa' * 20: 100, '0x' + 'bb' * 20: 200})
+
+
+@pytest.fixture
+def w3(node):
+    return Web3(node)
+
+
+@pytest.fixture
+def token(w3):
+    from server_config import ERC20_ABI
+    return w3.eth.contract(address=Web3.to_checksum_address(TOKEN), abi=ERC20_ABI)
+
+
+@pytest.fixture(scope='session')
+def server():
+    """导入 api-server-v2.py：不启动后台线程、不预压缩静态文件，RPC 指向假节点"""
+    import importlib.util
+    import json
+    import server_config
+
+    # 部署时服务器与 contract-info/ 同目录；仓库中从根目录读取完整ABI
+    with open(os.path.join(SERVER_DIR, '..', '..', 'contract-info', 'UnifiedSystemV19_ABI.json')) as f:
+        server_config.UNIFIED_SYSTEM_ABI = json.load(f)
+
+    os.environ['API_PREFORK'] = '1'
+    os.environ['STATIC_SERVING_ENABLED'] = '0'
+    spec = importlib.util.spec_from_file_location('api_server_v2', os.path.join(SERVER_DIR, 'api-server-v2.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.w3.provider = FakeNode()
+    return module
+
+
+@pytest.fixture
+def client(server):
+    server.cache.clear()
+    return server.app.test_client()
+
+
+@pytest.fixture(scope='session')
+def async_server(server):
+    """导入 api_server_async.py，RPC 指向同步服务器的假节点（两个服务器读取相同的链上状态）"""
+    import api_server_async
+    api_server_async.w3.provider = AsyncFakeNode(server.w3.provider)
+    return api_server_async
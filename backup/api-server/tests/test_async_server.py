@@ -0,0 +1,168 @@
+"""异步服务器与同步服务器读取相同的链上状态时返回相同的数据"""
+
+import asyncio
+import time
+
+import pytest
+from eth_abi import encode
+from web3 import Web3
+
+from conftest import Revert, selector
+from multicall import _abi_type
+
+USER = Web3.to_checksum_address('0x' + 'ab' * 20)
+EXPIRY = 2_000_000_000
+
+
+@pytest.fixture
+def chain(server, async_server, client, monkeypatch):
+    """假节点上的统一系统合约与代币：矿机3的 getNFTMetadata 回滚"""
+    node = server.w3.provider
+    unified = server.CONTRACT_ADDRESSES['UNIFIED_SYSTEM'].lower()
+    functions = {item['name']: item for item in server.UNIFIED_SYSTEM_ABI if item.get('type') == 'function'}
+
+    def returns(name, handler):
+        item = functions[name]
+        signature = f"{name}({','.join(i['type'] for i in item['inputs'])})"
+        output_types = [_abi_type(o) for o in item['outputs']]
+        node.handlers[(unified, selector(signature))] = lambda body: encode(output_types, handler(body))
+
+    def metadata(body):
+        token_id = int.from_bytes(body[:32], 'big')
+        if token_id == 3:
+            raise Revert()
+        return [1, 100, 10, EXPIRY]
+
+    returns('getUserMiningData', lambda body: [5, 4, 1, 10**18, 2 * 10**18, 2, 100, True, 3 * 10**17, 0, 2, 5])
+    returns('getUserMinersDetail', lambda body: [[1, 2], [1, 2], [10, 20], [EXPIRY, EXPIRY], [False, False], [500, 600]])
+    returns('minerLevels', lambda body: [10**18, 100 * int.from_bytes(body[:32], 'big'), 1000, 1])
+    returns('getUserMiners', lambda body: [[1, 2, 3]])
+    returns('getNFTMetadata', metadata)
+    returns('getReferralInfo', lambda body: [0, 0, 0, []])
+    returns('getNetworkStats', lambda body: [1000, 2, 3 * 10**18])
+    returns('getContractInfo', lambda body: ['V19', 5, 1000, 2, '0x' + '44' * 20])
+    returns('getPoolBalances', lambda body: [8 * 10**18, 9 * 10**18])
+
+    tokens = {server.CONTRACT_ADDRESSES[name].lower() for name in ('USDT_TOKEN', 'DREAMLE_TOKEN')}
+    node.tokens |= tokens
+    node.balances[USER.lower()] = 5 * 10**18
+
+    monkeypatch.setattr(server, 'level_hash_power', {})
+    monkeypatch.setattr(async_server, 'level_hash_power', {})
+    monkeypatch.setattr(server, 'MINERS_DETAIL_SUPPORTED', None)
+    monkeypatch.setattr(async_server, 'miners_detail_supported', None)
+    async_server.cache.clear()
+    yield node
+    node.handlers.clear()
+    node.tokens -= tokens
+
+
+def get_async(async_server, path, headers=None):
+    async def run():
+        response = await async_server.app.test_client().get(path, headers=headers)
+        return response.status_code, await response.get_json(), response.headers
+    return asyncio.run(run())
+
+
+def without_timestamps(value):
+    if isinstance(value, dict):
+        return {k: without_timestamps(v) for k, v in value.items() if k != 'timestamp'}
+    if isinstance(value, list):
+        return [without_timestamps(v) for v in value]
+    return value
+
+
+def assert_same(client, async_server, path):
+    sync = client.get(path)
+    status, body, headers = get_async(async_server, path)
+    assert (sync.status_code, status) == (200, 200)
+    assert without_timestamps(body) == without_timestamps(sync.json)
+    assert headers['ETag'] == sync.headers['ETag']
+    return body
+
+
+@pytest.mark.parametrize('path', [
+    f'/api/user/{USER}/mining-info',
+    f'/api/user/{USER}/balances',
+    f'/api/user/{USER}/miners',
+    '/api/network/stats'
+])
+def test_endpoints_return_the_same_data(client, async_server, chain, path):
+    body = assert_same(client, async_server, path)
+    assert body['cached'] is False
+
+
+def test_miner_fallback_reports_missing_tokens_the_same_way(server, client, async_server, chain, monkeypatch):
+    monkeypatch.setattr(server, 'MINERS_DETAIL_SUPPORTED', False)
+    monkeypatch.setattr(async_server, 'miners_detail_supported', False)
+
+    data = assert_same(client, async_server, f'/api/user/{USER}/miners')['data']
+    assert data['source'] == 'multicall'
+    assert data['incomplete'] is True and data['missingTokenIds'] == [3]
+    assert [m['tokenId'] for m in data['miners']] == [1, 2]
+    # 不完整的结果不写入缓存
+    assert async_server.cache.get_entry(f'miners_{USER.lower()}') is None
+
+
+def test_address_spellings_share_one_cache_entry(async_server, chain):
+    status, body, _ = get_async(async_server, f'/api/user/{USER.lower()}/balances')
+    assert status == 200 and body['data']['address'] == USER.lower()
+
+    status, body, _ = get_async(async_server, f'/api/user/{USER}/balances')
+    assert body['cached'] is True and body['data']['address'] == USER
+    assert 'allowances' in body['data']
+
+
+def test_invalid_address(client, async_server, chain):
+    status, body, _ = get_async(async_server, '/api/user/0x1234/balances')
+    assert status == 500 and body['success'] is False
+    assert client.get('/api/user/0x1234/balances').status_code == 500
+
+
+def test_unchanged_data_returns_304(async_server, chain):
+    _, _, headers = get_async(async_server, f'/api/user/{USER}/balances')
+    status, _, _ = get_async(async_server, f'/api/user/{USER}/balances', {'If-None-Match': headers['ETag']})
+    assert status == 304
+
+
+class Clock:
+    """异步服务器模块的时钟：真实时间加偏移（缓存仍使用真实时间）"""
+
+    def __init__(self):
+        self.offset = 0
+
+    def time(self):
+        return time.time() + self.offset
+
+
+def test_stale_while_revalidate_and_stale_if_error(async_server, chain, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(async_server, 'time', clock)
+
+    async def fresh():
+        return {'v': 'new'}
+
+    async def node_down():
+        raise ConnectionError('node down')
+
+    async def run():
+        async_server.cache.set('network_stats', {'v': 'old'}, ttl=30)
+        clock.offset = 40
+        data, meta = await async_server.get_or_load('network_stats', fresh)
+        assert data == {'v': 'old'} and meta['stale'] is True
+        while async_server.refreshing_keys:
+            await asyncio.sleep(0.01)
+        assert async_server.cache.get_entry('network_stats')[0] == {'v': 'new'}
+
+        # 超出 stale-while-revalidate 窗口：同步回源，失败时返回旧数据
+        async_server.cache.set('network_stats', {'v': 'old'}, ttl=30)
+        clock.offset = 30 + async_server.CACHE_STALE_WHILE_REVALIDATE + 10
+        data, meta = await async_server.get_or_load('network_stats', node_down)
+        assert data == {'v': 'old'} and meta['stale'] is True
+        assert not async_server.refreshing_keys
+
+        clock.offset = 30 + async_server.CACHE_STALE_IF_ERROR + 10
+        with pytest.raises(ConnectionError):
+            await async_server.get_or_load('network_stats', node_down)
+
+    asyncio.run(run())
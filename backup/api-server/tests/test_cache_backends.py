@@ -0,0 +1,132 @@
+import os
+import time
+
+import pytest
+
+from cache_backends import RedisCache, SharedMemoryCache, decode_entry, encode_entry
+
+DATA = {'address': '0x' + 'ab' * 20, 'wei': 2**70, 'miners': [{'tokenId': i} for i in range(50)]}
+
+
+class FakeRedis:
+    """内存中的 redis 客户端：get / set(px) / delete / scan_iter"""
+
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+        self.scans = 0
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError('redis down')
+
+    def get(self, name):
+        self._check()
+        return self.store.get(name)
+
+    def set(self, name, value, px=None):
+        self._check()
+        self.store[name] = value
+        self.ttls[name] = px
+
+    def delete(self, *names):
+        self._check()
+        return sum(1 for name in names if self.store.pop(name, None) is not None)
+
+    def scan_iter(self, match=None, count=None):
+        self._check()
+        self.scans += 1
+        prefix = match.rstrip('*')
+        return iter([name for name in list(self.store) if name.startswith(prefix)])
+
+
+def test_entry_round_trip():
+    raw = encode_entry(DATA, 100.0, 130.0, block=42)
+    assert decode_entry(raw) == (DATA, 100.0, 130.0, 42)
+    assert decode_entry(encode_entry('x', 1.0, 2.0))[3] is None
+
+
+@pytest.fixture
+def shm_path(tmp_path):
+    return str(tmp_path / 'cache.shm')
+
+
+def test_shm_round_trip_across_instances(shm_path):
+    writer = SharedMemoryCache(shm_path, slots=64, namespace_ttls={'balances': 30})
+    reader = SharedMemoryCache(shm_path, slots=64)  # 另一个 worker 进程打开同一文件
+
+    writer.set('balances_0xab', DATA, block=7)
+    data, stored_at, expires_at, block = reader.get_entry('balances_0xab')
+    assert data == DATA and block == 7
+    assert expires_at - stored_at == pytest.approx(30)
+    assert len(reader) == 1
+
+    assert reader.delete('balances_0xab')
+    assert writer.get_entry('balances_0xab') is None
+
+
+def test_shm_stale_and_expired_entries(shm_path):
+    cache = SharedMemoryCache(shm_path, slots=64, stale_ttl=60)
+    cache.set('mining_info_0xab', DATA, ttl=-1)
+    assert cache.get_entry('mining_info_0xab')[0] == DATA
+    assert cache.stale_hits == 1
+
+    cache.set('mining_info_0xab', DATA, ttl=-61)
+    assert cache.get_entry('mining_info_0xab') is None
+
+
+def test_shm_oversize_entry_is_not_cached(shm_path):
+    cache = SharedMemoryCache(shm_path, slots=64, slot_size=256)
+    cache.set('big', {'blob': os.urandom(500).hex()})  # 不可压缩
+    assert cache.get_entry('big') is None
+    assert cache.oversize == 1
+
+
+def test_shm_layout_change_reinitializes(shm_path):
+    SharedMemoryCache(shm_path, slots=64).set('key', 1)
+    cache = SharedMemoryCache(shm_path, slots=128)
+    assert cache.get_entry('key') is None
+    cache.set('key', 2)
+    assert cache.get_entry('key')[0] == 2
+
+
+def test_redis_round_trip():
+    client = FakeRedis()
+    cache = RedisCache(client=client, prefix='test:', namespace_ttls={'balances': 30}, stale_ttl=10)
+    cache.set('balances_0xab', DATA, block=7)
+
+    assert client.ttls['test:balances_0xab'] == 40000  # TTL + 保留期
+    data, stored_at, expires_at, block = cache.get_entry('balances_0xab')
+    assert data == DATA and block == 7
+    assert cache.get_entry('missing') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    client.store['other:key'] = b'x'
+    cache.clear()
+    assert list(client.store) == ['other:key']
+
+
+def test_redis_errors_are_misses():
+    client = FakeRedis()
+    cache = RedisCache(client=client)
+    client.down = True
+    cache.set('key', 1)
+    assert cache.get_entry('key') is None
+    assert cache.errors == 2
+
+
+def test_redis_len_is_cached():
+    client = FakeRedis()
+    cache = RedisCache(client=client, size_refresh_interval=60)
+    cache.set('a', 1)
+    assert len(cache) == 1
+    cache.set('b', 2)
+    for _ in range(10):
+        assert len(cache) == 1  # 健康检查不会每次遍历键空间
+    assert client.scans == 1
+    assert cache.stats()['entries'] == 1
+
+    cache._size_at = time.monotonic() - 61
+    assert len(cache) == 2
+    assert client.scans == 2
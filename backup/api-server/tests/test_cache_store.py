@@ -0,0 +1,131 @@
+import threading
+import time
+
+from cache_store import SingleFlight, TTLCache
+
+
+def test_lru_eviction_by_entries():
+    cache = TTLCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # a 变为最近使用
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_eviction_by_bytes():
+    cache = TTLCache(max_bytes=1000)
+    cache.set('a', 'x' * 600)
+    cache.set('b', 'y' * 600)
+
+    assert 'a' not in cache and cache.get('b') == 'y' * 600
+    assert cache.stats()['bytes'] <= 1000
+
+
+def test_namespace_ttl_and_expiry():
+    cache = TTLCache(default_ttl=30, namespace_ttls={'price': 0.05})
+    cache.set('price_bnb', 600)
+    cache.set('other', 1)
+    assert cache.ttl_for('price_bnb') == 0.05
+    time.sleep(0.1)
+
+    assert cache.get('price_bnb') is None
+    assert 'price_bnb' not in cache  # 无保留期，过期即删除
+    assert cache.get('other') == 1
+
+
+def test_stale_entry_kept_for_get_entry():
+    cache = TTLCache(stale_ttl=60)
+    cache.set('k', 'v', ttl=0.05, block=123)
+    time.sleep(0.1)
+
+    assert cache.get('k') is None
+    data, stored_at, expires_at, block = cache.get_entry('k')
+    assert (data, block) == ('v', 123) and expires_at < time.time()
+    assert cache.stale_hits == 1
+    assert cache.sweep() == 0
+
+
+def test_sweep_removes_entries_past_stale_ttl():
+    cache = TTLCache(stale_ttl=0.05)
+    cache.set('k', 'v', ttl=0.01)
+    cache.set('keep', 'v', ttl=60)
+    time.sleep(0.1)
+
+    assert cache.sweep() == 1
+    assert len(cache) == 1 and cache.get_entry('k') is None
+
+
+def run_concurrently(flight, key, fn, count):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_single_flight_deduplicates_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(1)
+        return 42
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_concurrently(flight, 'k', fetch, 5)
+
+    assert not errors and len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(result == 42 for result, _ in results)
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_single_flight_propagates_leader_error():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait(1)
+        raise ValueError('rpc down')
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_concurrently(flight, 'k', fetch, 3)
+
+    assert not results and len(errors) == 3
+    assert all(isinstance(e, ValueError) for e in errors)
+    # 失败不会留下进行中的调用
+    assert flight.do('k', lambda: 1) == (1, False)
+
+
+def test_single_flight_waiter_times_out_and_fetches_itself():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(1)
+        return 'slow'
+
+    leader = threading.Thread(target=flight.do, args=('k', slow))
+    leader.start()
+    started.wait(1)
+    assert flight.do('k', lambda: 'own') == ('own', False)
+    release.set()
+    leader.join()
+    assert flight.timeouts == 1
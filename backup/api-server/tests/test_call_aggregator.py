@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+import requests
+from web3 import Web3
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError
+
+from call_aggregator import CallAggregator
+
+ALICE = Web3.to_checksum_address('0x' + 'aa' * 20)
+NOBODY = Web3.to_checksum_address('0x' + 'cc' * 20)  # balanceOf 回滚
+NO_CODE = Web3.to_checksum_address('0x' + '33' * 20)  # 返回空数据
+
+
+def call_concurrently(aggregator, functions):
+    """同时提交调用（落在同一个合并窗口内），返回 [(结果, 异常)]"""
+    outcomes = [None] * len(functions)
+
+    def run(i):
+        try:
+            outcomes[i] = (aggregator.call(functions[i]), None)
+        except Exception as e:
+            outcomes[i] = (None, e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(functions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+@pytest.fixture
+def aggregator(w3):
+    aggregator = CallAggregator(w3, window=0.2)
+    yield aggregator
+    aggregator.stop()
+
+
+def test_calls_in_window_share_one_request(aggregator, node, token):
+    outcomes = call_concurrently(aggregator, [token.functions.balanceOf(ALICE)] * 3)
+    assert outcomes == [(100, None)] * 3
+    assert node.posts == 1
+
+
+def test_sub_call_errors_keep_their_type(aggregator, w3, token):
+    from server_config import ERC20_ABI
+    empty = w3.eth.contract(address=NO_CODE, abi=ERC20_ABI)
+    outcomes = call_concurrently(aggregator, [
+        token.functions.balanceOf(ALICE),
+        token.functions.balanceOf(NOBODY),
+        empty.functions.balanceOf(ALICE)
+    ])
+    assert outcomes[0] == (100, None)
+    assert isinstance(outcomes[1][1], ContractLogicError)
+    assert isinstance(outcomes[2][1], BadFunctionCallOutput)
+
+
+def test_transport_error_is_not_a_revert(aggregator, node, token):
+    node.down = True
+    outcomes = call_concurrently(aggregator, [token.functions.balanceOf(ALICE)] * 2)
+    for result, error in outcomes:
+        assert isinstance(error, requests.ConnectionError)
+        assert not isinstance(error, ContractLogicError)
+    assert aggregator.errors == 1
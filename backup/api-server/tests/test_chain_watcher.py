@@ -0,0 +1,210 @@
+"""区块游标与合约日志跟踪"""
+
+import json
+import os
+import threading
+import time
+
+from websockets.sync.server import serve
+
+from cache_store import TTLCache
+from chain_watcher import BlockCursor, LogFollower
+from conftest import make_log
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_new_block_invalidates_entries(w3, node):
+    cursor = BlockCursor(w3)
+    seen = []
+    cursor.add_listener(seen.append)
+    cursor.poll_once()
+    assert cursor.block == 100 and cursor.is_healthy()
+
+    cache = TTLCache()
+    cache.set('network_stats', 'v', block=cursor.block)
+    assert cursor.is_current('network_stats', cache.get_entry('network_stats')[3])
+
+    cursor.poll_once()  # 同一区块不触发回调
+    node.block = 101
+    cursor.poll_once()
+    assert seen == [100, 101]
+    assert not cursor.is_current('network_stats', cache.get_entry('network_stats')[3])
+    assert not cursor.is_current('network_stats', None)
+
+
+def test_poll_error_keeps_block_and_goes_unhealthy(w3, node):
+    cursor = BlockCursor(w3, max_lag=0.05)
+    cursor.poll_once()
+    node.down = True
+    cursor.poll_once()
+
+    assert cursor.block == 100 and cursor.poll_errors == 1
+    time.sleep(0.1)
+    assert not cursor.is_healthy()
+
+
+def test_invalidation_rule_overrides_per_key(w3):
+    cursor = BlockCursor(w3)
+    cursor.advance(100)
+    cursor.set_invalidation(lambda key: 90 if key.startswith('miners_') else None)
+
+    assert cursor.is_current('miners_0xaa', 95)
+    assert not cursor.is_current('balances_0xaa', 95)
+
+
+def new_heads_server(heads):
+    """本地 WebSocket 节点：确认 newHeads 订阅后推送给定区块头"""
+    closed = threading.Event()
+
+    def handler(ws):
+        request = json.loads(ws.recv())
+        assert request['method'] == 'eth_subscribe'
+        ws.send(json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': '0x1'}))
+        for number in heads:
+            ws.send(json.dumps({'jsonrpc': '2.0', 'method': 'eth_subscription',
+                                'params': {'subscription': '0x1', 'result': {'number': hex(number)}}}))
+        closed.wait(5)
+
+    server = serve(handler, '127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, closed
+
+
+def test_subscription_then_poll_fallback(w3, node):
+    server, closed = new_heads_server([96, 97])
+    port = server.socket.getsockname()[1]
+    cursor = BlockCursor(w3, poll_interval=0.02, ws_url=f'ws://127.0.0.1:{port}',
+                         resubscribe_interval=60)
+    cursor.start()
+    try:
+        assert wait_until(lambda: cursor.block == 97)
+        assert cursor.source == 'subscribe'
+        assert cursor.polls == 0
+
+        # 订阅断开：改用轮询 eth_blockNumber
+        closed.set()
+        server.shutdown()
+        assert wait_until(lambda: cursor.block == node.block)
+        assert cursor.source == 'poll'
+    finally:
+        cursor.stop()
+
+
+def test_unreachable_websocket_falls_back_to_polling(w3, node):
+    cursor = BlockCursor(w3, poll_interval=0.02, ws_url='ws://127.0.0.1:9', resubscribe_interval=60)
+    cursor.start()
+    try:
+        assert wait_until(lambda: cursor.block == node.block)
+        assert cursor.source == 'poll' and cursor.polls >= 1
+    finally:
+        cursor.stop()
+
+
+# ---------- 合约日志 ----------
+
+UNIFIED = '0x' + '33' * 20
+BUYER = '0x' + 'aa' * 20
+REFERRER = '0x' + 'bb' * 20
+OTHER = '0x' + 'cc' * 20
+
+
+def topic_address(address):
+    return bytes(12) + bytes.fromhex(address[2:])
+
+
+def unified_abi():
+    path = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'contract-info', 'UnifiedSystemV19_ABI.json')
+    with open(path) as f:
+        return json.load(f)
+
+
+def purchase_log(w3, block, buyer=BUYER, referrer=REFERRER):
+    """MinerPurchased(address indexed user, uint8 level, uint256 tokenId, address referrer)"""
+    topic = w3.keccak(text='MinerPurchased(address,uint8,uint256,address)')
+    data = w3.codec.encode(['uint8', 'uint256', 'address'], [1, 7, referrer])
+    return make_log(UNIFIED, block, [topic, topic_address(buyer)], data)
+
+
+def follower_for(w3, evicted):
+    cursor = BlockCursor(w3)
+    follower = LogFollower(
+        w3, cursor, [(UNIFIED, unified_abi(), None)],
+        lambda touched, block: evicted.append((touched, block)), namespaces=('miners',)
+    )
+    follower.start()
+    cursor.set_invalidation(follower.invalidation_block)
+    return cursor, follower
+
+
+def test_log_addresses_decoded_from_topics_and_data(w3, node):
+    evicted = []
+    cursor, follower = follower_for(w3, evicted)
+    cursor.poll_once()  # 从区块100开始跟踪
+
+    node.logs.append(purchase_log(w3, 101))
+    node.block = 101
+    cursor.poll_once()
+
+    assert evicted == [({BUYER: 101, REFERRER: 101}, 101)]
+    assert follower.logs_decoded == 1 and follower.is_healthy()
+
+
+def test_invalidation_only_for_addresses_with_events(w3, node):
+    cursor, follower = follower_for(w3, [])
+    cursor.poll_once()
+    node.logs.append(purchase_log(w3, 101))
+    node.block = 102
+    cursor.poll_once()
+
+    # 有事件的地址：在事件区块之前写入的条目失效
+    assert not cursor.is_current(f'miners_{BUYER}', 100)
+    assert cursor.is_current(f'miners_{BUYER}', 101)
+    # 没有事件的地址跨区块保持有效；非事件驱动的命名空间每个区块失效
+    assert cursor.is_current(f'miners_{OTHER}', 100)
+    assert not cursor.is_current(f'mining_info_{OTHER}', 101)
+
+
+def test_unhealthy_follower_invalidates_every_block(w3, node):
+    cursor, follower = follower_for(w3, [])
+    cursor.poll_once()
+    node.down = True
+    node.block = 110
+    cursor.advance(110)  # 日志拉取失败
+
+    assert follower.errors == 1 and not follower.is_healthy()
+    assert not cursor.is_current(f'miners_{OTHER}', 100)
+
+
+def test_log_with_other_indexed_layout_is_ignored(w3, node):
+    evicted = []
+    cursor, follower = follower_for(w3, evicted)
+    cursor.poll_once()
+    # ERC20 Transfer(from, to, value) 的 value 不是 indexed，与合约ABI中 ERC721 Transfer 的布局不同
+    topic = w3.keccak(text='Transfer(address,address,uint256)')
+    node.logs.append(make_log(UNIFIED, 101, [topic, topic_address(BUYER), topic_address(OTHER)],
+                              w3.codec.encode(['uint256'], [5])))
+    node.block = 101
+    cursor.poll_once()
+
+    assert evicted == [] and follower.logs_seen == 1 and follower.logs_decoded == 0
+    assert follower.processed_block == 101
+
+
+def test_server_evicts_address_entries(server, client):
+    address = '0x' + 'ab' * 20
+    for namespace in server.ADDRESS_CACHE_NAMESPACES:
+        server.cache.set(f'{namespace}_{address}', {'v': 1})
+    server.cache.set('network_stats', {'v': 1})
+
+    server.evict_addresses({address: 101}, 101)
+    assert all(f'{namespace}_{address}' not in server.cache for namespace in server.ADDRESS_CACHE_NAMESPACES)
+    assert 'network_stats' in server.cache
+    # 挖矿信息随区块变化，不使用事件驱动的长TTL
+    assert server.log_follower.key_address(f'mining_info_{address}') is None
+    assert server.log_follower.key_address(f'miners_{address}') == address
@@ -0,0 +1,100 @@
+import pytest
+import requests
+
+from gas_oracle import GasPriceOracle
+
+GWEI = 10**9
+
+
+@pytest.fixture
+def fee_history(node):
+    """假节点支持 eth_feeHistory：基础费 2 gwei，三个区块的 10/50/90 百分位优先费"""
+    respond = node.respond
+
+    def respond_with_fee_history(method, params, request_id=1):
+        if method == 'eth_feeHistory':
+            return {'jsonrpc': '2.0', 'id': request_id, 'result': {
+                'baseFeePerGas': [hex(GWEI), hex(2 * GWEI)],
+                'reward': [[hex(1), hex(10), hex(100)], [hex(2), hex(20), hex(200)], [hex(3), hex(30), hex(300)]]
+            }}
+        return respond(method, params, request_id)
+    node.respond = respond_with_fee_history
+
+
+def test_refresh_is_one_batch_with_percentile_suggestions(w3, node, fee_history):
+    oracle = GasPriceOracle(w3)
+    assert oracle.refresh(block=100) == GWEI
+
+    assert node.posts == 1
+    assert oracle.suggestions == {'slow': 2 * GWEI + 2, 'standard': 2 * GWEI + 20, 'fast': 2 * GWEI + 200}
+    stats = oracle.stats()
+    assert stats['block'] == 100 and stats['refreshes'] == 1 and stats['gas_price_gwei'] == 1.0
+
+
+def test_missing_fee_history_keeps_gas_price(w3, node):
+    # 节点不支持 eth_feeHistory 时仍更新 eth_gasPrice
+    oracle = GasPriceOracle(w3)
+    assert oracle.refresh() == GWEI
+    assert oracle.suggestions == {}
+    assert oracle.errors == 0
+
+
+def test_failed_refresh_keeps_previous_price(w3, node):
+    oracle = GasPriceOracle(w3, fee_history_blocks=0)
+    oracle.refresh()
+    updated_at = oracle.updated_at
+
+    node.down = True
+    assert oracle.refresh() == GWEI
+    assert oracle.errors == 1
+    assert oracle.updated_at == updated_at
+
+
+def test_fresh_price_is_read_without_rpc(w3, node):
+    oracle = GasPriceOracle(w3, fee_history_blocks=0, max_age=15)
+    oracle.refresh()
+    posts = node.posts
+
+    assert oracle.gas_price() == GWEI
+    assert node.posts == posts
+    assert oracle.sync_refreshes == 0
+
+
+def test_stale_price_is_refreshed_on_read(w3, node):
+    oracle = GasPriceOracle(w3, fee_history_blocks=0, max_age=15)
+    oracle.refresh()
+    oracle.updated_at -= 16
+    posts = node.posts
+
+    assert oracle.gas_price() == GWEI
+    assert node.posts == posts + 1
+    assert oracle.sync_refreshes == 1
+    assert oracle.age() < 1
+
+
+def test_stale_price_is_served_when_refresh_fails(w3, node):
+    oracle = GasPriceOracle(w3, fee_history_blocks=0, max_age=15)
+    oracle.refresh()
+    oracle.updated_at -= 60
+
+    node.down = True
+    assert oracle.gas_price() == GWEI
+    assert oracle.errors == 1
+
+
+def test_without_any_price_read_raises_when_node_is_down(w3, node):
+    oracle = GasPriceOracle(w3, fee_history_blocks=0)
+    node.down = True
+    with pytest.raises(requests.ConnectionError):
+        oracle.gas_price()
+
+
+def test_block_callback_respects_min_interval(w3, node):
+    oracle = GasPriceOracle(w3, fee_history_blocks=0, min_interval=1.0)
+    oracle.on_block(101)
+    oracle.on_block(102)
+    assert oracle.refreshes == 1 and oracle.block == 101
+
+    oracle.updated_at -= 2
+    oracle.on_block(103)
+    assert oracle.refreshes == 2 and oracle.block == 103
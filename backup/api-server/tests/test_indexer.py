@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import TOKEN
+from indexer import ChainIndexer
+
+ALICE = '0x' + 'aa' * 20
+
+
+def test_unknown_deployment_block_stays_not_ready(w3, node, token, tmp_path, monkeypatch):
+    indexer = ChainIndexer(w3, token, str(tmp_path / 'index.db'))
+
+    def unavailable():
+        raise ValueError('historical state not available')
+    monkeypatch.setattr(indexer, 'find_deployment_block', unavailable)
+
+    # 不从当前区块开始回填
+    with pytest.raises(RuntimeError):
+        indexer.step()
+    assert indexer.processed_block == 0
+    assert not indexer.is_ready()
+
+
+def test_explicit_start_block(w3, node, token, tmp_path):
+    indexer = ChainIndexer(w3, token, str(tmp_path / 'index.db'), start_block=node.block)
+    indexer.index_range = lambda from_block, to_block, miners, users: setattr(indexer, 'processed_block', to_block)
+
+    assert indexer.step()
+    assert indexer.is_ready()
+
+
+@pytest.fixture
+def unified(w3):
+    import json
+    import os
+    path = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'contract-info', 'UnifiedSystemV19_ABI.json')
+    with open(path) as f:
+        return w3.eth.contract(address=w3.to_checksum_address(TOKEN), abi=json.load(f))
+
+
+def test_failed_refresh_is_retried_after_restart(w3, node, unified, tmp_path):
+    db_path = str(tmp_path / 'index.db')
+    refreshed = []
+
+    def make_indexer(fail):
+        indexer = ChainIndexer(w3, unified, db_path, start_block=99)
+        indexer._scan = lambda from_block, to_block, miners, users: users.add(ALICE) or []
+        refresh = indexer._refresh
+
+        def flaky(token_ids, users, block):
+            refreshed.append(set(users))
+            if fail:
+                raise ValueError('rpc blip')
+            refresh(token_ids, users, block)
+        indexer._refresh = flaky
+        return indexer
+
+    with pytest.raises(ValueError):
+        make_indexer(fail=True).step()
+
+    # 区间进度已保存，变化的用户也已保存
+    indexer = make_indexer(fail=False)
+    assert indexer.processed_block == 100
+    assert indexer._pending_dirty() == (set(), {ALICE})
+
+    indexer._scan = lambda from_block, to_block, miners, users: []
+    indexer.step()
+    assert refreshed == [{ALICE}, {ALICE}]
+    assert indexer._pending_dirty() == (set(), set())
@@ -0,0 +1,87 @@
+import pytest
+import requests
+from web3 import Web3
+from web3.exceptions import ContractLogicError
+
+import multicall
+from multicall import MulticallBatch
+
+ALICE = Web3.to_checksum_address('0x' + 'aa' * 20)
+BOB = Web3.to_checksum_address('0x' + 'bb' * 20)
+NOBODY = Web3.to_checksum_address('0x' + 'cc' * 20)  # balanceOf 回滚
+
+
+def test_batch_is_one_aggregate3_call(w3, node, token):
+    batch = MulticallBatch(w3)
+    batch.add(token.functions.balanceOf(ALICE))
+    batch.add(token.functions.balanceOf(BOB))
+    ts = batch.add_block_timestamp()
+    results = batch.execute()
+
+    assert results[:2] == [100, 200]
+    assert results[ts] == node.timestamp
+    assert node.posts == 1
+
+
+def test_reverted_sub_call_is_none_with_error(w3, node, token):
+    batch = MulticallBatch(w3)
+    batch.add(token.functions.balanceOf(ALICE))
+    batch.add(token.functions.balanceOf(NOBODY))
+    results = batch.execute()
+
+    assert results == [100, None]
+    assert isinstance(batch.errors[1], ContractLogicError)
+    assert node.posts == 1
+
+
+def test_transport_error_raises_without_bisection(w3, node, token):
+    node.down = True
+    batch = MulticallBatch(w3)
+    for _ in range(40):
+        batch.add(token.functions.balanceOf(ALICE))
+    with pytest.raises(requests.ConnectionError):
+        batch.execute()
+    assert node.posts == 1
+
+
+def test_aggregate3_revert_bisects_to_required_call(w3, node, token):
+    batch = MulticallBatch(w3)
+    for _ in range(7):
+        batch.add(token.functions.balanceOf(ALICE))
+    batch.add(token.functions.balanceOf(NOBODY), allow_failure=False)
+    with pytest.raises(ContractLogicError):
+        batch.execute()
+
+
+def test_missing_multicall3_falls_back_to_one_rpc_batch(w3, node, token):
+    node.multicall_deployed = False
+    batch = MulticallBatch(w3)
+    batch.add(token.functions.balanceOf(ALICE))
+    batch.add(token.functions.balanceOf(NOBODY))
+    bnb = batch.add_eth_balance(ALICE)
+    ts = batch.add_block_timestamp()
+    results = batch.execute()
+
+    assert results[0] == 100
+    assert results[1] is None and isinstance(batch.errors[1], ContractLogicError)
+    assert results[bnb] == 7
+    assert results[ts] == node.timestamp
+    # 一次 aggregate3（返回空数据）+ 一次 JSON-RPC 批量请求
+    assert node.posts == 2
+
+    # 之后的批次直接走 JSON-RPC 批量请求
+    node.posts = 0
+    batch = MulticallBatch(w3)
+    batch.add(token.functions.balanceOf(BOB))
+    batch.add(token.functions.balanceOf(ALICE))
+    assert batch.execute() == [200, 100]
+    assert node.posts == 1
+    assert multicall.MULTICALL3_ADDRESS in multicall._unavailable_until
+
+
+def test_chunking_by_call_count(w3, node, token):
+    batch = MulticallBatch(w3, max_calls=3)
+    for _ in range(7):
+        batch.add(token.functions.balanceOf(BOB))
+    assert batch.execute() == [200] * 7
+    assert node.posts == 3
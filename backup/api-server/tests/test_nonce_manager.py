@@ -0,0 +1,106 @@
+import time
+
+from web3 import Web3
+
+from cache_store import TTLCache
+from nonce_manager import NonceManager
+
+ADDRESS = Web3.to_checksum_address('0x' + 'ab' * 20)
+
+
+def test_first_reservation_starts_at_chain_nonce(w3):
+    manager = NonceManager(w3)
+    assert manager.next_nonce(ADDRESS) is None
+    assert manager.reserve(ADDRESS, count=2, chain_nonce=7) == 7
+    assert manager.next_nonce(ADDRESS) == 9
+
+
+def test_back_to_back_reservations_increase_without_rpc(w3, node):
+    manager = NonceManager(w3)
+    manager.reserve(ADDRESS, chain_nonce=7)
+    node.methods = []
+
+    # 上一笔交易尚未上链：在本地继续分配
+    assert manager.reserve(ADDRESS) == 8
+    assert manager.reserve(ADDRESS, count=2) == 9
+    assert manager.reserve(ADDRESS) == 11
+    assert 'eth_getTransactionCount' not in node.methods
+    assert manager.stats()['local'] == 3
+
+
+def test_reservation_without_record_reads_chain(w3, node):
+    node.pending_nonce = 4
+    manager = NonceManager(w3)
+    assert manager.reserve(ADDRESS) == 4
+    assert node.methods.count('eth_getTransactionCount') == 1
+
+
+def test_higher_chain_nonce_wins(w3):
+    manager = NonceManager(w3)
+    manager.reserve(ADDRESS, chain_nonce=7)
+    # 该地址在其他地方发送了交易
+    assert manager.reserve(ADDRESS, chain_nonce=12) == 12
+
+
+def test_allocation_resets_to_chain_after_grace(w3, node):
+    manager = NonceManager(w3, grace=60)
+    manager.reserve(ADDRESS, count=2, chain_nonce=7)
+    manager.entries[ADDRESS]['reserved_at'] = time.time() - 61
+
+    # 交易在钱包中被取消：回退到链上值
+    assert manager.next_nonce(ADDRESS) is None
+    node.pending_nonce = 7
+    assert manager.reserve(ADDRESS) == 7
+
+
+def test_reconcile_drops_confirmed_allocations(w3, node):
+    manager = NonceManager(w3)
+    manager.reserve(ADDRESS, count=2, chain_nonce=7)
+    node.pending_nonce = 9
+    manager.reconcile()
+    assert ADDRESS not in manager.entries
+    assert manager.confirmed == 1
+
+
+def test_reconcile_raises_local_allocation_to_chain(w3, node):
+    manager = NonceManager(w3)
+    manager.reserve(ADDRESS, chain_nonce=7)
+    node.pending_nonce = 8
+    manager.reserve(ADDRESS)
+
+    # 链上已有 12 笔：下一次本地分配跳到链上值
+    node.pending_nonce = 12
+    manager.reconcile()
+    assert manager.reserve(ADDRESS) == 12
+
+
+def test_reconcile_releases_abandoned_nonce_after_grace(w3, node):
+    manager = NonceManager(w3, grace=60)
+    manager.reserve(ADDRESS, count=2, chain_nonce=7)
+    node.pending_nonce = 7
+
+    manager.reconcile()
+    assert manager.next_nonce(ADDRESS) == 9  # 宽限期内保留
+
+    manager.entries[ADDRESS]['reserved_at'] = time.time() - 61
+    manager.reconcile()
+    assert ADDRESS not in manager.entries
+    assert manager.released == 1
+
+
+def test_workers_share_allocations(w3, node):
+    store = TTLCache()
+    first, second = NonceManager(w3), NonceManager(w3)
+    first.use_shared_state(store)
+    second.use_shared_state(store)
+
+    assert first.reserve(ADDRESS, count=2, chain_nonce=7) == 7
+    node.methods = []
+    assert second.reserve(ADDRESS) == 9
+    assert first.reserve(ADDRESS) == 10
+    assert 'eth_getTransactionCount' not in node.methods
+
+    # 全部上链后删除共享记录
+    node.pending_nonce = 11
+    first.reconcile()
+    assert first.next_nonce(ADDRESS) is None
@@ -0,0 +1,127 @@
+import pytest
+import requests
+from web3 import Web3
+from web3.exceptions import ContractLogicError, Web3RPCError
+
+import rpc_batch
+from rpc_batch import RPCBatch
+
+ALICE = Web3.to_checksum_address('0x' + 'aa' * 20)
+BOB = Web3.to_checksum_address('0x' + 'bb' * 20)
+NOBODY = Web3.to_checksum_address('0x' + 'cc' * 20)  # balanceOf 回滚
+
+
+def mixed_batch(w3, token):
+    batch = RPCBatch(w3)
+    batch.add_balance(ALICE)
+    batch.add_call(token.functions.balanceOf(ALICE))
+    batch.add_gas_price()
+    batch.add_call(token.functions.balanceOf(BOB))
+    batch.add_transaction_count(ALICE, 'pending')
+    return batch
+
+
+def test_batch_is_one_post_with_results_in_add_order(w3, node, token):
+    batches = rpc_batch.batch_stats['batches']
+    results = mixed_batch(w3, token).execute()
+
+    assert results == [7, 100, 10**9, 200, 0]
+    assert node.posts == 1
+    assert rpc_batch.batch_stats['batches'] == batches + 1
+
+
+def test_out_of_order_batch_response_is_matched_by_id(w3, node, token):
+    respond = node.make_batch_request
+    node.make_batch_request = lambda batch_requests: list(reversed(respond(batch_requests)))
+
+    assert mixed_batch(w3, token).execute() == [7, 100, 10**9, 200, 0]
+
+
+def test_single_call_is_not_batched(w3, node, token):
+    node.make_batch_request = None  # 不应被调用
+    batch = RPCBatch(w3)
+    batch.add_call(token.functions.balanceOf(BOB))
+    assert batch.execute() == [200]
+    assert node.posts == 1
+
+
+def test_node_without_batch_support_falls_back_to_individual_requests(w3, node, token):
+    # 不支持批量的节点对整个批量请求返回单个错误对象
+    node.make_batch_request = lambda batch_requests: {'jsonrpc': '2.0', 'id': None,
+                                                      'error': {'code': -32600, 'message': 'batch disabled'}}
+    fallbacks = rpc_batch.batch_stats['fallbacks']
+
+    assert mixed_batch(w3, token).execute() == [7, 100, 10**9, 200, 0]
+    assert node.batch_supported is False
+    assert node.posts == 5
+    assert rpc_batch.batch_stats['fallbacks'] == fallbacks + 1
+
+    # 之后不再尝试批量请求
+    node.make_batch_request = None
+    assert mixed_batch(w3, token).execute() == [7, 100, 10**9, 200, 0]
+
+
+def test_not_implemented_batch_falls_back(w3, node, token):
+    def unsupported(batch_requests):
+        raise NotImplementedError
+    node.make_batch_request = unsupported
+
+    assert mixed_batch(w3, token).execute() == [7, 100, 10**9, 200, 0]
+    assert node.batch_supported is False
+
+
+def test_failed_batch_post_retries_individually_and_keeps_batching(w3, node, token):
+    def flaky(batch_requests):
+        raise requests.ConnectionError('reset by peer')
+    node.make_batch_request = flaky
+
+    assert mixed_batch(w3, token).execute() == [7, 100, 10**9, 200, 0]
+    assert getattr(node, 'batch_supported', True) is True
+
+
+def test_revert_raises_contract_logic_error(w3, node, token):
+    batch = RPCBatch(w3)
+    batch.add_call(token.functions.balanceOf(ALICE))
+    batch.add_call(token.functions.balanceOf(NOBODY))
+    with pytest.raises(ContractLogicError):
+        batch.execute()
+
+
+def test_allowed_failures_are_none_with_mapped_errors(w3, node, token):
+    respond = node.respond
+
+    def respond_with_errors(method, params, request_id=1):
+        if method == 'eth_blockNumber':
+            # 部分节点回滚时不返回 code 3，仅在消息中说明
+            return {'jsonrpc': '2.0', 'id': request_id,
+                    'error': {'code': -32000, 'message': 'Execution Reverted: paused'}}
+        return respond(method, params, request_id)
+    node.respond = respond_with_errors
+
+    batch = RPCBatch(w3)
+    batch.add_call(token.functions.balanceOf(NOBODY), allow_failure=True)
+    batch.add_call(token.functions.balanceOf(ALICE))
+    batch.add('eth_unknownMethod', [], allow_failure=True)
+    batch.add('eth_blockNumber', [], allow_failure=True)
+    results = batch.execute()
+
+    assert results == [None, 100, None, None]
+    assert set(batch.errors) == {0, 2, 3}
+    assert isinstance(batch.errors[0], ContractLogicError)
+    assert isinstance(batch.errors[2], Web3RPCError)
+    assert not isinstance(batch.errors[2], ContractLogicError)
+    assert isinstance(batch.errors[3], ContractLogicError)
+
+    # 重新执行时 errors 只反映本次结果
+    node.respond = respond
+    batch.calls = batch.calls[1:2]
+    assert batch.execute() == [100]
+    assert batch.errors == {}
+
+
+def test_required_rpc_error_raises_web3_rpc_error(w3, node):
+    batch = RPCBatch(w3)
+    batch.add_gas_price()
+    batch.add('eth_unknownMethod', [])
+    with pytest.raises(Web3RPCError):
+        batch.execute()
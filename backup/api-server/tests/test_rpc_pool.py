@@ -0,0 +1,133 @@
+import time
+
+import pytest
+import requests
+
+from rpc_pool import PooledHTTPProvider
+
+
+class Endpoint:
+    """假节点：可设置延迟、网络错误或返回的 JSON-RPC 错误"""
+
+    def __init__(self, url):
+        self.url = url
+        self.delay = 0
+        self.down = False
+        self.error = None
+        self.methods = []
+
+    def make_request(self, method, params):
+        self.methods.append(method)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.down:
+            raise requests.ConnectionError(f'{self.url} down')
+        if self.error is not None:
+            return {'jsonrpc': '2.0', 'id': 1, 'error': self.error}
+        return {'jsonrpc': '2.0', 'id': 1, 'result': self.url}
+
+    def make_batch_request(self, batch_requests):
+        return [self.make_request(m, p) for m, p in batch_requests]
+
+    def is_connected(self, show_traceback=False):
+        return not self.down
+
+
+@pytest.fixture
+def nodes():
+    return {}
+
+
+def make_pool(nodes, count=2, **kwargs):
+    def factory(url):
+        nodes[url] = Endpoint(url)
+        return nodes[url]
+    kwargs.setdefault('probe_every', 0)
+    pool = PooledHTTPProvider([f'node{i}' for i in range(count)], provider_factory=factory, **kwargs)
+    return pool, [nodes[f'node{i}'] for i in range(count)]
+
+
+def test_failover_on_transport_error(nodes):
+    pool, (first, second) = make_pool(nodes)
+    first.down = True
+
+    assert pool.make_request('eth_blockNumber', [])['result'] == 'node1'
+    assert pool.failovers == 1
+    assert pool.endpoints[0].failures == 1
+
+
+def test_node_error_code_fails_over_but_revert_does_not(nodes):
+    pool, (first, second) = make_pool(nodes)
+    first.error = {'code': -32005, 'message': 'limit exceeded'}
+    assert pool.make_request('eth_call', [])['result'] == 'node1'
+
+    # 回滚是调用本身的结果，原样返回，不切换节点
+    first.error = second.error = {'code': 3, 'message': 'execution reverted'}
+    response = pool.make_request('eth_call', [])
+    assert response['error']['code'] == 3
+    assert pool.failovers == 1
+
+
+def test_all_endpoints_down_raises_last_error(nodes):
+    pool, endpoints = make_pool(nodes)
+    for endpoint in endpoints:
+        endpoint.down = True
+    with pytest.raises(requests.ConnectionError):
+        pool.make_request('eth_blockNumber', [])
+
+
+def test_circuit_opens_and_half_opens(nodes):
+    pool, (first, second) = make_pool(nodes, failure_threshold=2, cooldown=0.1)
+    first.down = True
+    pool.make_request('eth_blockNumber', [])
+    pool.make_request('eth_blockNumber', [])
+
+    state = pool.endpoints[0]
+    assert state.stats()['circuit'] == 'open'
+    first.methods.clear()
+    pool.make_request('eth_blockNumber', [])
+    assert first.methods == []  # 熔断期间不再发往该节点
+
+    time.sleep(0.15)
+    first.down = False
+    assert state.available() and state.half_open
+    state.record_success(0.01)
+    assert state.stats()['circuit'] == 'closed'
+
+
+def test_slow_primary_is_hedged(nodes):
+    pool, (first, second) = make_pool(nodes, hedge_min=0.05, hedge_default=0.05)
+    first.delay = 0.5
+
+    started = time.monotonic()
+    assert pool.make_request('eth_call', [])['result'] == 'node1'
+    assert time.monotonic() - started < 0.4
+    assert pool.hedged == 1
+    assert pool.endpoints[1].hedged_wins == 1
+    pool.close()
+
+
+def test_writes_are_never_hedged(nodes):
+    pool, (first, second) = make_pool(nodes, hedge_min=0.05, hedge_default=0.05)
+    first.delay = 0.2
+
+    assert pool.make_request('eth_sendRawTransaction', ['0x'])['result'] == 'node0'
+    assert pool.hedged == 0
+    assert second.methods == []
+
+
+def test_batch_goes_to_one_endpoint(nodes):
+    pool, (first, second) = make_pool(nodes)
+    responses = pool.make_batch_request([('eth_blockNumber', []), ('eth_gasPrice', [])])
+
+    assert [r['result'] for r in responses] == ['node0', 'node0']
+    assert second.methods == []
+
+
+def test_faster_endpoint_ranks_first(nodes):
+    pool, _ = make_pool(nodes)
+    pool.endpoints[0].record_success(0.3)
+    pool.endpoints[1].record_success(0.05)
+
+    assert pool.ranked_endpoints()[0].url == 'node1'
+    assert pool.make_request('eth_blockNumber', [])['result'] == 'node1'
@@ -0,0 +1,163 @@
+import json
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from rpc_transport import TunedHTTPProvider
+
+
+class StubNode:
+    """本地 JSON-RPC 节点：记录每个请求所用的连接（客户端端口）与最大并发数"""
+
+    def __init__(self):
+        self.delay = 0
+        self.status = 200
+        self.ports = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub.lock:
+                    stub.ports.append(self.client_address[1])
+                    stub.active += 1
+                    stub.peak = max(stub.peak, stub.active)
+                try:
+                    time.sleep(stub.delay)
+                    if isinstance(body, list):
+                        # 批量响应的顺序与请求不同
+                        payload = [{'jsonrpc': '2.0', 'id': r['id'], 'result': r['method']} for r in reversed(body)]
+                    else:
+                        payload = {'jsonrpc': '2.0', 'id': body['id'], 'result': body['method']}
+                    data = json.dumps(payload).encode()
+                    self.send_response(stub.status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                finally:
+                    with stub.lock:
+                        stub.active -= 1
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub():
+    stub = StubNode()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+def test_requests_reuse_one_keep_alive_connection(stub):
+    provider = TunedHTTPProvider(stub.url)
+    for _ in range(5):
+        assert provider.make_request('eth_blockNumber', [])['result'] == 'eth_blockNumber'
+
+    assert len(set(stub.ports)) == 1
+    stats = provider.stats()
+    assert stats['protocol'] == 'http/1.1'
+    assert stats['requests'] == 5 and stats['errors'] == 0 and stats['in_flight'] == 0
+    assert stats['connections_opened'] == 1 and stats['idle_connections'] == 1
+    assert stats['avg_ms'] is not None
+
+
+def test_pool_size_caps_connections_and_requests_queue(stub):
+    stub.delay = 0.1
+    provider = TunedHTTPProvider(stub.url, pool_size=2)
+    threads = [threading.Thread(target=provider.make_request, args=('eth_call', [])) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # pool_block: 超出连接池的请求等待空闲连接，而不是新建连接
+    assert stub.peak == 2
+    assert len(set(stub.ports)) == 2
+    assert provider.pool_stats()['connections_opened'] == 2
+    assert provider.peak_in_flight > 2
+
+
+def test_method_timeouts(stub):
+    stub.delay = 0.3
+    provider = TunedHTTPProvider(stub.url, read_timeout=0.1, method_timeouts={'eth_getLogs': 2})
+
+    assert provider.timeout_for('eth_getLogs') == (provider.connect_timeout, 2)
+    assert provider.make_request('eth_getLogs', [{}])['result'] == 'eth_getLogs'
+    with pytest.raises(requests.exceptions.Timeout):
+        provider.make_request('eth_blockNumber', [])
+    assert provider.errors == 1
+
+
+def test_http_error_is_raised_and_counted(stub):
+    stub.status = 503
+    provider = TunedHTTPProvider(stub.url)
+    with pytest.raises(requests.HTTPError):
+        provider.make_request('eth_blockNumber', [])
+    assert provider.stats()['errors'] == 1
+
+
+def test_batch_responses_in_request_order(stub):
+    provider = TunedHTTPProvider(stub.url)
+    responses = provider.make_batch_request([('eth_blockNumber', []), ('eth_gasPrice', []), ('eth_chainId', [])])
+    assert [r['result'] for r in responses] == ['eth_blockNumber', 'eth_gasPrice', 'eth_chainId']
+    assert len(stub.ports) == 1
+
+
+def test_reset_connections_opens_new_pool(stub):
+    provider = TunedHTTPProvider(stub.url)
+    provider.make_request('eth_blockNumber', [])
+    provider.reset_connections()
+    provider.make_request('eth_blockNumber', [])
+
+    assert len(set(stub.ports)) == 2
+    assert provider.pool_stats()['connections_opened'] == 1
+
+
+def test_http2_without_httpx_falls_back(stub, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'httpx', None)
+    provider = TunedHTTPProvider(stub.url, http2=True)
+    assert provider.protocol == 'http/1.1'
+    assert provider.make_request('eth_blockNumber', [])['result'] == 'eth_blockNumber'
+
+
+def test_http2_uses_httpx_client(stub, monkeypatch):
+    created = {}
+
+    class Client:
+        def __init__(self, http2, limits, headers):
+            created.update(http2=http2, limits=limits)
+
+        def post(self, url, content, timeout):
+            created['timeout'] = timeout
+            return requests.post(url, data=content, headers={'Content-Type': 'application/json'})
+
+    httpx = types.SimpleNamespace(
+        Client=Client,
+        Limits=lambda **kwargs: kwargs,
+        Timeout=lambda read, connect: (connect, read)
+    )
+    monkeypatch.setitem(sys.modules, 'httpx', httpx)
+    provider = TunedHTTPProvider(stub.url, pool_size=4, http2=True)
+
+    assert provider.protocol == 'http/2'
+    assert created['http2'] is True and created['limits']['max_connections'] == 4
+    assert provider.make_request('eth_gasPrice', [])['result'] == 'eth_gasPrice'
+    assert created['timeout'] == (provider.connect_timeout, provider.read_timeout)
+    assert provider.pool_stats() == {}
@@ -0,0 +1,450 @@
+import time
+
+import pytest
+import requests
+from web3 import Web3
+from web3.exceptions import BadFunctionCallOutput
+
+import multicall
+
+USER = Web3.to_checksum_address('0x' + 'ab' * 20)
+
+
+def miner(token_id):
+    return {'tokenId': token_id, 'level': 1, 'hashPower': '100'}
+
+
+def test_incomplete_miner_list_is_not_cached(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'MINERS_DETAIL_SUPPORTED', False)
+    monkeypatch.setattr(server, 'fetch_miners_multicall', lambda address: ([miner(1)], [13]))
+
+    data = client.get(f'/api/user/{USER}/miners').json['data']
+    assert data['incomplete'] is True
+    assert data['missingTokenIds'] == [13]
+    assert server.cache.get_entry(f'miners_{USER.lower()}') is None
+
+    monkeypatch.setattr(server, 'fetch_miners_multicall', lambda address: ([miner(1), miner(13)], []))
+    data = client.get(f'/api/user/{USER}/miners').json['data']
+    assert data['total_count'] == 2 and 'incomplete' not in data
+    assert server.cache.get_entry(f'miners_{USER.lower()}') is not None
+
+
+def test_network_error_does_not_disable_miners_detail(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'MINERS_DETAIL_SUPPORTED', None)
+
+    def node_down(address):
+        raise requests.ConnectionError('node down')
+    monkeypatch.setattr(server, 'fetch_miners_detail', node_down)
+    monkeypatch.setattr(server, 'fetch_miners_multicall', lambda address: ([miner(1)], []))
+
+    data = client.get(f'/api/user/{USER}/miners').json['data']
+    assert data['source'] == 'multicall'
+    assert server.MINERS_DETAIL_SUPPORTED is None
+
+    def not_supported(address):
+        raise BadFunctionCallOutput('empty return')
+    monkeypatch.setattr(server, 'fetch_miners_detail', not_supported)
+    server.cache.clear()
+    client.get(f'/api/user/{USER}/miners')
+    assert server.MINERS_DETAIL_SUPPORTED is False
+
+
+def test_failed_level_read_is_not_served_as_zero_hash_power(server, client, monkeypatch):
+    # 等级9的 minerLevels 读取失败（假节点返回空数据）
+    detail = ([7], [9], [1], [2], [False], [100])
+    monkeypatch.setattr(server, 'MINERS_DETAIL_SUPPORTED', True)
+    monkeypatch.setattr(server, 'fetch_miners_detail', lambda address: detail)
+    monkeypatch.setattr(server, 'fetch_miners_multicall', lambda address: ([miner(7)], []))
+    server.level_hash_power.pop(9, None)
+
+    with pytest.raises(BadFunctionCallOutput):
+        server.get_level_hash_power([9])
+    data = client.get(f'/api/user/{USER}/miners').json['data']
+    assert data['source'] == 'multicall'
+    assert data['miners'][0]['hashPower'] == '100'
+    assert server.MINERS_DETAIL_SUPPORTED is True
+
+
+def test_failed_level_read_fails_bulk_miners(server, client, monkeypatch):
+    detail = ([7], [9], [1], [2], [False], [100])
+    monkeypatch.setattr(server, 'MINERS_DETAIL_SUPPORTED', True)
+    monkeypatch.setattr(server, 'read_calls', lambda functions: ([detail] * len(functions), {}))
+    server.level_hash_power.pop(9, None)
+
+    loaded, failed = server.bulk_load([(USER.lower(), 'miners')])
+    assert loaded == {}
+    assert isinstance(failed[(USER.lower(), 'miners')], BadFunctionCallOutput)
+
+    body = {'addresses': [USER], 'fields': ['miners']}
+    response = client.post('/api/users/mining-info', json=body)
+    assert response.json['errors'][USER]['miners']
+    assert 'miners' not in response.json['data'][USER]
+    assert server.cache.get_entry(f'miners_{USER.lower()}') is None
+
+
+@pytest.mark.parametrize('body', [
+    {'addresses': [USER, ['0x' + 'ab' * 20]]},
+    {'addresses': [{'address': USER}]},
+    {'addresses': [USER], 'fields': [['miners']]},
+])
+def test_bulk_request_with_non_string_items_is_bad_request(client, body):
+    response = client.post('/api/users/mining-info', json=body)
+    assert response.status_code == 400
+    assert response.json['success'] is False
+
+def test_gas_profile_hit_still_checks_for_revert(server, client, monkeypatch):
+    node = server.w3.provider
+    unified = server.CONTRACT_ADDRESSES['UNIFIED_SYSTEM'].lower()
+    monkeypatch.setattr(server.gas_profiles, 'lookup', lambda key: 100000)
+    server.nonce_manager.entries.clear()
+    node.methods = []
+
+    body = {'action': 'purchaseMiner', 'from': USER, 'params': {'level': 1}}
+    response = client.post('/api/transaction/prepare', json=body)
+    assert response.status_code == 200
+    assert response.json['data']['gas'] == hex(int(100000 * server.GAS_MARGIN))
+    assert 'eth_estimateGas' not in node.methods
+
+    node.reverting.add(unified)
+    try:
+        response = client.post('/api/transaction/prepare', json=body)
+    finally:
+        node.reverting.discard(unified)
+    assert response.status_code == 500
+    assert 'reverted' in response.json['error']
+
+
+def test_purchase_miner_without_level_is_bad_request(client):
+    response = client.post('/api/transaction/prepare', json={'action': 'purchaseMiner', 'from': USER, 'params': {}})
+    assert response.status_code == 400
+    assert response.json == {'success': False, 'error': 'Missing level parameter'}
+
+
+def test_plan_preview_does_not_reserve_nonces(server, client):
+    server.nonce_manager.entries.clear()
+    body = {'action': 'claimRewards', 'from': USER, 'params': {}}
+
+    data = client.post('/api/transaction/plan', json=body).json['data']
+    assert 'transactions' not in data
+    assert not server.nonce_manager.entries
+
+    data = client.post('/api/transaction/plan', json=dict(body, prepare=True)).json['data']
+    assert len(data['transactions']) == 1
+    assert USER in server.nonce_manager.entries
+
+
+def test_back_to_back_prepares_get_increasing_nonces(server, client):
+    node = server.w3.provider
+    server.nonce_manager.entries.clear()
+    node.pending_nonce = 5
+    body = {'action': 'claimRewards', 'from': USER, 'params': {}}
+
+    assert client.post('/api/transaction/prepare', json=body).json['data']['nonce'] == hex(5)
+    node.methods = []
+    assert client.post('/api/transaction/prepare', json=body).json['data']['nonce'] == hex(6)
+    assert 'eth_getTransactionCount' not in node.methods
+    node.pending_nonce = 0
+
+
+def test_allowance_override_slots(server):
+    from eth_abi import encode
+
+    spender = Web3.to_checksum_address(server.CONTRACT_ADDRESSES['UNIFIED_SYSTEM'])
+    for action, token, slot in (('authorizeUSDT', 'USDT_TOKEN', 2), ('authorizeDRM', 'DREAMLE_TOKEN', 1)):
+        step = server.prepare_step(action, USER, {'amount': 5})
+        # allowance[owner][spender]: keccak(spender . keccak(owner . slot))
+        owner_slot = Web3.keccak(encode(['address', 'uint256'], [USER, slot]))
+        key = Web3.keccak(encode(['address', 'bytes32'], [spender, owner_slot]))
+        assert server.allowance_override(step, USER) == {
+            Web3.to_checksum_address(server.CONTRACT_ADDRESSES[token]): {
+                'stateDiff': {Web3.to_hex(key): '0x' + (5).to_bytes(32, 'big').hex()}
+            }
+        }
+
+
+@pytest.fixture
+def batch_node(server, monkeypatch):
+    """prepare-batch 测试：不使用Gas画像，状态覆盖支持情况未探测；estimates 记录 eth_estimateGas 参数"""
+    node = server.w3.provider
+    monkeypatch.setattr(server, 'gas_profiles', None)
+    monkeypatch.setattr(server, 'STATE_OVERRIDE_SUPPORTED', None)
+    server.nonce_manager.entries.clear()
+    node.estimates = []
+    node.override_error = None  # 附带状态覆盖的估算返回的错误
+    respond = node.respond
+
+    def respond_with_override(method, params, request_id=1):
+        if method == 'eth_estimateGas':
+            node.estimates.append(params)
+            if len(params) > 2 and node.override_error is not None:
+                return {'jsonrpc': '2.0', 'id': request_id, 'error': node.override_error}
+        return respond(method, params, request_id)
+    monkeypatch.setattr(node, 'respond', respond_with_override)
+    return node
+
+
+BATCH_BODY = {'from': USER, 'actions': [
+    {'action': 'authorizeUSDT', 'params': {}},
+    {'action': 'purchaseMiner', 'params': {'level': 1}}
+]}
+
+
+def test_prepare_batch_estimates_dependent_step_with_state_override(server, client, batch_node):
+    response = client.post('/api/transaction/prepare-batch', json=BATCH_BODY)
+    assert response.status_code == 200
+    approve, purchase = response.json['data']
+    assert purchase['gas'] == hex(int(90000 * server.GAS_MARGIN))
+    assert int(purchase['nonce'], 16) == int(approve['nonce'], 16) + 1
+
+    (params,) = batch_node.estimates
+    step = server.prepare_step('authorizeUSDT', USER, {})
+    assert params[2] == server.allowance_override(step, USER)
+    assert server.STATE_OVERRIDE_SUPPORTED is True
+
+
+def test_prepare_batch_without_state_override_support_uses_fallback_gas(server, client, batch_node):
+    batch_node.override_error = {'code': -32602, 'message': 'too many arguments, want at most 2'}
+    response = client.post('/api/transaction/prepare-batch', json=BATCH_BODY)
+    assert response.status_code == 200
+    assert response.json['data'][1]['gas'] == hex(int(server.DEPENDENT_STEP_GAS * server.GAS_MARGIN))
+    assert server.STATE_OVERRIDE_SUPPORTED is False
+
+    # 之后不再发送状态覆盖
+    batch_node.estimates = []
+    assert client.post('/api/transaction/prepare-batch', json=BATCH_BODY).status_code == 200
+    assert batch_node.estimates == []
+
+
+def test_prepare_batch_reports_revert_as_step_error(server, client, batch_node):
+    # 模拟授权后仍回滚（如USDT余额不足）：不使用回退Gas
+    batch_node.override_error = {'code': 3, 'message': 'execution reverted: insufficient balance', 'data': '0x'}
+    response = client.post('/api/transaction/prepare-batch', json=BATCH_BODY)
+    assert response.status_code == 500
+    assert response.json['step'] == 1
+    assert 'insufficient balance' in response.json['error']
+    assert server.STATE_OVERRIDE_SUPPORTED is None
+    assert USER not in server.nonce_manager.entries
+
+
+@pytest.fixture
+def token_node(server):
+    """服务器的假节点：USDT/DRM 为代币合约，统一系统合约返回空数据（不支持的函数）"""
+    node = server.w3.provider
+    tokens = {server.CONTRACT_ADDRESSES[name].lower() for name in ('USDT_TOKEN', 'DREAMLE_TOKEN')}
+    node.tokens |= tokens
+    node.balances[USER.lower()] = 5 * 10**18
+    multicall._unavailable_until.clear()
+    yield node
+    node.tokens -= tokens
+    node.multicall_deployed = True
+    multicall._unavailable_until.clear()
+
+
+def test_facet_failure_does_not_fail_other_facets(client, token_node):
+    # 同一地址的 mining/miners 读取失败，balances 仍正常返回
+    response = client.get(f'/api/user/{USER}/balances')
+    assert response.status_code == 200
+    assert response.json['data']['usdt'] == '5'
+    assert client.get(f'/api/user/{USER}/mining-info').status_code == 500
+
+
+def test_balances_without_multicall3(client, token_node):
+    token_node.multicall_deployed = False
+    response = client.get(f'/api/user/{USER}/balances')
+    assert response.status_code == 200
+    assert response.json['data']['bnb_wei'] == '7'
+
+
+def test_response_address_keeps_caller_spelling(client, token_node):
+    lower = USER.lower()
+    assert client.get(f'/api/user/{USER}/balances').json['data']['address'] == USER
+    assert client.get(f'/api/user/{lower}/balances').json['data']['address'] == lower
+
+    body = {'addresses': [USER, lower], 'fields': ['balances']}
+    data = client.post('/api/users/mining-info', json=body).json['data']
+    assert data[USER]['balances']['address'] == USER
+    assert data[lower]['balances']['address'] == lower
+
+
+def test_bulk_load_uses_call_aggregator(server, client, token_node, monkeypatch):
+    from call_aggregator import CallAggregator
+    aggregator = CallAggregator(server.w3)
+    monkeypatch.setattr(server, 'call_aggregator', aggregator)
+    try:
+        response = client.get(f'/api/user/{USER}/balances')
+    finally:
+        aggregator.stop()
+    assert response.status_code == 200
+    assert aggregator.calls > 0
+
+
+def test_batch_failure_falls_back_per_facet(server, client, token_node, monkeypatch):
+    def batch_failed(functions):
+        raise requests.ConnectionError('batch too large')
+    monkeypatch.setattr(server, 'read_calls', batch_failed)
+
+    response = client.get(f'/api/user/{USER}/balances')
+    assert response.status_code == 200
+    assert response.json['data']['usdt'] == '5'
+
+
+def test_unchanged_balances_return_304(server, client, token_node):
+    response = client.get(f'/api/user/{USER}/balances')
+    etag = response.headers['ETag']
+    assert etag.startswith('W/') and response.headers['Cache-Control'] == 'no-cache'
+
+    # 缓存命中时响应中的 cached 字段变化，ETag 不变
+    response = client.get(f'/api/user/{USER}/balances', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == etag
+
+    token_node.balances[USER.lower()] = 6 * 10**18
+    server.cache.clear()
+    response = client.get(f'/api/user/{USER}/balances', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert response.json['data']['usdt'] == '6'
+
+
+def test_etag_ignores_load_timestamp(server):
+    assert server.data_etag({'a': 1, 'timestamp': 1}) == server.data_etag({'a': 1, 'timestamp': 2})
+    assert server.data_etag({'a': 1}) != server.data_etag({'a': 2})
+
+
+def test_miners_etag_ignores_remaining_time(server):
+    def index_miners(current_time):
+        # 索引路径按请求时间计算剩余时间
+        miner = server.format_miner(7, 1, 100, 1000, 5000, current_time=current_time)
+        return server.format_user_miners(USER, [miner], 'index')
+
+    assert server.data_etag(index_miners(2000)) == server.data_etag(index_miners(2001))
+    # 到期后 isExpired 变化，ETag 随之变化
+    assert server.data_etag(index_miners(2000)) != server.data_etag(index_miners(5000))
+
+
+def compressed(server, data, accept_encoding):
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    with server.app.test_request_context('/api/network/stats', headers=headers):
+        return server.compress_response(server.data_response(data, {'cached': False}))
+
+
+def test_large_response_is_gzipped(server, monkeypatch):
+    import gzip
+    import json
+    monkeypatch.setattr(server, 'brotli', None)
+    data = {'miners': [miner(i) for i in range(50)]}
+
+    response = compressed(server, data, 'gzip, deflate')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.get_data()))['data'] == data
+
+    response = compressed(server, data, None)
+    assert 'Content-Encoding' not in response.headers
+    assert response.json['data'] == data
+
+
+def test_small_and_not_modified_responses_are_not_compressed(server):
+    response = compressed(server, {'a': 1}, 'gzip')
+    assert 'Content-Encoding' not in response.headers
+
+    data = {'miners': [miner(i) for i in range(50)]}
+    etag = server.data_etag(data)
+    headers = {'Accept-Encoding': 'gzip', 'If-None-Match': f'W/"{etag}"'}
+    with server.app.test_request_context('/api/network/stats', headers=headers):
+        response = server.compress_response(server.data_response(data, {'cached': False}))
+    assert response.status_code == 304 and 'Content-Encoding' not in response.headers
+
+
+class Clock:
+    """服务器模块的时钟：真实时间加偏移（缓存后端仍使用真实时间）"""
+
+    def __init__(self):
+        self.offset = 0
+
+    def time(self):
+        return time.time() + self.offset
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def clock(server, client, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server, 'time', clock)
+    return clock
+
+
+def wait_for_refresh(server, key):
+    deadline = time.time() + 5
+    while key in server.refreshing_keys and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_stale_entry_is_served_while_revalidating(server, clock):
+    server.cache.set('network_stats', {'v': 'old'}, ttl=30)
+    clock.offset = 40
+
+    data, meta = server.get_or_load('network_stats', lambda: {'v': 'new'})
+    assert data == {'v': 'old'} and meta['stale'] is True
+    wait_for_refresh(server, 'network_stats')
+    assert server.cache.get_entry('network_stats')[0] == {'v': 'new'}
+
+
+def test_entry_past_revalidate_window_loads_synchronously(server, clock):
+    server.cache.set('network_stats', {'v': 'old'}, ttl=30)
+    clock.offset = 30 + server.CACHE_STALE_WHILE_REVALIDATE + 10
+
+    data, meta = server.get_or_load('network_stats', lambda: {'v': 'new'})
+    assert data == {'v': 'new'} and meta == {'cached': False}
+
+
+def test_stale_if_error(server, clock):
+    def node_down():
+        raise requests.ConnectionError('node down')
+
+    server.cache.set('network_stats', {'v': 'old'}, ttl=30)
+    clock.offset = 30 + server.CACHE_STALE_WHILE_REVALIDATE + 10
+    data, meta = server.get_or_load('network_stats', node_down)
+    assert data == {'v': 'old'} and meta['stale'] is True
+
+    clock.offset = 30 + server.CACHE_STALE_IF_ERROR + 10
+    with pytest.raises(requests.ConnectionError):
+        server.get_or_load('network_stats', node_down)
+
+
+def test_no_stale_data_after_new_block(server, clock, monkeypatch):
+    cursor = server.block_cursor
+    monkeypatch.setattr(cursor, 'block', 0)
+    monkeypatch.setattr(cursor, 'updated_at', 0)
+    cursor.advance(100)
+    server.cache.set('network_stats', {'v': 'old'}, ttl=300, block=100)
+    assert server.get_or_load('network_stats', lambda: {'v': 'new'})[0] == {'v': 'old'}
+
+    # 出块后不返回旧数据（不做 stale-while-revalidate），同步回源
+    cursor.advance(101)
+    data, meta = server.get_or_load('network_stats', lambda: {'v': 'new'})
+    assert data == {'v': 'new'} and meta == {'cached': False}
+    assert server.cache.get_entry('network_stats')[3] == 101
+
+    # 回源失败时仍可按 stale-if-error 返回旧数据
+    cursor.advance(102)
+    def node_down():
+        raise requests.ConnectionError('node down')
+    data, meta = server.get_or_load('network_stats', node_down)
+    assert data == {'v': 'new'} and meta['stale'] is True
+
+
+def test_plan_does_not_use_stale_allowance(server, client, token_node, clock):
+    address = USER.lower()
+    # 旧数据中授权额度充足（之后链上授权已被撤销）
+    stale = server.format_balances(address, 0, 10**30, 0, 10**30, 10**30)
+    server.cache.set(f'balances_{address}', stale, ttl=30)
+    body = {'action': 'exchangeUsdtToDrm', 'from': USER, 'params': {'usdtAmount': 100}}
+    assert client.post('/api/transaction/plan', json=body).json['data']['needsApproval'] is False
+
+    # 过期但仍在 stale-while-revalidate 窗口内：重新读取
+    clock.offset = 40
+    data = client.post('/api/transaction/plan', json=body).json['data']
+    assert data['needsApproval'] is True
+    assert data['actions'][0]['action'] == 'authorizeUSDT'
@@ -0,0 +1,102 @@
+"""多 worker 部署：leader 跟踪链上状态写入共享缓存，其余 worker 读取"""
+
+import pytest
+
+from cache_backends import SharedMemoryCache
+from chain_watcher import BlockCursor, LogFollower
+from gas_oracle import GasPriceOracle
+from indexer import ChainIndexer
+
+ALICE = '0x' + 'aa' * 20
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SharedMemoryCache(str(tmp_path / 'cache.shm'), slots=64)
+
+
+def cursors(w3, store):
+    leader, follower = BlockCursor(w3), BlockCursor(w3)
+    leader.use_shared_state(store, follower=False)
+    follower.use_shared_state(store, follower=True)
+    return leader, follower
+
+
+def test_follower_cursor_reads_head_without_rpc(w3, node, store):
+    leader, follower = cursors(w3, store)
+    leader.poll_once()
+    node.posts = 0
+
+    follower.poll_once()
+    assert follower.block == node.block and follower.is_healthy()
+    assert follower.source == 'shared'
+    assert node.posts == 0
+
+
+def test_follower_cursor_falls_back_to_rpc_without_leader(w3, node, store):
+    _, follower = cursors(w3, store)
+    follower.poll_once()
+    assert follower.block == node.block
+    assert node.posts == 1
+
+
+def test_follower_log_invalidation_from_shared_state(w3, store):
+    leader_cursor, follower_cursor = cursors(w3, store)
+    leader = LogFollower(w3, leader_cursor, [], lambda touched, block: None, namespaces=('balances',))
+    follower = LogFollower(w3, follower_cursor, [], lambda touched, block: None, namespaces=('balances',))
+    leader.use_shared_state(store, follower=False, ttl=300)
+    follower.use_shared_state(store, follower=True, ttl=300)
+
+    leader_cursor.advance(100)
+    follower_cursor.poll_once()
+    # 没有共享记录时按每个区块失效
+    assert follower.invalidation_block(f'balances_{ALICE}') is None
+
+    leader.address_blocks[ALICE] = 99
+    store.set('log_block_' + ALICE, 99, ttl=300)
+    store.set('log_follower_block', 100, ttl=300)
+    follower._shared_block = (0, 0)
+    assert follower.is_healthy()
+    assert follower.invalidation_block(f'balances_{ALICE}') == 99
+    # 没有该地址的共享记录（可能已被淘汰）：按每个区块失效，而不是视为从未变化
+    assert follower.invalidation_block(f'balances_0x{"bb" * 20}') is None
+    follower_cursor.set_invalidation(follower.invalidation_block)
+    assert follower_cursor.is_current(f'balances_{ALICE}', 99)
+    assert not follower_cursor.is_current(f'balances_0x{"bb" * 20}', 99)
+
+
+def test_follower_gas_oracle_reads_shared_price(w3, node, store):
+    leader, follower = GasPriceOracle(w3, fee_history_blocks=0), GasPriceOracle(w3, fee_history_blocks=0)
+    leader.use_shared_state(store, follower=False)
+    follower.use_shared_state(store, follower=True)
+    leader.refresh(100)
+    node.posts = 0
+
+    follower.start()  # 不在后台刷新
+    assert follower.gas_price() == 10**9
+    assert follower.block == 100
+    assert node.posts == 0
+
+
+def test_indexer_follower_reads_progress_from_database(w3, node, token, tmp_path):
+    db_path = str(tmp_path / 'index.db')
+    writer = ChainIndexer(w3, token, db_path, start_block=node.block)
+    writer.index_range = lambda from_block, to_block, miners, users: setattr(writer, 'processed_block', to_block)
+    reader = ChainIndexer(w3, token, db_path)
+    reader.follow()
+    assert not reader.is_ready()
+
+    writer.step()
+    writer._set_meta('processed_block', writer.processed_block)
+    writer._writer.commit()
+    assert reader.is_ready()
+
+
+def test_only_one_leader(tmp_path):
+    import serve
+    path = str(tmp_path / 'leader.lock')
+    assert serve.acquire_leadership(path)
+    # 同一锁文件的另一次 open 相当于另一个 worker
+    saved = serve._leader_lock
+    assert not serve.acquire_leadership(path)
+    assert serve._leader_lock == saved
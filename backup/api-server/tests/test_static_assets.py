@@ -0,0 +1,81 @@
+import pytest
+from flask import Flask
+
+from static_assets import IMMUTABLE_MAX_AGE, StaticAssets
+
+PAGE = b'<html>' + b'dreamle ' * 400 + b'</html>'
+
+
+@pytest.fixture
+def site(tmp_path):
+    root = tmp_path / 'public'
+    for relpath, data in {
+        'index.html': PAGE,
+        'js/app.3f9a2c1d.js': b'console.log(1);' * 100,
+        'js/app.js': b'console.log(2);' * 100,
+        'big.js': b'x' * 5000,
+        '.env': b'SECRET=1',
+        '.git/config': b'[core]',
+        'js/.cache/old.js': b'old',
+        'backup/api-server-v2.py': b'source',
+        'dreamle-index.db': b'sqlite',
+        'dreamle-index.db-wal': b'wal',
+    }.items():
+        path = root / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    db = str(root / 'dreamle-index.db')
+    assets = StaticAssets(
+        str(root), str(tmp_path / 'cache'), max_size=4096, exclude_dirs=('backup',),
+        exclude_files=[db, db + '-wal', db + '-shm']
+    )
+    assets.precompress()
+
+    app = Flask(__name__, static_folder=None)
+
+    @app.route('/<path:path>')
+    def serve_static(path):
+        response = assets.send(path)
+        return response if response is not None else ('File not found', 404)
+
+    return assets, app.test_client()
+
+
+def test_startup_scan_skips_filtered_files(site):
+    assets, client = site
+    names = sorted(path.split('public/')[1] for path in assets.entries)
+    assert names == ['index.html', 'js/app.3f9a2c1d.js', 'js/app.js']
+
+
+@pytest.mark.parametrize('path', [
+    '.env', '.git/config', 'js/.cache/old.js', 'backup/api-server-v2.py',
+    'dreamle-index.db', 'dreamle-index.db-wal', 'big.js', '../public/.env', 'missing.html'
+])
+def test_filtered_files_are_not_served(site, path):
+    assets, client = site
+    assert client.get(f'/{path}').status_code == 404
+    # 请求时不读取、不压缩被过滤的文件
+    assert len(assets.entries) == 3
+
+
+def test_public_file_is_served_compressed(site):
+    assets, client = site
+    response = client.get('/index.html', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    etag = response.headers['ETag']
+    assert client.get('/index.html', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+
+def test_only_hashed_names_are_immutable(site):
+    assets, client = site
+    hashed = client.get('/js/app.3f9a2c1d.js')
+    assert hashed.headers['Cache-Control'] == f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+
+    # ?v= 不保证与文件内容对应
+    versioned = client.get('/js/app.js?v=20250101')
+    assert versioned.status_code == 200
+    assert versioned.headers['Cache-Control'] == 'no-cache'